@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Alignment / metadata sidecar of a synthesized output.
+
+The concatenation stage records, for every char, the start and end sample of its unit in the output, the
+syllable (phone) it was read as and the unit file that was chosen; tokens get the span of their chars.
+The sidecar is a small column-oriented JSON file next to the audio (<outfile>.align.json), so lip-sync or
+captioning jobs can read the timing without loading the audio. The text of a char is the char of the
+(normalized) input, punctuation included; a pause has no syllable ("") and its unit is the silence it is read
+as (sil_200 / sil_400):
+    {"rate": 48000, "params": {...},
+     "chars":  {"text": [...], "syllable": [...], "unit": [...], "token": [...], "start": [...], "end": [...]},
+     "tokens": {"text": [...], "start": [...], "end": [...]}}
+
+Usage:
+    alignment = Alignment.load("output.wav.align.json")
+    for text, start, end in zip(alignment.char_text, alignment.char_start, alignment.char_end):
+        print(text, start / alignment.rate, end / alignment.rate)
+"""
+
+import json
+
+# Suffix of the sidecar file, appended to the output file name
+SUFFIX = ".align.json"
+
+
+class Alignment:
+    """
+    Description: Char / token sample offsets of an output, with the synthesis parameters
+    """
+
+    def __init__(self, rate, params=None):
+        self.rate = rate
+        self.params = dict(params or {})
+        # Char columns
+        self.char_text = []
+        self.char_syllable = []
+        self.char_unit = []
+        self.char_token = []
+        self.char_start = []
+        self.char_end = []
+        # Token columns
+        self.token_text = []
+        self.token_start = []
+        self.token_end = []
+
+    def add_token(self, text, start, end):
+        """Append a token, return its index"""
+        self.token_text.append(text)
+        self.token_start.append(int(start))
+        self.token_end.append(int(end))
+        return len(self.token_text) - 1
+
+    def add_char(self, text, syllable, unit, token, start, end):
+        """Append a char of the given token index"""
+        self.char_text.append(text)
+        self.char_syllable.append(syllable)
+        self.char_unit.append(unit)
+        self.char_token.append(token)
+        self.char_start.append(int(start))
+        self.char_end.append(int(end))
+
+    def extend(self, other, offset=0):
+        """
+        Description: Append another alignment (e.g. the next run of a code-switched input)
+
+        Input : The other Alignment and the sample offset of its output in this one. Its offsets are
+                converted to this alignment's rate.
+        """
+        other = other.rescaled(self.rate)
+        for key, value in other.params.items():
+            self.params.setdefault(key, value)
+        tokens = len(self.token_text)
+        for text, start, end in zip(other.token_text, other.token_start, other.token_end):
+            self.add_token(text, start + offset, end + offset)
+        for text, syllable, unit, token, start, end in zip(other.char_text, other.char_syllable, other.char_unit,
+                                                           other.char_token, other.char_start, other.char_end):
+            self.add_char(text, syllable, unit, token + tokens, start + offset, end + offset)
+
+    def rescaled(self, rate):
+        """A copy with the offsets converted to another sample rate (e.g. after resampling the output)"""
+        if rate == self.rate:
+            return self
+        scale = float(rate) / self.rate
+        convert = lambda offsets: [int(round(offset * scale)) for offset in offsets]
+        copy = Alignment(rate, self.params)
+        copy.char_text, copy.char_syllable = list(self.char_text), list(self.char_syllable)
+        copy.char_unit, copy.char_token = list(self.char_unit), list(self.char_token)
+        copy.char_start, copy.char_end = convert(self.char_start), convert(self.char_end)
+        copy.token_text = list(self.token_text)
+        copy.token_start, copy.token_end = convert(self.token_start), convert(self.token_end)
+        return copy
+
+    def to_dict(self):
+        return {"rate": self.rate, "params": self.params,
+                "chars": {"text": self.char_text, "syllable": self.char_syllable, "unit": self.char_unit,
+                          "token": self.char_token, "start": self.char_start, "end": self.char_end},
+                "tokens": {"text": self.token_text, "start": self.token_start, "end": self.token_end}}
+
+    @classmethod
+    def from_dict(cls, info):
+        alignment = cls(info["rate"], info.get("params"))
+        chars, tokens = info["chars"], info["tokens"]
+        alignment.char_text, alignment.char_syllable = chars["text"], chars["syllable"]
+        alignment.char_unit, alignment.char_token = chars["unit"], chars["token"]
+        alignment.char_start, alignment.char_end = chars["start"], chars["end"]
+        alignment.token_text, alignment.token_start, alignment.token_end = tokens["text"], tokens["start"], tokens["end"]
+        return alignment
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(self.to_dict(), ensure_ascii=False, separators=(",", ":")))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.loads(f.read()))
+
+    def __len__(self):
+        return len(self.char_text)
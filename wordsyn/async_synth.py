@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Asyncio API around the Sequence -> unit loading -> concatenation pipeline of word_syn.py,
+for embedding the TTS in an asyncio service without stalling the event loop.
+
+    - The frontend (Sequence) and concatenation stages are CPU-bound and run on a configurable executor
+    - The unit files of a request are read concurrently on an I/O thread pool
+    - A semaphore bounds the number of requests in flight, later requests wait (backpressure)
+    - Every request can have a timeout, and cancelling the awaiting task abandons the request
+    - stream() is an async iterator of audio chunks, rendered sentence by sentence, so a client starts
+      receiving audio after the first sentence and a slow client only holds back its own request
+
+Usage:
+    tts = AsyncSynthesizer(max_concurrency=4)
+    rate, data = await tts.synthesize("今日天氣好好。", language="c", timeout=10)
+    async for chunk in tts.stream(long_text, language="p"):
+        await websocket.send(chunk.tobytes())
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import word_syn
+import simpleaudio
+
+# Default number of samples per streamed chunk
+STREAM_CHUNK = 4096
+
+
+class AsyncSynthesizer:
+    """
+    Description: Bounded-concurrency asyncio front end of the Chinese synthesizer
+    """
+
+    def __init__(self, executor=None, max_concurrency=4, io_workers=8, timeout=None):
+        """
+        Input : executor        - executor for the CPU-bound stages (default: the event loop's default executor)
+                max_concurrency - maximum number of requests synthesized at the same time
+                io_workers      - threads reading unit files
+                timeout         - default per-request timeout in seconds (None: no timeout)
+        """
+        self.executor = executor
+        self.io_executor = ThreadPoolExecutor(max_workers=io_workers)
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        # Created lazily so the semaphore belongs to the running event loop
+        self.semaphore = None
+
+    def get_semaphore(self):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self.semaphore
+
+    async def run_cpu(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def load_units(self, inputseq, voice, words=True):
+        """Read the unit files of all chars (or the word unit of a token, if words is set) concurrently on the I/O thread pool"""
+        loop = asyncio.get_running_loop()
+        loads = []
+        for eachtoken in inputseq.tokens:
+            loader = word_syn.word_loader(eachtoken, voice) if words else None
+            if loader is not None:
+                loads.append(loop.run_in_executor(self.io_executor, loader))
+            else:
+                loads.extend(loop.run_in_executor(self.io_executor, word_syn.load_unit, eachchar, voice)
+                             for eachchar in eachtoken.chars)
+        await asyncio.gather(*loads)
+
+    async def render(self, phrase, language=None, crossfade=False):
+        """One request through all stages (no concurrency limit or timeout)"""
+        inputseq, voice = await self.run_cpu(word_syn.build_sequence, phrase, language)
+        # Word units are crossfaded, without -c every syllable is loaded on its own
+        await self.load_units(inputseq, voice, words=crossfade)
+        output = await self.run_cpu(word_syn.concatenate, inputseq, crossfade)
+        # The float32 working format is converted (dithered) once, here at the output
+        return output.rate, simpleaudio.to_int16(output.data)
+
+    async def synthesize(self, phrase, language=None, crossfade=False, timeout=None):
+        """
+        Description: Synthesize a phrase without blocking the event loop
+
+        Input : The phrase, language option (c or p, auto-select if None), crossfade option and a timeout
+                in seconds (default: the synthesizer's timeout)
+        Output: A (rate, int16 numpy array) tuple
+        NOTE  : Raises asyncio.TimeoutError when the timeout expires, work already running in an executor
+                finishes in the background but its result is dropped
+        """
+        if timeout is None:
+            timeout = self.timeout
+        async with self.get_semaphore():
+            return await asyncio.wait_for(self.render(phrase, language, crossfade), timeout)
+
+    async def stream(self, phrase, language=None, crossfade=False, chunk_size=STREAM_CHUNK, timeout=None):
+        """
+        Description: Async iterator of audio chunks, the text is rendered sentence by sentence
+
+        Input : The phrase, language option, crossfade option, samples per chunk and a per-sentence timeout
+        Output: Yields int16 numpy arrays of at most chunk_size samples (the rate is the voice output rate,
+                see word_syn.synthesize)
+        """
+        if language is None:
+            # Select the language once so every sentence uses the same voice
+            language = word_syn.check_lang(phrase)
+        for sentence in word_syn.split_sentences(phrase):
+            rate, data = await self.synthesize(sentence, language, crossfade, timeout)
+            for start in range(0, len(data), chunk_size):
+                yield data[start:start+chunk_size]
+
+    def close(self):
+        """Shut down the I/O thread pool (the CPU executor belongs to the caller)"""
+        self.io_executor.shutdown(wait=False)
+
+
+def synthesize(phrase, language=None, crossfade=False, timeout=None):
+    """Blocking helper: run one request through the async API (e.g. from a script or a test)"""
+    tts = AsyncSynthesizer(timeout=timeout)
+    try:
+        return asyncio.run(tts.synthesize(phrase, language, crossfade))
+    finally:
+        tts.close()
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Incremental lexicon build, one command for the runtime phone dictionaries
+(replaces process_phone_dict.py, process_phone_dict_perc.py, create_can_dict.py and create_can_dict2.py).
+
+Stages:
+    corpus    : (only with --corpus) count the readings of every char in a romanised corpus, the corpus is
+                cut into chunks at line boundaries and mined in parallel on all cores
+    mandarin  : phonedict_pth_withpercentage -> phonedict_dict_pth_perc
+                (all readings of a char, the most frequent first)
+    cantonese : can_finaldict_corpusAndWeb + output2.txt (the same list with the hand-added entries) and the
+                corpus counts -> phonedict_dict_can (readings seen in the corpus first, by count)
+Every stage hashes its inputs and options and is skipped when they and its outputs did not change since its
+last run (the hashes are kept in the cache folder), so a rebuild with nothing to do only reads the files.
+
+Corpus format (e.g. HKCanCor, exported once with --export-hkcancor): one token per line, the word and its
+jyutping separated by a tab, e.g. "你好<TAB>nei5 hou2". Tokens whose syllable count differs from the char
+count are skipped.
+
+Usage:
+    python3 build_lexicon.py
+    python3 build_lexicon.py --export-hkcancor hkcancor.tsv
+    python3 build_lexicon.py --corpus hkcancor.tsv --jobs 8
+    python3 build_lexicon.py --force
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from unit_index import cache_path, write_atomic
+
+# Bump when the output of a stage changes for the same inputs
+BUILD_VERSION = 1
+# Folder of the dictionary files
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+MANDARIN_SOURCE = "phonedict_pth_withpercentage"
+MANDARIN_LEXICON = "phonedict_dict_pth_perc"
+CANTONESE_SOURCES = ["can_finaldict_corpusAndWeb", "output2.txt"]
+CANTONESE_LEXICON = "phonedict_dict_can"
+
+# A reading and its percentage in phonedict_pth_withpercentage, e.g. "yi1 (54.492646%)"
+percentage_pattern = re.compile(r"([a-z]+[1-5]?)\s*\(([0-9.]+)%\)")
+# A jyutping syllable
+jyutping_pattern = re.compile(r"[a-z]+[1-6]")
+# Smallest corpus chunk given to one worker
+MIN_CHUNK = 1 << 20
+
+
+def file_digest(path):
+    """SHA-1 of a file's content"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def add_reading(lexicon, char, reading):
+    """Append a reading to a char (no duplicates, the first reading is the one used at runtime)"""
+    readings = lexicon.setdefault(char, [])
+    if reading not in readings:
+        readings.append(reading)
+
+
+# (1) Stage functions
+
+def build_mandarin(source):
+    """
+    Description: Mandarin lexicon from the per-char reading percentages
+
+    Input : The path of phonedict_pth_withpercentage (char, count, number of readings, "yi1 (54.49%), ...")
+    Output: A dict char -> readings, sorted by percentage (most frequent first)
+    """
+    lexicon = dict([])
+    with open(source, "r", encoding="utf-8") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 4:
+                continue
+            readings = percentage_pattern.findall(fields[3])
+            # Stable sort: equal percentages keep the order of the source
+            for reading, percentage in sorted(readings, key=lambda item: -float(item[1])):
+                add_reading(lexicon, fields[0], reading)
+    return lexicon
+
+
+def build_cantonese(sources, counts=None):
+    """
+    Description: Cantonese lexicon from the char / reading lists and the corpus counts
+
+    Input : The paths of the lists ("char reading" per line, in order of preference) and optionally the corpus
+            counts (char -> {reading: count})
+    Output: A dict char -> readings
+    """
+    lexicon = dict([])
+    for source in sources:
+        with open(source, "r", encoding="utf-8") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 2:
+                    continue
+                for char in fields[0]:
+                    add_reading(lexicon, char, fields[1])
+    if counts:
+        for char, readings in lexicon.items():
+            seen = counts.get(char)
+            if seen:
+                # Readings found in the corpus first (most frequent first), then the other listed readings
+                ranked = sorted(seen, key=lambda reading: -seen[reading])
+                lexicon[char] = ranked + [reading for reading in readings if reading not in seen]
+    return lexicon
+
+
+def corpus_chunks(paths, jobs):
+    """Cut the corpus files into (path, start, end) byte ranges, about 4 per worker"""
+    chunks = []
+    for path in paths:
+        size = os.path.getsize(path)
+        step = max(size // (jobs * 4) + 1, MIN_CHUNK)
+        chunks.extend((path, start, min(start + step, size)) for start in range(0, size, step))
+    return chunks
+
+
+def mine_chunk(chunk):
+    """
+    Description: Count the (char, reading) pairs of one corpus chunk (run in a worker process)
+
+    Input : (path, start, end): the chunk owns the lines that start in (start, end], and the first line if start is 0
+    Output: A Counter of "char<TAB>reading"
+    """
+    path, start, end = chunk
+    counts = Counter()
+    with open(path, "rb") as f:
+        f.seek(start)
+        if start:
+            # The line under the start belongs to the previous chunk
+            f.readline()
+        while f.tell() <= end:
+            line = f.readline()
+            if not line:
+                break
+            fields = line.decode("utf-8", "replace").rstrip("\r\n").split("\t")
+            if len(fields) < 2:
+                continue
+            word, syllables = fields[0].strip(), jyutping_pattern.findall(fields[1])
+            if len(word) != len(syllables):
+                continue
+            counts.update(char + "\t" + syllable for char, syllable in zip(word, syllables))
+    return counts
+
+
+def mine_corpus(paths, jobs=None):
+    """
+    Description: Count the readings of every char in the corpus files, in parallel
+
+    Input : The corpus files and the number of worker processes (default: all cores)
+    Output: A dict char -> {reading: count}
+    """
+    jobs = jobs or os.cpu_count() or 1
+    chunks = corpus_chunks(paths, jobs)
+    total = Counter()
+    if jobs == 1 or len(chunks) == 1:
+        for chunk in chunks:
+            total.update(mine_chunk(chunk))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for counts in pool.map(mine_chunk, chunks):
+                total.update(counts)
+    result = dict([])
+    for key, count in total.items():
+        char, reading = key.split("\t")
+        result.setdefault(char, dict([]))[reading] = count
+    return result
+
+
+def export_hkcancor(path):
+    """One-off export of the pycantonese HKCanCor corpus to the corpus format (word<TAB>jyutping per line)"""
+    # New user please install: pip install -U pycantonese
+    import pycantonese as pc
+    corpus = pc.hkcancor()
+    with open(path, "w", encoding="utf-8") as f:
+        if hasattr(corpus, "tokens"):
+            tokens = ((token.word, token.jyutping) for token in corpus.tokens())
+        else:
+            # Older pycantonese: (word, pos, jyutping, ...) tuples
+            tokens = ((entry[0], entry[2]) for entry in corpus.tagged_words())
+        for word, jyutping in tokens:
+            if word and jyutping:
+                f.write("{}\t{}\n".format(word, jyutping))
+
+
+# (2) Incremental build
+
+class BuildState:
+    """
+    Description: Input / output hashes of the last run of every stage (saved in the cache folder)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.stages = dict([])
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.stages = json.loads(f.read())
+
+    def key(self, name, inputs, options):
+        """Hash of a stage's inputs (content) and options"""
+        digest = hashlib.sha1(json.dumps([BUILD_VERSION, name, options], sort_keys=True).encode("utf-8"))
+        for path in inputs:
+            digest.update(file_digest(path).encode("ascii"))
+        return digest.hexdigest()
+
+    def up_to_date(self, name, key, outputs):
+        stage = self.stages.get(name)
+        if stage is None or stage["key"] != key:
+            return False
+        return all(os.path.exists(path) and file_digest(path) == stage["outputs"].get(path) for path in outputs)
+
+    def done(self, name, key, outputs):
+        self.stages[name] = {"key": key, "outputs": dict((path, file_digest(path)) for path in outputs)}
+        write_atomic(self.path, json.dumps(self.stages, indent=1))
+
+
+def run_stage(state, name, inputs, outputs, build, options=None, force=False):
+    """
+    Description: Run a stage unless its inputs, options and outputs are unchanged
+
+    Input : The build state, stage name, input and output paths, the build function (writes the outputs),
+            the stage options and whether to run it anyway
+    Output: True if the stage ran
+    """
+    key = state.key(name, inputs, options or {})
+    if not force and state.up_to_date(name, key, outputs):
+        print("{:<10} up to date".format(name))
+        return False
+    start = time.perf_counter()
+    build()
+    state.done(name, key, outputs)
+    print("{:<10} built in {:.2f} s".format(name, time.perf_counter() - start))
+    return True
+
+
+def build(in_dir=HERE, out_dir=HERE, corpus=(), jobs=None, force=False, state=None):
+    """
+    Description: Build all stages
+
+    Input : The folder of the source lists, the output folder, the corpus files, the number of corpus workers,
+            whether to rebuild everything and optionally the build state
+    Output: The names of the stages that ran
+    """
+    state = state or BuildState(cache_path("lexicon_build.json", out_dir))
+    ran = []
+    counts_path = cache_path("corpus_counts.json", out_dir)
+    corpus = [os.path.abspath(path) for path in corpus]
+
+    def corpus_stage():
+        write_atomic(counts_path, json.dumps(mine_corpus(corpus, jobs)))
+    if corpus and run_stage(state, "corpus", corpus, [counts_path], corpus_stage, force=force):
+        ran.append("corpus")
+
+    mandarin_source = os.path.join(in_dir, MANDARIN_SOURCE)
+    mandarin_lexicon = os.path.join(out_dir, MANDARIN_LEXICON)
+    def mandarin_stage():
+        write_atomic(mandarin_lexicon, json.dumps(build_mandarin(mandarin_source)))
+    if run_stage(state, "mandarin", [mandarin_source], [mandarin_lexicon], mandarin_stage, force=force):
+        ran.append("mandarin")
+
+    cantonese_sources = [os.path.join(in_dir, name) for name in CANTONESE_SOURCES if os.path.exists(os.path.join(in_dir, name))]
+    cantonese_lexicon = os.path.join(out_dir, CANTONESE_LEXICON)
+    def cantonese_stage():
+        counts = None
+        if corpus:
+            with open(counts_path, "r", encoding="utf-8") as f:
+                counts = json.loads(f.read())
+        write_atomic(cantonese_lexicon, json.dumps(build_cantonese(cantonese_sources, counts)))
+    inputs = cantonese_sources + ([counts_path] if corpus else [])
+    if run_stage(state, "cantonese", inputs, [cantonese_lexicon], cantonese_stage, force=force):
+        ran.append("cantonese")
+    return ran
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the runtime phone dictionaries (only the stages whose inputs changed).')
+    parser.add_argument('--in-dir', dest="in_dir", default=HERE, help="Folder of the source lists")
+    parser.add_argument('--out-dir', dest="out_dir", default=HERE, help="Folder of the built dictionaries")
+    parser.add_argument('--corpus', nargs="*", default=[], help="Corpus files (word<TAB>jyutping per line) to rank the Cantonese readings")
+    parser.add_argument('--jobs', '-j', default=None, type=int, help="Worker processes mining the corpus (default: all cores)")
+    parser.add_argument('--force', action="store_true", default=False, help="Rebuild every stage")
+    parser.add_argument('--export-hkcancor', dest="export_hkcancor", default=None,
+                        help="Export the pycantonese HKCanCor corpus to this file and exit")
+    args = parser.parse_args()
+
+    if args.export_hkcancor != None:
+        export_hkcancor(args.export_hkcancor)
+        sys.exit()
+    start = time.perf_counter()
+    build(args.in_dir, args.out_dir, args.corpus, args.jobs, args.force)
+    print("Done in {:.2f} s".format(time.perf_counter() - start))
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Compiled, memory-mappable CMUdict for the English diphone synthesizer.
+
+nltk's cmudict.dict() parses the whole dictionary into Python lists (~130k entries) on every run.
+Here the dictionary is compiled once into flat NumPy arrays saved as .npy files in the cache folder,
+and later runs just memory-map them, so loading is a constant cost and a lookup is a binary search.
+
+Layout (all arrays in CACHE_DIR/cmudict/):
+    words.npy      : sorted byte strings, one per word
+    word_start.npy : int32, pronunciations of word i are rows word_start[i]:word_start[i+1]
+                     (the first row is the primary pronunciation, the rest are the alternates)
+    pron_start.npy : int32, phones of pronunciation j are phones[pron_start[j]:pron_start[j+1]]
+    phones.npy     : uint8 phone ids, see "phones" in meta.json for the symbols
+    meta.json      : phone symbols and the size/mtime of the source file (to invalidate the cache)
+"""
+
+import os
+import json
+import numpy as np
+
+from unit_index import cache_path, write_atomic
+
+# Bump when the layout of the compiled files changes
+COMPILED_VERSION = 1
+ARRAYS = ("words", "word_start", "pron_start", "phones")
+
+
+def source_path():
+    """Path to nltk's raw cmudict file (downloaded if the user does not have it yet)"""
+    import nltk
+    from nltk.corpus import cmudict
+    try:
+        return str(cmudict.abspath("cmudict"))
+    except LookupError:
+        nltk.download("cmudict")
+        return str(cmudict.abspath("cmudict"))
+
+
+def source_stamp(path):
+    """Path, size and mtime of the source file, stored with the compiled arrays to detect a newer copy"""
+    stat = os.stat(path)
+    return [path, stat.st_size, stat.st_mtime_ns]
+
+
+def compile_cmudict(folder, pron_dict=None):
+    """
+    Description: Compile a pronunciation dictionary to the flat array layout
+
+    Input : Output folder, and optionally a {word: [[phones], ...]} dict (default: nltk's cmudict.dict())
+    Output: None, the arrays and meta.json are written to the folder
+    """
+    stamp = None
+    if pron_dict is None:
+        from nltk.corpus import cmudict
+        stamp = source_stamp(source_path())
+        pron_dict = cmudict.dict()
+
+    symbols = sorted(set(phone for prons in pron_dict.values() for pron in prons for phone in pron))
+    assert len(symbols) < 256, "Too many phone symbols for uint8 ids"
+    symbol_id = dict((symbol, i) for i, symbol in enumerate(symbols))
+
+    words = sorted(pron_dict)
+    word_start = [0]
+    pron_start = [0]
+    phones = []
+    for word in words:
+        for pron in pron_dict[word]:
+            phones.extend(symbol_id[phone] for phone in pron)
+            pron_start.append(len(phones))
+        word_start.append(len(pron_start) - 1)
+
+    os.makedirs(folder, exist_ok=True)
+    np.save(os.path.join(folder, "words.npy"), np.array([w.encode("utf-8") for w in words]))
+    np.save(os.path.join(folder, "word_start.npy"), np.array(word_start, dtype=np.int32))
+    np.save(os.path.join(folder, "pron_start.npy"), np.array(pron_start, dtype=np.int32))
+    np.save(os.path.join(folder, "phones.npy"), np.array(phones, dtype=np.uint8))
+    # meta.json is written last: its presence marks a complete compile
+    write_atomic(os.path.join(folder, "meta.json"),
+                 json.dumps({"version": COMPILED_VERSION, "phones": symbols, "source": stamp}))
+
+
+class CompiledCMUdict:
+    """
+    Description: Read-only view of a compiled dictionary, looked up like cmudict.dict()
+    e.g. pron_dict["hello"][0] -> ['HH', 'AH0', 'L', 'OW1']
+    """
+
+    def __init__(self, folder):
+        with open(os.path.join(folder, "meta.json"), "r") as f:
+            self.meta = json.loads(f.read())
+        self.symbols = self.meta["phones"]
+        # Memory-map the arrays: only the pages touched by lookups are ever read from disk
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(folder, name + ".npy"), mmap_mode="r"))
+
+    def find(self, word):
+        """Index of a word in the sorted word array, or -1 if it is not in the dictionary"""
+        key = word.encode("utf-8")
+        index = int(np.searchsorted(self.words, key))
+        if index < len(self.words) and self.words[index] == key:
+            return index
+        return -1
+
+    def pron(self, row):
+        return [self.symbols[i] for i in self.phones[self.pron_start[row]:self.pron_start[row+1]]]
+
+    def first(self, word):
+        """Primary pronunciation of a word, raise KeyError if it is not in the dictionary"""
+        index = self.find(word)
+        if index < 0:
+            raise KeyError(word)
+        return self.pron(self.word_start[index])
+
+    def __getitem__(self, word):
+        """All pronunciations of a word (primary first), raise KeyError if it is not in the dictionary"""
+        index = self.find(word)
+        if index < 0:
+            raise KeyError(word)
+        return [self.pron(row) for row in range(self.word_start[index], self.word_start[index+1])]
+
+    def __contains__(self, word):
+        return self.find(word) >= 0
+
+    def __len__(self):
+        return len(self.words)
+
+
+# Lazily loaded shared instance
+_cmudict = None
+
+
+def load_cmudict(folder=None):
+    """
+    Description: Load the compiled CMUdict, compiling it first if it is missing or older than nltk's copy
+
+    Input : Optional folder of the compiled arrays (default: CACHE_DIR/cmudict)
+    Output: A CompiledCMUdict instance (shared between calls)
+    """
+    global _cmudict
+    if _cmudict is not None:
+        return _cmudict
+    if folder is None:
+        folder = cache_path("cmudict")
+    try:
+        compiled = CompiledCMUdict(folder)
+        assert compiled.meta["version"] == COMPILED_VERSION
+        # Validate with a single stat of the recorded source file (no nltk import on the fast path),
+        # a removed source keeps the compiled copy usable
+        stamp = compiled.meta["source"]
+        if stamp is not None and os.path.exists(stamp[0]):
+            assert source_stamp(stamp[0]) == stamp
+    except (OSError, ValueError, KeyError, AssertionError):
+        compile_cmudict(folder)
+        compiled = CompiledCMUdict(folder)
+    _cmudict = compiled
+    return _cmudict
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Code-switching front end for mixed Chinese / English input.
+
+The input is split into runs of Chinese text and runs of English words (e.g. "我用iPhone拍照" ->
+[("zh", "我用"), ("en", "iPhone"), ("zh", "拍照")]). Each run goes to its own synthesizer, the runs
+are rendered concurrently in a worker pool, resampled to a common rate and stitched in order, so a
+mixed-language prompt costs about as much as its longest run.
+
+Usage:
+    runs = split_runs(text)
+    data = render_runs(runs, {CHINESE: render_chinese, ENGLISH: render_english}, rate=48000)
+"""
+
+import re
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+import simpleaudio
+import splice
+
+# Run labels
+CHINESE = "zh"
+ENGLISH = "en"
+
+# An English run: Latin words, joined by spaces, apostrophes, hyphens, dots or "&" (e.g. "Mr. O'Neil", "AT&T")
+english_pattern = re.compile(r"[A-Za-z]+(?:[\s'\-.&]*[A-Za-z]+)*")
+
+
+def split_runs(text):
+    """
+    Description: Split a code-switched input into Chinese and English runs
+
+    Input : A string that may mix Chinese and English
+    Output: A list of (label, text) tuples in their original order (whitespace-only runs are dropped)
+    """
+    runs = []
+    position = 0
+    for match in english_pattern.finditer(text):
+        runs.append((CHINESE, text[position:match.start()]))
+        runs.append((ENGLISH, match.group()))
+        position = match.end()
+    runs.append((CHINESE, text[position:]))
+    # NOTE: Spaces are not in the Chinese phone dictionaries, only keep them inside English runs
+    return [(label, run.strip()) for label, run in runs if run.strip() != ""]
+
+
+def render_runs(runs, renderers, rate, workers=4, executor=None, alignment=None):
+    """
+    Description: Render runs concurrently and stitch them in order
+
+    Input : A list of (label, text) runs, a dict of renderers (label -> function(text) returning (rate, samples),
+            or (rate, samples, alignment)), the output sample rate, the number of workers, optionally an executor
+            to use instead of a thread pool (e.g. a ProcessPoolExecutor, then the renderers must be picklable)
+            and an alignment.Alignment that the alignment of every run is appended to
+    Output: A float32 numpy array (working format, full scale 1.0) of the stitched output at the given rate
+    """
+    if len(runs) == 0:
+        return np.array([], dtype=np.float32)
+
+    # A single run (the usual pure Chinese input) or a single worker is rendered inline, no pool needed
+    if executor is None and (len(runs) == 1 or workers <= 1):
+        results = [renderers[label](run) for label, run in runs]
+    elif executor is not None:
+        results = [future.result() for future in [executor.submit(renderers[label], run) for label, run in runs]]
+    else:
+        with ThreadPoolExecutor(max_workers=min(workers, len(runs))) as pool:
+            results = [future.result() for future in [pool.submit(renderers[label], run) for label, run in runs]]
+
+    return stitch(results, rate, alignment=alignment)
+
+
+def stitch(results, rate, overlap=0, alignment=None):
+    """
+    Description: Resample rendered pieces to a common rate and join them in their original order
+
+    Input : A list of (rate, samples) or (rate, samples, alignment) results, the output sample rate, the
+            number of samples cross-faded (linear fade out / fade in) at every boundary, and optionally an
+            alignment.Alignment that the alignment of every piece is appended to
+    Output: A float32 numpy array (working format, full scale 1.0), the pieces may be of any sample type
+            (a splice.SegmentPlan if a piece is one, see splice.stitch)
+    """
+    if any(isinstance(result[1], splice.SegmentPlan) for result in results):
+        return splice.stitch(results, rate, overlap=overlap, alignment=alignment)
+    pieces = [simpleaudio.resample(simpleaudio.to_float32(result[1]), result[0], rate) for result in results]
+    if len(pieces) == 0:
+        return np.array([], dtype=np.float32)
+    output = np.zeros(sum(len(piece) for piece in pieces), dtype=np.float32)
+    ramp = np.arange(overlap) / float(overlap) if overlap else None
+    offset = 0
+    for index, (result, piece) in enumerate(zip(results, pieces)):
+        piece = np.asarray(piece, dtype=np.float32)
+        # Overlap the start of this piece with the end of the previous one (both long enough to fade)
+        if overlap and index > 0 and len(piece) > overlap and offset > overlap:
+            piece = piece.copy()
+            piece[:overlap] *= ramp
+            output[offset - overlap:offset] *= ramp[::-1]
+            offset -= overlap
+        output[offset:offset + len(piece)] += piece
+        if alignment is not None and len(result) > 2 and result[2] is not None:
+            alignment.extend(result[2], offset)
+        offset += len(piece)
+    return output[:offset]
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Incremental re-synthesis of an edited document (word_syn.py --document <folder>).
+
+A document is rendered sentence by sentence. The audio (float32, before the effects and the volume control)
+and the alignment of every sentence are kept in a folder, keyed by a hash of the normalized sentence and of
+the options that change its audio (language, voice, crossfade, intonation, speed, sandhi):
+    <key>.npy        : float32 samples of the sentence at the output rate
+    <key>.json       : its alignment (see alignment.py)
+    document.json    : the previous render, its sentences in order with their key and [start, end] sample
+                       offsets in the output
+On the next version of the document only the sentences whose key is not in the folder are rendered. The
+output is spliced again from the sentences in their new order, so the crossfade at every sentence boundary
+is recomputed from the sentence audio (a sentence next to an edit gets a new boundary, not the old fade).
+The effects and the volume control are applied to the whole output afterwards, as for a normal render.
+The audio of sentences the new version no longer uses is removed from the folder (only the files named by a
+sentence key, so other files in the folder are left alone).
+
+Usage:
+    python3 word_syn.py -f chapter.txt -l p -c -o chapter.wav --document chapter.sentences
+    (edit chapter.txt)
+    python3 word_syn.py -f chapter.txt -l p -c -o chapter.wav --document chapter.sentences
+"""
+
+import os
+import re
+import json
+import hashlib
+
+import numpy as np
+
+import alignment
+import code_switch
+from unit_index import write_atomic
+
+# Bump when the audio or the alignment of a sentence changes for the same text and options (e.g. a new frontend rule)
+# 2: the alignment keeps the punctuation chars (the pause they are read as is only in the unit column)
+DOCUMENT_VERSION = 2
+MANIFEST = "document.json"
+# Names of the files of a sentence: its sha1 key (nothing else in the folder is ever removed)
+KEY_NAME = re.compile(r"^[0-9a-f]{40}\.(npy|json)$")
+
+
+def normalize_sentence(sentence):
+    """A sentence with its whitespace collapsed (re-wrapping a paragraph does not change its sentences)"""
+    return " ".join(sentence.split())
+
+
+def sentence_key(sentence, options):
+    """
+    Description: Cache key of a sentence
+
+    Input : The sentence and a dict of the synthesis options that change its audio
+    Output: A hex digest of the normalized sentence and the options
+    """
+    text = json.dumps([DOCUMENT_VERSION, normalize_sentence(sentence), options], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class SentenceCache:
+    """
+    Description: The folder with the audio and alignment of the sentences of the previous render
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, key, suffix):
+        return os.path.join(self.folder, key + suffix)
+
+    def __contains__(self, key):
+        return os.path.exists(self.path(key, ".npy")) and os.path.exists(self.path(key, ".json"))
+
+    def load(self, key):
+        """(rate, float32 samples (memory-mapped), alignment) of a sentence"""
+        timing = alignment.Alignment.load(self.path(key, ".json"))
+        return timing.rate, np.load(self.path(key, ".npy"), mmap_mode="r"), timing
+
+    def store(self, key, rate, data, timing):
+        """Keep the audio and alignment of a rendered sentence (temp file + rename, like write_atomic)"""
+        tmp = "{}.{}.tmp".format(self.path(key, ".npy"), os.getpid())
+        with open(tmp, "wb") as f:
+            np.save(f, np.asarray(data, dtype=np.float32))
+        os.replace(tmp, self.path(key, ".npy"))
+        write_atomic(self.path(key, ".json"), json.dumps(timing.rescaled(rate).to_dict(), ensure_ascii=False))
+
+    def previous(self):
+        """The manifest of the previous render, None if there is none (or it is from another version)"""
+        try:
+            with open(os.path.join(self.folder, MANIFEST), "r", encoding="utf-8") as f:
+                info = json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        return info if info.get("version") == DOCUMENT_VERSION else None
+
+    def save(self, rate, sentences):
+        """Save the manifest of this render: [text, key, start, end] for every sentence in order"""
+        write_atomic(os.path.join(self.folder, MANIFEST),
+                     json.dumps({"version": DOCUMENT_VERSION, "rate": rate, "sentences": sentences}, ensure_ascii=False))
+
+    def prune(self, keys):
+        """Remove the sentences that are not in keys, return how many were removed (only files named by a key)"""
+        removed = 0
+        for name in os.listdir(self.folder):
+            key, suffix = os.path.splitext(name)
+            if KEY_NAME.match(name) and key not in keys:
+                os.remove(os.path.join(self.folder, name))
+                removed += suffix == ".npy"
+        return removed
+
+
+def changed_spans(previous, sentences):
+    """
+    Description: The spans of the new output that differ from the previous render
+
+    Input : The manifest of the previous render (or None) and the [text, key, start, end] of the new sentences
+    Output: A list of [start, end] sample offsets in the new output (consecutive changed sentences are merged)
+    """
+    old = set(entry[1] for entry in previous["sentences"]) if previous else set()
+    spans = []
+    for text, key, start, end in sentences:
+        if key in old:
+            continue
+        if spans and spans[-1][1] >= start:
+            spans[-1][1] = end
+        else:
+            spans.append([start, end])
+    return spans
+
+
+def render_document(sentences, render_each, options, cache, rate, overlap=0, timing=None):
+    """
+    Description: Render the sentences of a document that are not in the cache and splice the output
+
+    Input : The sentences in order, a renderer (list of sentences -> yields (rate, samples, alignment) in
+            order, see word_syn.render_each), the options of the sentence keys, the SentenceCache, the output
+            sample rate, the crossfade at sentence boundaries and optionally an Alignment that the char / token
+            offsets of the output are appended to
+    Output: The float32 output, the number of rendered sentences and the changed [start, end] spans
+    """
+    keys = [sentence_key(sentence, options) for sentence in sentences]
+    # Each sentence text is rendered once, even when it appears several times in the document
+    missing = dict([])
+    for sentence, key in zip(sentences, keys):
+        if key not in cache and key not in missing:
+            missing[key] = sentence
+    for key, (sentence_rate, data, sentence_timing) in zip(list(missing), render_each(list(missing.values()))):
+        cache.store(key, sentence_rate, data, sentence_timing)
+
+    # Splice every sentence again, the boundary crossfades are recomputed from the sentence audio
+    results = [cache.load(key) for key in keys]
+    output = code_switch.stitch(results, rate, overlap=overlap, alignment=timing)
+
+    # Sample offsets of every sentence in the output (the same overlaps as code_switch.stitch)
+    entries, position = [], 0
+    for sentence, key, (sentence_rate, data, sentence_timing) in zip(sentences, keys, results):
+        length = len(data) if sentence_rate == rate else int(round(len(data) * float(rate) / sentence_rate))
+        start = position - overlap if overlap and length > overlap and position > overlap else position
+        entries.append([sentence, key, start, start + length])
+        position = start + length
+    spans = changed_spans(cache.previous(), entries)
+    cache.save(rate, entries)
+    cache.prune(set(keys))
+    return output, len(missing), spans
@@ -0,0 +1,526 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Block-based streaming effects chain (float32 working format, full scale 1.0).
+
+Every effect processes the audio block by block and carries its state (filter memory, delay line,
+reverb input spectra) from one block to the next, so an effect costs a constant amount of memory and
+never needs the whole output. An effect may hold samples back (e.g. the reverb waits for a full FFT
+partition, the fade-out keeps its last samples until it knows where the stream ends): it then returns
+fewer samples at first and the held ones from flush(), so the output is never shifted in time, only
+delayed by a constant latency. flush() also returns the tail (echo repeats, reverb decay).
+
+    gain     : fixed gain in dB
+    fade     : fade in at the start / fade out at the end of the stream
+    echo     : delay line with decaying repeats
+    reverb   : FFT convolution with an impulse response (uniformly partitioned overlap-save)
+    highpass : one-pole high-pass filter (also a DC blocker at a low cutoff)
+    loudness : loudness normalisation to a target in LUFS (gated, BS.1770-style K-weighted measure)
+    limiter  : look-ahead peak limiter
+
+Usage:
+    chain = parse_chain("highpass:80,echo:0.25:0.4,reverb:1.0:0.2,gain:-3", rate=48000)
+    for chunk in chunks:
+        writer.write(chain.process(chunk))
+    writer.write(chain.flush())
+    # or: writer = EffectWriter(chain, writer)
+"""
+
+import os
+import numpy as np
+
+import simpleaudio
+
+# Largest block processed in one go by the chain
+BLOCK_SIZE = 4096
+# FFT partition of the reverb (its latency, in samples)
+PARTITION = 1024
+
+
+def empty():
+    return np.zeros(0, dtype=np.float32)
+
+
+class Effect:
+    """
+    Description: Base class of an effect node: float32 blocks in, float32 blocks out
+    """
+    # Samples held back before the first output
+    latency = 0
+    # Samples added after the end of the input by flush()
+    tail = 0
+
+    def process(self, block):
+        """One block of input -> the output that is ready (any length)"""
+        return block
+
+    def flush(self):
+        """End of the stream: the held samples and the tail"""
+        return empty()
+
+    def reset(self):
+        """Forget the state (start of a new stream)"""
+        pass
+
+
+class Gain(Effect):
+    """Fixed gain (in dB)"""
+
+    def __init__(self, db=0.0):
+        self.factor = np.float32(10.0 ** (db / 20.0))
+
+    def process(self, block):
+        return block * self.factor
+
+
+class Fade(Effect):
+    """
+    Description: Linear fade in over the first samples, fade out over the last samples of the stream
+    NOTE  : The fade out holds back its length (the end of the stream is only known at flush())
+    """
+
+    def __init__(self, fade_in=0, fade_out=0):
+        self.fade_in = int(fade_in)
+        self.fade_out = int(fade_out)
+        self.latency = self.fade_out
+        self.reset()
+
+    def reset(self):
+        self.position = 0
+        self.held = empty()
+
+    def process(self, block):
+        if self.position < self.fade_in:
+            # Fade in the part of the block that is still in the ramp
+            count = min(self.fade_in - self.position, len(block))
+            block = block.copy()
+            block[:count] *= (np.arange(self.position, self.position + count) / float(self.fade_in)).astype(np.float32)
+        self.position += len(block)
+        if self.fade_out == 0:
+            return block
+        held = np.concatenate((self.held, block))
+        self.held = held[max(len(held) - self.fade_out, 0):]
+        return held[:max(len(held) - self.fade_out, 0)]
+
+    def flush(self):
+        held, self.held = self.held, empty()
+        if len(held) == 0:
+            return held
+        # The ramp ends at 0 on the last sample, even if the stream is shorter than the fade
+        ramp = np.arange(len(held), 0, -1) / float(max(self.fade_out, len(held)))
+        return held * ramp.astype(np.float32)
+
+
+class Echo(Effect):
+    """
+    Description: Delay line with a fixed number of decaying repeats (y[n] = sum_i decay^i * x[n - i*delay])
+    """
+
+    def __init__(self, delay, decay=0.5, repeats=3):
+        self.delay = int(delay)
+        self.decay = decay
+        self.repeats = int(repeats)
+        self.tail = self.delay * self.repeats
+        self.reset()
+
+    def reset(self):
+        # The last repeats * delay input samples
+        self.history = np.zeros(self.tail, dtype=np.float32)
+
+    def process(self, block):
+        x = np.concatenate((self.history, block))
+        output = np.array(block, dtype=np.float32)
+        for i in range(1, self.repeats + 1):
+            start = self.tail - i * self.delay
+            output += np.float32(self.decay ** i) * x[start:start + len(block)]
+        self.history = x[len(x) - self.tail:]
+        return output
+
+    def flush(self):
+        tail = self.process(np.zeros(self.tail, dtype=np.float32))
+        self.reset()
+        return tail
+
+
+class Reverb(Effect):
+    """
+    Description: Convolution reverb, uniformly partitioned overlap-save
+
+    The impulse response is cut into partitions of P samples whose spectra (FFT size 2P) are computed
+    once. Every full partition of input is transformed once and kept in a frequency-domain delay line; the
+    output partition is the sum of the delay line times the IR spectra, so the cost per sample does not
+    depend on the length of the stream and the latency is P samples.
+    """
+
+    def __init__(self, ir, wet=0.3, dry=1.0, partition=PARTITION):
+        self.partition = int(partition)
+        ir = simpleaudio.to_float32(ir)
+        self.ir_length = len(ir)
+        self.wet = np.float32(wet)
+        self.dry = np.float32(dry)
+        count = max(-(-len(ir) // self.partition), 1)
+        padded = np.zeros(count * self.partition, dtype=np.float32)
+        padded[:len(ir)] = ir
+        self.spectra = np.fft.rfft(padded.reshape(count, self.partition), 2 * self.partition, axis=1)
+        self.latency = self.partition
+        self.tail = max(self.ir_length - 1, 0)
+        self.reset()
+
+    def reset(self):
+        # Input not yet forming a full partition, the previous partition, and the input spectra (newest first)
+        self.pending = empty()
+        self.previous = np.zeros(self.partition, dtype=np.float32)
+        self.delay_line = np.zeros_like(self.spectra)
+
+    def convolve(self, block):
+        """One full partition of input -> one partition of output"""
+        spectrum = np.fft.rfft(np.concatenate((self.previous, block)))
+        self.delay_line = np.roll(self.delay_line, 1, axis=0)
+        self.delay_line[0] = spectrum
+        self.previous = block
+        wet = np.fft.irfft((self.delay_line * self.spectra).sum(axis=0), 2 * self.partition)[self.partition:]
+        return block * self.dry + wet.astype(np.float32) * self.wet
+
+    def process(self, block):
+        x = np.concatenate((self.pending, block))
+        full = len(x) - len(x) % self.partition
+        self.pending = x[full:]
+        if full == 0:
+            return empty()
+        return np.concatenate([self.convolve(x[start:start + self.partition])
+                               for start in range(0, full, self.partition)])
+
+    def flush(self):
+        # Output still owed: the pending input, then the decay of the impulse response
+        owed = len(self.pending) + self.tail
+        x = np.concatenate((self.pending, np.zeros(owed - len(self.pending), dtype=np.float32)))
+        padded = np.zeros(-(-len(x) // self.partition) * self.partition, dtype=np.float32)
+        padded[:len(x)] = x
+        output = [self.convolve(padded[start:start + self.partition]) for start in range(0, len(padded), self.partition)]
+        self.reset()
+        return np.concatenate(output)[:owed] if output else empty()
+
+    @staticmethod
+    def synthetic_ir(rate, seconds=1.0, seed=0):
+        """A room-like impulse response: exponentially decaying noise (-60 dB after the given time)"""
+        length = max(int(seconds * rate), 1)
+        noise = np.random.default_rng(seed).standard_normal(length)
+        envelope = 10.0 ** (-3.0 * np.arange(length) / length)
+        ir = noise * envelope
+        return (ir / np.sqrt(np.sum(ir ** 2))).astype(np.float32)
+
+
+class HighPass(Effect):
+    """
+    Description: One-pole high-pass filter (y[n] = a * (y[n-1] + x[n] - x[n-1])), e.g. a DC blocker at 20 Hz
+
+    The recursion is evaluated in closed form on short sub-blocks (y = a^k * (y0 + cumsum(u * a^-k))), so
+    the filter runs in numpy instead of a Python loop per sample.
+    """
+
+    def __init__(self, cutoff, rate):
+        rc = 1.0 / (2 * np.pi * cutoff)
+        self.a = rc / (rc + 1.0 / rate)
+        # Sub-block length keeping a^-k well inside the float64 range
+        self.step = int(min(256, max(1, 50.0 / -np.log(self.a))))
+        self.powers = self.a ** np.arange(1, self.step + 1)
+        self.reset()
+
+    def reset(self):
+        self.last_input = 0.0
+        self.last_output = 0.0
+
+    def process(self, block):
+        x = np.asarray(block, dtype=np.float64)
+        if len(x) == 0:
+            return empty()
+        u = self.a * np.diff(x, prepend=self.last_input)
+        self.last_input = x[-1]
+        y = np.empty_like(u)
+        for start in range(0, len(u), self.step):
+            part = u[start:start + self.step]
+            powers = self.powers[:len(part)]
+            # y[k] = a^(k+1) * y_prev + sum_j a^(k-j) u[j]
+            y[start:start + len(part)] = powers * (self.last_output + np.cumsum(part / powers))
+            self.last_output = y[start + len(part) - 1]
+        return y.astype(np.float32)
+
+
+# K-weighting of ITU-R BS.1770 (high shelf + RLB high-pass), biquad coefficients at 48 kHz
+K_SHELF = ([1.53512485958697, -2.69169618940638, 1.19839281085285], [1.0, -1.69065929318241, 0.73248077421585])
+K_HIGHPASS = ([1.0, -2.0, 1.0], [1.0, -1.99004745483398, 0.99007225036621])
+# Loudness of blocks below this are not counted (absolute gate), and the relative gate below the ungated loudness
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+# Resolution of the block loudness histogram (LU), from the absolute gate up to +10 LUFS
+HISTOGRAM_STEP = 0.1
+
+
+def k_weighting(length, rate):
+    """Magnitude of the K-weighting filter at the rfft frequencies of a block (used on the block spectrum)"""
+    frequencies = np.fft.rfftfreq(length, 1.0 / rate)
+    # The 48 kHz filter evaluated at the same analogue frequencies (the response above 20 kHz does not matter)
+    z = np.exp(-2j * np.pi * np.minimum(frequencies, 24000.0) / 48000.0)
+    response = np.ones(len(frequencies), dtype=complex)
+    for b, a in (K_SHELF, K_HIGHPASS):
+        response *= (b[0] + b[1] * z + b[2] * z ** 2) / (a[0] + a[1] * z + a[2] * z ** 2)
+    return np.abs(response)
+
+
+class Loudness(Effect):
+    """
+    Description: Streaming loudness normalisation to a target in LUFS
+
+    The audio is measured in windows of 400 ms (K-weighted mean square, as in BS.1770). The loudness of every
+    window goes into a fixed histogram, and the integrated loudness so far is read from it with the
+    absolute (-70 LUFS) and relative (-10 LU) gates, so pauses do not pull the level up and the memory does
+    not grow with the stream. Each window is output with the gain that brings the integrated loudness to the
+    target, ramped from the gain of the previous window (no steps). The first window is measured before it is
+    output, so the gain is right from the first sample: the latency is one window. The shorter last window
+    of a stream is weighted by its length in the histogram (a few samples do not count as a whole window).
+    """
+
+    def __init__(self, target, rate, window=0.4, max_gain=20.0):
+        self.target = target
+        self.window = max(int(window * rate), 1)
+        self.max_gain = max_gain
+        self.weights = k_weighting(self.window, rate) ** 2
+        self.latency = self.window
+        self.reset()
+
+    def reset(self):
+        self.pending = empty()
+        self.histogram = np.zeros(int((10.0 - ABSOLUTE_GATE) / HISTOGRAM_STEP) + 1)
+        self.energy = np.zeros_like(self.histogram)
+        self.gain = None
+
+    def measure(self, block):
+        """K-weighted loudness (LUFS) of a block, added to the histogram (weighted by its length) if it passes the absolute gate"""
+        spectrum = np.fft.rfft(block, self.window)
+        # Parseval: mean square of the filtered block
+        power = (np.abs(spectrum) ** 2 * self.weights)
+        mean_square = (2 * power.sum() - power[0] - (power[-1] if self.window % 2 == 0 else 0)) / (self.window * len(block))
+        loudness = -0.691 + 10 * np.log10(max(mean_square, 1e-20))
+        if loudness > ABSOLUTE_GATE:
+            index = min(int((loudness - ABSOLUTE_GATE) / HISTOGRAM_STEP), len(self.histogram) - 1)
+            weight = len(block) / float(self.window)
+            self.histogram[index] += weight
+            self.energy[index] += mean_square * weight
+        return loudness
+
+    def integrated(self):
+        """Gated integrated loudness of the stream so far (None before the first loud enough block)"""
+        if self.histogram.sum() == 0:
+            return None
+        ungated = -0.691 + 10 * np.log10(self.energy.sum() / self.histogram.sum())
+        first = max(int((ungated + RELATIVE_GATE - ABSOLUTE_GATE) / HISTOGRAM_STEP), 0)
+        count = self.histogram[first:].sum()
+        if count == 0:
+            return ungated
+        return -0.691 + 10 * np.log10(self.energy[first:].sum() / count)
+
+    def apply(self, block):
+        self.measure(block)
+        loudness = self.integrated()
+        gain = 0.0 if loudness is None else min(self.target - loudness, self.max_gain)
+        previous = gain if self.gain is None else self.gain
+        self.gain = gain
+        ramp = np.linspace(previous, gain, len(block), endpoint=False) if len(block) > 1 else np.array([gain])
+        return block * (10.0 ** (ramp / 20.0)).astype(np.float32)
+
+    def process(self, block):
+        x = np.concatenate((self.pending, block))
+        full = len(x) - len(x) % self.window
+        self.pending = x[full:]
+        if full == 0:
+            return empty()
+        return np.concatenate([self.apply(x[start:start + self.window]) for start in range(0, full, self.window)])
+
+    def flush(self):
+        pending = self.pending
+        output = self.apply(pending) if len(pending) else empty()
+        self.reset()
+        return output
+
+
+class Limiter(Effect):
+    """
+    Description: Look-ahead peak limiter (no sample over the ceiling, no hard clipping)
+
+    The gain needed by every sample (ceiling / |x|, at most 1) is taken as the minimum over the look-ahead and a
+    hold time, then smoothed by a moving average over the look-ahead: the gain is already down when a peak
+    arrives and comes back up after the hold. All of it is sliding minimums / sums over the block, the latency
+    is the look-ahead.
+    """
+
+    def __init__(self, rate, ceiling=-1.0, lookahead=0.005, hold=0.05):
+        self.ceiling = 10.0 ** (ceiling / 20.0)
+        self.lookahead = max(int(lookahead * rate), 1)
+        self.hold = int(hold * rate)
+        self.latency = self.lookahead
+        self.reset()
+
+    def reset(self):
+        # Input not yet output (the look-ahead), the needed gain of the hold samples before it and of the
+        # held input, and the last minimums (for the moving average, None at the start of a stream)
+        self.pending = empty()
+        self.needed = np.ones(self.hold, dtype=np.float32)
+        self.minimums = None
+
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float32)
+        x = np.concatenate((self.pending, block))
+        peaks = np.abs(block)
+        needed = np.concatenate((self.needed, np.minimum(1.0, self.ceiling / np.maximum(peaks, 1e-9)).astype(np.float32)))
+        count = len(x) - self.lookahead
+        if count <= 0:
+            self.pending, self.needed = x, needed
+            return empty()
+        # Minimum over [n - hold, n + lookahead] for every output sample n
+        span = self.hold + self.lookahead + 1
+        minimums = np.lib.stride_tricks.sliding_window_view(needed[:count + span - 1], span).min(axis=1)
+        # Moving average over [n - lookahead, n]; before the stream starts the first minimum stands in, as it
+        # covers the first look-ahead samples too
+        if self.minimums is None:
+            self.minimums = np.full(self.lookahead, minimums[0], dtype=np.float32)
+        history = np.concatenate((self.minimums, minimums))
+        sums = np.cumsum(np.concatenate(([0.0], history)))
+        gain = (sums[self.lookahead + 1:] - sums[:-self.lookahead - 1]) / (self.lookahead + 1)
+        self.minimums = history[len(history) - self.lookahead:]
+        self.pending = x[count:]
+        self.needed = needed[count:]
+        return x[:count] * gain.astype(np.float32)
+
+    def flush(self):
+        # Push the look-ahead out with silence (which needs no gain reduction)
+        output = self.process(np.zeros(self.lookahead, dtype=np.float32))
+        self.reset()
+        return output
+
+
+def loudness_chain(target, rate, ceiling=-1.0):
+    """Streaming volume control: loudness normalisation to the target (LUFS) followed by the peak limiter"""
+    return EffectsChain([Loudness(target, rate), Limiter(rate, ceiling)])
+
+
+class EffectsChain:
+    """
+    Description: Effects applied in order, on blocks of at most block_size samples
+    """
+
+    def __init__(self, effects=(), block_size=BLOCK_SIZE):
+        self.effects = list(effects)
+        self.block_size = block_size
+
+    @property
+    def latency(self):
+        return sum(effect.latency for effect in self.effects)
+
+    def run(self, block, first=0):
+        for effect in self.effects[first:]:
+            block = effect.process(block)
+        return block
+
+    def process(self, chunk):
+        """A chunk of any length and type -> the float32 output that is ready"""
+        x = simpleaudio.to_float32(chunk)
+        output = [self.run(x[start:start + self.block_size]) for start in range(0, len(x), self.block_size)]
+        return np.concatenate(output) if output else empty()
+
+    def flush(self):
+        """End of the stream: the samples held by every effect and their tails, through the effects after it"""
+        output = []
+        for index, effect in enumerate(self.effects):
+            tail = effect.flush()
+            for start in range(0, len(tail), self.block_size):
+                output.append(self.run(tail[start:start + self.block_size], index + 1))
+        return np.concatenate(output) if output else empty()
+
+    def reset(self):
+        for effect in self.effects:
+            effect.reset()
+
+    def apply(self, data):
+        """Run a whole array through the chain (still block by block) and return the output with its tail"""
+        output = self.process(data)
+        tail = self.flush()
+        return np.concatenate((output, tail)) if len(tail) else output
+
+
+class EffectWriter:
+    """
+    Description: A writer (e.g. an encoders.Encoder) with an effects chain in front of it
+    """
+
+    def __init__(self, chain, writer):
+        self.chain = chain
+        self.writer = writer
+
+    def write(self, data):
+        return self.writer.write(self.chain.process(data))
+
+    def close(self):
+        if self.chain is not None:
+            self.writer.write(self.chain.flush())
+            self.chain = None
+        self.writer.close()
+
+    def __getattr__(self, name):
+        # out_rate, bytes_written... of the wrapped writer
+        return getattr(self.writer, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def parse_chain(spec, rate, block_size=BLOCK_SIZE):
+    """
+    Description: Build an effects chain from a command line description
+
+    Input : A comma separated list of effects with their parameters separated by ':' (times in seconds), e.g.
+                gain:<dB>                         gain:-3
+                fade:<in>[:<out>]                 fade:0.01:0.2
+                echo:<delay>[:<decay>[:<repeats>]] echo:0.25:0.4:3
+                reverb:<seconds|ir.wav>[:<wet>]    reverb:1.2:0.25   reverb:hall.wav:0.3
+                highpass:<cutoff Hz>              highpass:80
+                dc                                (highpass:20)
+                loudness:<LUFS>                   loudness:-16
+                limiter[:<ceiling dBFS>]          limiter:-1
+            the sample rate and the block size
+    Output: An EffectsChain (raise ValueError for an unknown effect)
+    """
+    effects = []
+    for item in spec.split(","):
+        if item.strip() == "":
+            continue
+        name, *params = item.strip().split(":")
+        if name == "gain":
+            effects.append(Gain(float(params[0])))
+        elif name == "fade":
+            fade_out = float(params[1]) if len(params) > 1 else 0.0
+            effects.append(Fade(float(params[0]) * rate, fade_out * rate))
+        elif name == "echo":
+            decay = float(params[1]) if len(params) > 1 else 0.5
+            repeats = int(params[2]) if len(params) > 2 else 3
+            effects.append(Echo(float(params[0]) * rate, decay, repeats))
+        elif name == "reverb":
+            wet = float(params[1]) if len(params) > 1 else 0.3
+            if os.path.isfile(params[0]):
+                ir_rate, ir = simpleaudio.read_wav(params[0])
+                ir = simpleaudio.resample(simpleaudio.to_float32(ir), ir_rate, rate)
+            else:
+                ir = Reverb.synthetic_ir(rate, float(params[0]))
+            effects.append(Reverb(ir, wet))
+        elif name == "highpass":
+            effects.append(HighPass(float(params[0]), rate))
+        elif name == "dc":
+            effects.append(HighPass(20.0, rate))
+        elif name == "loudness":
+            effects.append(Loudness(float(params[0]), rate))
+        elif name == "limiter":
+            effects.append(Limiter(rate, float(params[0]) if params else -1.0))
+        else:
+            raise ValueError("Unknown effect: {}".format(name))
+    return EffectsChain(effects, block_size)
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Streaming output encoders (WAV/RIFF, headerless raw PCM, 8 kHz mu-law / A-law).
+
+Every encoder accepts audio chunk by chunk and writes it straight from the array buffer to a sink: a file
+name, '-' for stdout, or any binary file-like object (pipe, socket file, io.BytesIO...).
+    wav   : 16 bit PCM WAV. Sizes are patched on close() when the sink can seek, otherwise (pipes) the
+            header is streaming-friendly: the sizes are left at 0xFFFFFFFF ("until end of stream")
+    raw   : headerless 16 bit little-endian PCM
+    mulaw : headerless 8 bit G.711 mu-law, resampled to 8 kHz by default (telephony)
+    alaw  : headerless 8 bit G.711 A-law, resampled to 8 kHz by default
+
+Usage:
+    encoder = open_encoder("mulaw", "prompt.ul", rate=48000)
+    for chunk in chunks:
+        encoder.write(chunk)
+    encoder.close()
+"""
+
+import sys
+import struct
+import numpy as np
+
+import g711
+import metrics
+import simpleaudio
+
+# Size of the canonical WAV header written by wav_header()
+HEADER_SIZE = 44
+# Data size used in the header when the final size is unknown (streamed to a pipe)
+STREAMING_SIZE = 0xFFFFFFFF
+# Telephony sample rate
+TELEPHONY_RATE = 8000
+
+
+def wav_header(rate, channels=1, sampwidth=2, data_size=0, format_tag=1):
+    """
+    Description: Canonical 44 byte WAV header
+
+    Input : Sample rate, channels, bytes per sample, size of the data chunk and the format tag (1: PCM)
+    Output: The header as bytes (the RIFF size saturates for a streaming data size)
+    """
+    block_align = channels * sampwidth
+    return struct.pack("<4sI4s4sIHHIIHH4sI",
+                       b"RIFF", min(36 + data_size, STREAMING_SIZE), b"WAVE",
+                       b"fmt ", 16, format_tag, channels, rate, rate * block_align, block_align, sampwidth * 8,
+                       b"data", data_size)
+
+
+def lowpass_taps(cutoff, taps=63):
+    """Windowed-sinc lowpass filter (cutoff as a fraction of the input sample rate)"""
+    n = np.arange(taps) - (taps - 1) / 2.0
+    h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+    return h / h.sum()
+
+
+class StreamResampler:
+    """
+    Description: Linear-interpolation resampler that carries its state between chunks (plus an
+    anti-aliasing lowpass when downsampling), so chunk boundaries leave no clicks or drift
+    """
+
+    def __init__(self, rate, new_rate):
+        self.step = float(rate) / new_rate
+        # Position of the next output sample, relative to the first sample of the next input block
+        self.position = 0.0
+        self.last = None
+        self.taps = lowpass_taps(0.45 * new_rate / rate) if new_rate < rate else None
+        self.history = np.zeros(0 if self.taps is None else len(self.taps) - 1)
+        # Group delay of the filter: its first outputs are dropped, flush() pushes its last ones out
+        self.delay = 0 if self.taps is None else (len(self.taps) - 1) // 2
+        self.skip = self.delay
+        # Input samples received and output samples returned (flush() stops at the end of the input)
+        self.received = 0
+        self.produced = 0
+
+    def process(self, chunk):
+        x = np.asarray(chunk, dtype=np.float64)
+        self.received += len(x)
+        output = self.run(x)
+        self.produced += len(output)
+        return output
+
+    def flush(self):
+        """The samples still held by the filter and the interpolation at the end of the stream"""
+        # Zeros push the last samples through the filter, one more lets the interpolation reach the last sample
+        output = self.run(np.zeros(self.delay + 1))
+        expected = int((self.received - 1) // self.step) + 1 if self.received else 0
+        output = output[:max(expected - self.produced, 0)]
+        self.produced += len(output)
+        return output
+
+    def run(self, x):
+        if self.taps is not None:
+            x = np.concatenate((self.history, x))
+            self.history = x[len(x) - len(self.history):]
+            x = np.convolve(x, self.taps, mode="valid")
+            if self.skip:
+                dropped = min(self.skip, len(x))
+                x = x[dropped:]
+                self.skip -= dropped
+        if self.last is not None:
+            x = np.concatenate((self.last, x))
+        if len(x) < 2:
+            self.last = x
+            return np.zeros(0)
+        positions = np.arange(self.position, len(x) - 1, self.step)
+        output = np.interp(positions, np.arange(len(x)), x)
+        # Carry the last sample over, so the next block starts at its index 0
+        next_position = positions[-1] + self.step if len(positions) else self.position
+        self.position = next_position - (len(x) - 1)
+        self.last = x[-1:]
+        return output
+
+
+class Encoder:
+    """
+    Description: Base class: owns the sink, resamples if needed and writes the encoded bytes
+    """
+    # Format name (see ENCODERS) and default output rate (None: keep the input rate)
+    name = None
+    default_rate = None
+
+    def __init__(self, sink, rate, out_rate=None):
+        """
+        Input : The sink (file name, '-' for stdout, or a binary file-like object), the sample rate of the
+                audio that will be written, and the output sample rate (default: the encoder's default)
+        """
+        if out_rate is None:
+            out_rate = self.default_rate or rate
+        self.rate = rate
+        self.out_rate = out_rate
+        self.resampler = StreamResampler(rate, out_rate) if out_rate != rate else None
+        self.owns_file = False
+        if sink == "-":
+            self.file = sys.stdout.buffer
+        elif isinstance(sink, str):
+            self.file = open(sink, "wb")
+            self.owns_file = True
+        else:
+            self.file = sink
+        self.bytes_written = 0
+        self.start()
+
+    def start(self):
+        """Write the header (if any)"""
+        pass
+
+    def encode(self, data):
+        """Samples at the output rate (int16, or floats at full scale 1.0) -> numpy array in the output format"""
+        raise NotImplementedError
+
+    def write(self, data):
+        """Encode and write one chunk of audio, return the number of bytes written"""
+        if self.resampler is not None:
+            # Resampled in the float32 working format (full scale 1.0)
+            data = self.resampler.process(simpleaudio.to_float32(data))
+        return self.emit(data)
+
+    def emit(self, data):
+        """Encode and write samples at the output rate"""
+        encoded = np.ascontiguousarray(self.encode(data))
+        # Write straight from the array buffer, no intermediate bytes copy
+        self.file.write(memoryview(encoded).cast("B"))
+        self.bytes_written += encoded.nbytes
+        metrics.BYTES_WRITTEN.inc(self.name, amount=encoded.nbytes)
+        return encoded.nbytes
+
+    def write_plan(self, plan):
+        """Write a splice.SegmentPlan (joined into one array, see RawEncoder for the vectored write)"""
+        return self.write(plan.materialize())
+
+    def finish(self):
+        """Complete the stream (e.g. patch the header)"""
+        pass
+
+    def close(self):
+        if self.file is None:
+            return
+        if self.resampler is not None:
+            # The end of the input still held by the resampler
+            self.emit(self.resampler.flush())
+        self.finish()
+        if self.owns_file:
+            self.file.close()
+        else:
+            self.file.flush()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RawEncoder(Encoder):
+    """Headerless 16 bit little-endian PCM"""
+    name = "raw"
+
+    def encode(self, data):
+        # The one dithered conversion of the float32 working format
+        return simpleaudio.to_int16(data)
+
+    def write_plan(self, plan):
+        """Write a splice.SegmentPlan: the int16 unit views as they are, with vectored writes"""
+        if self.resampler is not None:
+            return Encoder.write_plan(self, plan)
+        written = plan.write_to(self.file)
+        self.bytes_written += written
+        metrics.BYTES_WRITTEN.inc(self.name, amount=written)
+        return written
+
+
+class WavEncoder(RawEncoder):
+    """16 bit PCM WAV, sizes patched on close (or left at the streaming size if the sink cannot seek)"""
+    name = "wav"
+
+    def start(self):
+        try:
+            self.header_position = self.file.tell()
+            self.seekable = self.file.seekable()
+        except (AttributeError, OSError):
+            self.seekable = False
+        self.file.write(wav_header(self.out_rate, data_size=0 if self.seekable else STREAMING_SIZE))
+
+    def finish(self):
+        if self.seekable:
+            # Past 4 GiB the sizes stay at the streaming size (readers then take the data to the end of the file)
+            end = self.file.tell()
+            self.file.seek(self.header_position + 4)
+            self.file.write(struct.pack("<I", min(36 + self.bytes_written, STREAMING_SIZE)))
+            self.file.seek(self.header_position + 40)
+            self.file.write(struct.pack("<I", min(self.bytes_written, STREAMING_SIZE)))
+            self.file.seek(end)
+
+
+class MulawEncoder(Encoder):
+    """Headerless 8 bit G.711 mu-law"""
+    name = "mulaw"
+    default_rate = TELEPHONY_RATE
+
+    def encode(self, data):
+        return g711.mulaw_encode(simpleaudio.to_int16(data))
+
+
+class AlawEncoder(Encoder):
+    """Headerless 8 bit G.711 A-law"""
+    name = "alaw"
+    default_rate = TELEPHONY_RATE
+
+    def encode(self, data):
+        return g711.alaw_encode(simpleaudio.to_int16(data))
+
+
+# Format name -> encoder class (--format in word_syn.py)
+ENCODERS = {"wav": WavEncoder, "raw": RawEncoder, "mulaw": MulawEncoder, "alaw": AlawEncoder}
+
+
+def open_encoder(format, sink, rate, out_rate=None):
+    """
+    Description: Create an encoder by format name
+
+    Input : Format (wav, raw, mulaw or alaw), sink, input sample rate and optional output sample rate
+    Output: An Encoder instance (call write() for each chunk, then close())
+    """
+    return ENCODERS[format](sink, rate, out_rate)
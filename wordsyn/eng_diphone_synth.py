@@ -10,12 +10,12 @@ potential output error warning etc.
 """
 import os
 import sys
-import pyaudio
 import simpleaudio
 import argparse
-import nltk
-from nltk.corpus import cmudict
 import re
+# Compiled CMUdict and cached diphone folder index (nltk is only imported when the dictionary needs compiling)
+from cmudict_compiled import load_cmudict
+from unit_index import UnitIndex
 import numpy as np
 
 # Given argparse auguments
@@ -34,24 +34,29 @@ parser.add_argument('--volume', '-v', default=None, type=int,
                     help="An int between 0 and 100 representing the desired volume")
 
 # (PART I) Parse arguments from the command line
-try: 
-    # Test if the user gave any argument
-    assert len(sys.argv) > 1
-    # If yes, parse all arguments 
-    args = parser.parse_args() 
-except:
-    if len(sys.argv) == 1: 
-        # If the user didn't input any argument, show the usage information
-        print(parser.format_usage()) 
-        # Gives instructions before quit
-        print("*** ERROR: Required input phrase is missing, please provide an input string argument for synthesis.")
-    else:
-        # Otherwise, refer to an error message
-        print("*** ERROR: Please check the missing/incorrect argument.")
-        print("Usage Examples with input types:")
-        print("\t  -volume \t<int: 0-100>")
-        print("\t  -outfile \t<string: filename>")
-    exit()
+def parse_arguments():
+    """Parse the command line, show the usage information and quit if it is incorrect"""
+    try: 
+        # Test if the user gave any argument
+        assert len(sys.argv) > 1
+        # If yes, parse all arguments 
+        return parser.parse_args() 
+    except:
+        if len(sys.argv) == 1: 
+            # If the user didn't input any argument, show the usage information
+            print(parser.format_usage()) 
+            # Gives instructions before quit
+            print("*** ERROR: Required input phrase is missing, please provide an input string argument for synthesis.")
+        else:
+            # Otherwise, refer to an error message
+            print("*** ERROR: Please check the missing/incorrect argument.")
+            print("Usage Examples with input types:")
+            print("\t  -volume \t<int: 0-100>")
+            print("\t  -outfile \t<string: filename>")
+        exit()
+
+# Default options when this file is imported as a module, e.g. by word_syn for code-switched input (replaced by the command line in __main__)
+args = parser.parse_args([""])
 
 # (PART II) Utterance class for processing text normalization and annotation
 class Utterance:
@@ -204,7 +209,7 @@ class Utterance:
                 output = output + " " + year_first2digits + " " + year_last2digits + " "
 
         # Provide a message to inform users about the auto number/date conversion
-        print("Translated number expressions: " + number_seq + " ->" + re.sub("\s+"," ",output))
+        print("Translated number expressions: " + number_seq + " ->" + re.sub("\s+"," ",output), file=sys.stderr)
 
         return output
 
@@ -281,12 +286,8 @@ class Utterance:
         Output: A list of phone sequence 
         '''
         # Get pronunciation dictionary form CMU dict
-        try:
-            phoneDict = cmudict.dict()
-        # If user does not have CMU dict, download before load
-        except LookupError:
-            nltk.download('cmudict')
-            phoneDict = cmudict.dict()
+        # NOTE: Memory-mapped compiled copy, built (and downloaded if needed) on first use only
+        phoneDict = load_cmudict()
         
         # Task 1 and 2 - Tokenize the text sequence
         # (Task 1) - For normal pronuciation, split the text to token list accourding to while space
@@ -326,7 +327,7 @@ class Utterance:
             # Extract pronunciation of each token from pronunciation dict
             # NOTE: ASSUMPTION: For words with multiple possible pronunciation in CMU dict, we use the 1st one
             try:
-                pron_list.extend(phoneDict[each_token.strip()][0])
+                pron_list.extend(phoneDict.first(each_token.strip()))
             # Special handling for tokens not in the CMU dict
             except:
                 # Annotation of 200ms silence
@@ -344,7 +345,7 @@ class Utterance:
                     continue
                 # For unhandled case, show error meassage : Unknown token in the dictioinary
                 else:
-                    print("ERROR: This word is not in the CMU dict:", each_token)
+                    print("ERROR: This word is not in the CMU dict:", each_token, file=sys.stderr)
                     exit() 
 
             # When flag for emphasis token is true, save indexes of emphrasised phones
@@ -360,7 +361,7 @@ class Utterance:
             startphone_index = len(pron_list)
         
         # Imform user the emphasised words
-        print("Emphasised tokens:", emp_wordlist)
+        print("Emphasised tokens:", emp_wordlist, file=sys.stderr)
 
         # Return phone list and emphasis
         return pron_list, emphasis
@@ -429,11 +430,12 @@ class Synth():
     based on the given feature information (e.g. emphasiss).
     """
 
-    def __init__(self, wav_folder, diphone_seq=None, diph_emphasis=None):
+    def __init__(self, wav_folder, diphone_seq=None, diph_emphasis=None, smoother=None):
         """
         Description: Go through a pipeline to generate the required audio: (1) get the diphones, (2) concatenate them to an Audio object
         
-        Input : A path to wav_folder, a list of requested diphones, a set of diphone index which marked with emphasis
+        Input : A path to wav_folder, a list of requested diphones, a set of diphone index which marked with emphasis,
+                and the smoother option (default: the --crossfade option)
         Output: Return nothing but save information in self attribute (self.diphones and self.output)
         """
         # Step 0 - Infomation about diphone sequence from text annotation part done in Utterence
@@ -442,7 +444,9 @@ class Synth():
         # Step 1 - Get unique diphone audio data (numpy array that represent their audio signal) from the diphone database
         self.diphones = self.get_wavs(wav_folder=wav_folder)
         # Step 2 - Concatenate the audio in diphones and put them to an output audio instance 
-        self.output = self.concat_diphones(diph_emphasis=self.diph_emphasis, smoother=bool(args.crossfade))
+        if smoother is None:
+            smoother = bool(args.crossfade)
+        self.output = self.concat_diphones(diph_emphasis=self.diph_emphasis, smoother=smoother)
 
     # Task 1 - Basic synthesis
     def get_wavs(self, wav_folder):
@@ -457,7 +461,6 @@ class Synth():
                 (2) Save data in numpy array instead of object instance
         """
         # Variables to store diphones
-        diphone_path = dict([])
         diphones = dict([])
         
         # To ensure efficiency, I create a list of unique diphones that we need to retrive from the file.
@@ -465,12 +468,10 @@ class Synth():
         # lots of repeating words, e.g. Long sentence with repeating the, a, he, she .... 
         unique_diphones = set(map(lambda each_diphone: each_diphone, self.diphone_seq))
 
-        # Only go through the database once, storing a complete dictionary of avaliable diphone and their path
-        # is still necessary because my required diphone might be a missing diphone, I need to know what other
-        # similar diphones in the database I can use.
-        for root, dirs, files in os.walk(wav_folder, topdown=False):
-            for file in files:
-                diphone_path[file] = root + '/' + file
+        # A complete dictionary of avaliable diphone and their path is still necessary because my required diphone
+        # might be a missing diphone, I need to know what other similar diphones in the database I can use.
+        # NOTE: The index is cached on disk and only rebuilt when the folder changes, so we don't walk the database every run
+        diphone_path = UnitIndex(wav_folder)
 
         # Go through the required diphones, use the method in an Audio instance to load the numpy array data,
         # then only store the np array data in the diphone dictionary (i.e. key: diphone, value: np array)
@@ -491,19 +492,19 @@ class Synth():
                 # Handle normal diphones
                 try:
                     # Load the audio data from the corresponding path
-                    path = diphone_path[required_diphone+".wav"]
+                    path = diphone_path.path(required_diphone+".wav")
                     sound_obj.load(path)
                     # Save the array data in a dictionary
                     diphones[required_diphone] = sound_obj.data
                 except KeyError:
                     # Show error message to user when there is a KeyError which refers to missing diphone in the diphone database
-                    print("*** This is a missing diphone: ", required_diphone)
+                    print("*** This is a missing diphone: ", required_diphone, file=sys.stderr)
                     # Instead of quiting the program, use the method sub_diphone to find corresponding suitable subsitude diphone
                     sub_diphone = self.sub_diphone(required_diphone)
                     # NOTE: Show message to user about subsitution of diphone
-                    print("*** Using subsitude diphone: ", sub_diphone)
+                    print("*** Using subsitude diphone: ", sub_diphone, file=sys.stderr)
                     # Save the array data in the dictionary
-                    path = diphone_path[sub_diphone+".wav"]
+                    path = diphone_path.path(sub_diphone+".wav")
                     sound_obj.load(path)
                     diphones[required_diphone] = sound_obj.data
                     
@@ -580,7 +581,7 @@ class Synth():
                         # Scale the data points in the initial 10 msc of current working diphone
                         # Order: Start scaling from the 1st point, 2nd, 3rd... througout the loop (From edge of diphone towards the middle)
                         temp_diphone.data[index] = temp_diphone.data[index] * adjust_level/160.0
-                    if diphone_index < len(diphone_seq)-1:
+                    if diphone_index < len(self.diphone_seq)-1:
                         # Except the last diphone:
                         # Scale the data points in the last 10 msc of of current working diphone
                         # Order: Start scaling from the last point, 2nd last, 3rd last... througout the loop (From edge of diphone towards the middle)
@@ -589,8 +590,8 @@ class Synth():
                     adjust_level+=1
                 
                 # After rescale all, seperate the whole diphone into two portions: (1) initial 10msc, and (2) everything after 10msc
-                np.initial10msc = temp_diphone.data[:160]
-                np.after10msc = temp_diphone.data[160:]
+                initial10msc = temp_diphone.data[:160]
+                after10msc = temp_diphone.data[160:]
 
                 # Combine diphone portions together in the output.data
                 if diphone_index == 0:
@@ -598,9 +599,9 @@ class Synth():
                     output.data = np.concatenate((output.data, temp_diphone.data))
                 else:
                     # For later diphones, addup/cross-fade the first 10 msc of the current diphone with last 10 msc of the previous diphone (which saved in the output.data in the previous round)
-                    output.data[-160:] = output.data[-160:] + np.initial10msc
+                    output.data[-160:] = output.data[-160:] + initial10msc
                     # Concatenate the remaining part of the processed diphone data
-                    output.data = np.concatenate((output.data, np.after10msc))
+                    output.data = np.concatenate((output.data, after10msc))
             # Increase monitereing index
             diphone_index += 1
         # Return 
@@ -646,6 +647,8 @@ def play_audio(play=False, object=None):
 # (PART V) Main module
 if __name__ == "__main__":
 
+    args = parse_arguments()
+
     # Step 1 - Create an Utterance instance to handle text normalization and annotatioin (incl. translation of number) of input text
     utt = Utterance(input_text=args.phrase[0])
 
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Vectorized language / variety detection for check_lang().
+
+Every codepoint of the input is mapped through one precomputed uint8 lookup table of feature bits
+(Latin letter, CJK character, simplified-only, traditional-only, Cantonese-specific, covered by the
+Cantonese / Mandarin phone dictionary). The per-sentence work is a single NumPy gather plus a few
+bit counts, so the router can afford to call it on every request.
+
+The table is built once from the phone dictionaries (and OpenCC for the simplified/traditional split,
+if installed) and cached as .npy next to the other derived data.
+
+Usage:
+    detect("佢今日唔返工")   -> {"language": "zh", "variety": "c", "counts": {...}}
+    check_lang("今天不上班") -> "p"
+"""
+
+import os
+import json
+import numpy as np
+
+from unit_index import cache_path
+
+# Feature bits in the lookup table
+LATIN = 1
+CJK = 2
+SIMPLIFIED = 4      # changes under s2t, unchanged under t2s
+TRADITIONAL = 8     # changes under t2s
+CANTONESE = 16      # written-Cantonese characters that don't occur in standard Mandarin text
+IN_CAN_DICT = 32
+IN_MAND_DICT = 64
+BITS = (("latin", LATIN), ("cjk", CJK), ("simplified", SIMPLIFIED), ("traditional", TRADITIONAL),
+        ("cantonese", CANTONESE), ("can_dict", IN_CAN_DICT), ("mand_dict", IN_MAND_DICT))
+
+# Covers the BMP and CJK extension B/C/D (plane 2), anything beyond is looked up as 0 (no feature)
+TABLE_SIZE = 0x30000
+# Bump when the bits or the way the table is built change
+TABLE_VERSION = 1
+
+# Colloquial Cantonese characters (e.g. 嘅/咗/唔/佢), a strong signal even in short inputs
+CANTONESE_CHARS = "嘅咗嘢啲嗰喺冇咁乜佢哋唔咩嚟囉噉嘥攰揾搵睇瞓諗啱嘞嚿冚喎嘸啩咋㗎𠮶"
+
+# Default dictionaries, same as assign_paths() in word_syn.py
+CAN_DICT = "phonedict_dict_can"
+MAND_DICT = "phonedict_dict_pth_perc"
+
+
+def cjk_ranges():
+    """CJK unified ideographs (and extensions) covered by the table"""
+    return [(0x3400, 0x4DC0), (0x4E00, 0xA000), (0xF900, 0xFB00), (0x20000, 0x2EBF0)]
+
+
+def build_table(can_dict=CAN_DICT, mand_dict=MAND_DICT):
+    """
+    Description: Build the codepoint -> feature bits table
+
+    Input : Paths to the Cantonese and Mandarin phone dictionaries (json)
+    Output: A uint8 numpy array of length TABLE_SIZE
+    """
+    table = np.zeros(TABLE_SIZE, dtype=np.uint8)
+
+    # Script bits
+    table[ord("A"):ord("Z")+1] |= LATIN
+    table[ord("a"):ord("z")+1] |= LATIN
+    # Full width Latin letters
+    table[0xFF21:0xFF3B] |= LATIN
+    table[0xFF41:0xFF5B] |= LATIN
+    for start, end in cjk_ranges():
+        table[start:min(end, TABLE_SIZE)] |= CJK
+
+    # Dictionary coverage
+    for dictpath, bit in ((can_dict, IN_CAN_DICT), (mand_dict, IN_MAND_DICT)):
+        with open(dictpath, "r") as f:
+            chars = [char for char in json.loads(f.read()) if len(char) == 1 and ord(char) < TABLE_SIZE]
+        table[np.array([ord(char) for char in chars], dtype=np.int64)] |= bit
+
+    # Cantonese-specific characters
+    table[np.array([ord(char) for char in CANTONESE_CHARS], dtype=np.int64)] |= CANTONESE
+
+    # Simplified-only / traditional-only characters from OpenCC (optional, the dictionaries still separate most scripts)
+    try:
+        from opencc import OpenCC
+    except ImportError:
+        OpenCC = None
+    if OpenCC is not None:
+        chars = [chr(cp) for start, end in cjk_ranges() for cp in range(start, min(end, 0x10000))]
+        # Convert all characters in one call, one per line so no phrase conversion spans two characters
+        to_simplified = OpenCC("t2s").convert("\n".join(chars)).split("\n")
+        to_traditional = OpenCC("s2t").convert("\n".join(chars)).split("\n")
+        if len(to_simplified) == len(chars) and len(to_traditional) == len(chars):
+            for char, simplified, traditional in zip(chars, to_simplified, to_traditional):
+                if simplified != char:
+                    table[ord(char)] |= TRADITIONAL
+                elif traditional != char:
+                    table[ord(char)] |= SIMPLIFIED
+    return table
+
+
+def source_stamp(paths):
+    return [[path, os.stat(path).st_size, os.stat(path).st_mtime_ns] for path in paths]
+
+
+# Lazily loaded shared table
+_table = None
+
+
+def load_table(can_dict=CAN_DICT, mand_dict=MAND_DICT):
+    """
+    Description: Load the cached lookup table, rebuild it if the dictionaries changed
+
+    Output: The uint8 lookup table (shared between calls)
+    """
+    global _table
+    if _table is not None:
+        return _table
+    table_file = cache_path("lang_table.npy")
+    meta_file = cache_path("lang_table.json")
+    stamp = [TABLE_VERSION, source_stamp([can_dict, mand_dict])]
+    try:
+        with open(meta_file, "r") as f:
+            assert json.loads(f.read()) == stamp
+        table = np.load(table_file)
+        assert table.shape == (TABLE_SIZE,)
+    except (OSError, ValueError, AssertionError):
+        table = build_table(can_dict, mand_dict)
+        try:
+            os.makedirs(os.path.dirname(table_file), exist_ok=True)
+            np.save(table_file, table)
+            with open(meta_file, "w") as f:
+                f.write(json.dumps(stamp))
+        except OSError:
+            pass
+    _table = table
+    return _table
+
+
+def lookup(text, table=None):
+    """
+    Description: Feature bits of every character of the text, in one vectorized gather
+
+    Input : A string (and optionally a lookup table)
+    Output: A uint8 numpy array, one entry per character
+    """
+    if table is None:
+        table = load_table()
+    codepoints = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    # Codepoints outside the table have no features
+    codepoints = np.where(codepoints < TABLE_SIZE, codepoints, 0)
+    return table[codepoints]
+
+
+def count_features(flags):
+    """Count how many characters carry each feature bit (and how many are covered by one dictionary only)"""
+    counts = dict((name, int(np.count_nonzero(flags & bit))) for name, bit in BITS)
+    coverage = flags & (IN_CAN_DICT | IN_MAND_DICT)
+    counts["can_dict_only"] = int(np.count_nonzero(coverage == IN_CAN_DICT))
+    counts["mand_dict_only"] = int(np.count_nonzero(coverage == IN_MAND_DICT))
+    return counts
+
+
+def detect(text, table=None):
+    """
+    Description: Detect the language (zh / en) and the Chinese variety (c: Cantonese, p: Mandarin) of the text
+
+    Input : A string
+    Output: A dict with "language", "variety" and the feature "counts"
+    NOTE  : Mandarin is chosen on ties, as check_lang() did before
+    """
+    counts = count_features(lookup(text, table))
+    language = "en" if counts["latin"] > 0 and counts["cjk"] == 0 else "zh"
+    # Written Cantonese characters count most, then the script, then the characters only one voice can say
+    score_c = 3 * counts["cantonese"] + counts["traditional"] + counts["can_dict_only"]
+    score_p = counts["simplified"] + counts["mand_dict_only"]
+    variety = "c" if score_c > score_p else "p"
+    return {"language": language, "variety": variety, "counts": counts}
+
+
+def check_lang(input_sequence):
+    """Language option (c or p) for the Chinese synthesizer"""
+    return detect(input_sequence)["variety"]
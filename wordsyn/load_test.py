@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Local load generator for the synthesis library (concurrent threads or processes).
+
+N workers call word_syn.synthesize() in a loop with a weighted prompt mix (short IVR prompts, dates and
+numbers that go through Sequence.translate_num_pattern, and long paragraphs), for a fixed duration or number
+of requests. Every worker reports its requests, latencies, audio produced, CPU time and memory, and the run
+is summarised as throughput, p50/p95/p99 latency (overall and per prompt kind), CPU utilisation and RSS per
+worker. Results can be saved to a JSON file and compared with a later run (e.g. threads vs processes, or
+before / after a change).
+NOTE  : Threads share one interpreter (and the GIL), so their CPU / RSS are those of the whole process;
+        worker processes are forked after the voices are loaded and report their own CPU and RSS
+        (RSS counts the pages shared with the parent in every worker)
+
+Usage:
+    python3 load_test.py --workers 4 --duration 30
+    python3 load_test.py --workers 4 --processes --duration 30 --save processes.json
+    python3 load_test.py --workers 8 --requests 50 --mix ivr=1,numbers=1 --compare processes.json
+    python3 load_test.py --prompts prompts.tsv --language c
+"""
+
+import os
+import json
+import time
+import random
+import argparse
+import resource
+import threading
+
+import numpy as np
+
+import word_syn
+
+# Prompt mix: kind -> (weight, [(language, text), ...])
+PROMPTS = {
+    "ivr": (0.6, [
+        ("c", "你好。"),
+        ("c", "請稍等。"),
+        ("c", "多謝你的來電。"),
+        ("c", "請輸入你的密碼。"),
+        ("p", "你好。"),
+        ("p", "请稍等。"),
+        ("p", "谢谢你的来电。"),
+        ("p", "请输入你的密码。"),
+    ]),
+    "numbers": (0.25, [
+        ("c", "今日係12/10/2019。"),
+        ("c", "你有3個新訊息。"),
+        ("c", "我們1/10去飲茶。"),
+        ("p", "今天是1/10/2019。"),
+        ("p", "你有12个新消息。"),
+        ("p", "请在5/6之前回复。"),
+    ]),
+    "paragraph": (0.15, [
+        ("c", "今日天氣好好，我們去飲茶。飲完茶之後，我們去公園行下，再去睇電影。"
+              "晚上我們一齊食飯，食完飯返屋企休息。聽日又係新的一日，大家早點休息。"),
+        ("p", "今天天气很好，我们去公园散步。散步之后，我们一起去看电影。"
+              "晚上我们一起吃饭，吃完饭回家休息。明天又是新的一天，大家早点睡觉。"),
+    ]),
+}
+# Latency percentiles reported
+PERCENTILES = (50, 95, 99)
+
+
+def parse_mix(spec, prompts=PROMPTS):
+    """Weights of the prompt kinds from "ivr=1,numbers=2" (kinds not listed are left out)"""
+    weights = dict([])
+    for item in spec.split(","):
+        kind, weight = item.split("=")
+        if kind not in prompts:
+            raise ValueError("Unknown prompt kind: {} (kinds: {})".format(kind, ", ".join(sorted(prompts))))
+        weights[kind] = float(weight)
+    return weights
+
+
+def load_prompts(path):
+    """
+    Description: Prompt mix from a file
+
+    Input : A UTF-8 file, one prompt per line: kind<TAB>language<TAB>text (weights of the kinds default to 1)
+    Output: A dict like PROMPTS
+    """
+    prompts = dict([])
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 3 or line.startswith("#"):
+                continue
+            prompts.setdefault(fields[0], (1.0, []))[1].append((fields[1], fields[2]))
+    return prompts
+
+
+def build_plan(prompts, weights=None, language=None):
+    """
+    Description: The prompts a worker picks from, with their weights
+
+    Input : A prompt mix (see PROMPTS), optionally the weights of the kinds and a language (c or p) to keep
+    Output: A list of (kind, language, text) and a list of their weights
+    """
+    plan, plan_weights = [], []
+    for kind, (weight, entries) in sorted(prompts.items()):
+        if weights != None:
+            weight = weights.get(kind, 0.0)
+        entries = [(prompt_language, text) for prompt_language, text in entries if language in (None, prompt_language)]
+        for prompt_language, text in entries:
+            plan.append((kind, prompt_language, text))
+            # The weight of a kind is shared by its prompts
+            plan_weights.append(weight / len(entries))
+    if not plan or sum(plan_weights) <= 0:
+        raise ValueError("The prompt mix is empty")
+    return plan, plan_weights
+
+
+def rss_mb():
+    """Current resident set size of this process in MB (/proc, or the peak where there is no /proc)"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2.0**20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run_worker(index, plan, weights, duration=None, requests=None, warmup=1, seed=0, thread=False):
+    """
+    Description: One worker: synthesize prompts from the plan until the duration or request count is reached
+
+    Input : The worker index, the plan and weights (see build_plan), the duration in seconds or the number of
+            requests, the warm-up requests (not counted), the random seed and whether the worker is a thread
+            (CPU time of the thread) or a process
+    Output: A dict of the worker results (one (kind, latency, audio seconds) per request, errors, CPU, RSS)
+    """
+    rng = random.Random(seed * 1000 + index)
+    cpu_time = time.thread_time if thread else time.process_time
+    results = {"worker": index, "pid": os.getpid(), "requests": [], "errors": dict([])}
+    for _ in range(warmup):
+        kind, language, text = rng.choices(plan, weights)[0]
+        try:
+            word_syn.synthesize(text, language)
+        except Exception:
+            # Counted when the prompt comes up again in the measured requests
+            pass
+    cpu_start, start = cpu_time(), time.perf_counter()
+    while True:
+        if requests != None and len(results["requests"]) + sum(results["errors"].values()) >= requests:
+            break
+        if duration != None and time.perf_counter() - start >= duration:
+            break
+        kind, language, text = rng.choices(plan, weights)[0]
+        request_start = time.perf_counter()
+        try:
+            audio = word_syn.synthesize(text, language)
+        except Exception as error:
+            name = type(error).__name__
+            results["errors"][name] = results["errors"].get(name, 0) + 1
+            continue
+        latency = time.perf_counter() - request_start
+        results["requests"].append((kind, latency, len(audio.data) / float(audio.rate)))
+    results["wall"] = time.perf_counter() - start
+    results["cpu"] = cpu_time() - cpu_start
+    results["rss_mb"] = rss_mb()
+    # ru_maxrss is in KB on Linux
+    results["max_rss_mb"] = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, results["rss_mb"])
+    return results
+
+
+def run_threads(workers, **options):
+    """Run the workers as threads of this process (started together)"""
+    results = [None] * workers
+    def target(index):
+        results[index] = run_worker(index, thread=True, **options)
+    threads = [threading.Thread(target=target, args=(index,), name="load-{}".format(index)) for index in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def run_processes(workers, **options):
+    """Run the workers as processes, forked after the voices are loaded (see word_syn.sentence_pool)"""
+    from concurrent.futures import ProcessPoolExecutor
+    word_syn.preload_voices()
+    with ProcessPoolExecutor(max_workers=workers, initializer=word_syn.init_worker, initargs=(word_syn.args,)) as pool:
+        futures = [pool.submit(run_worker, index, **options) for index in range(workers)]
+        return [future.result() for future in futures]
+
+
+def cpu_count():
+    """Cores this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def latency_stats(latencies):
+    """p50/p95/p99, mean and max of latencies in seconds, in ms"""
+    if not latencies:
+        return dict([])
+    values = np.asarray(latencies) * 1000
+    stats = dict(("p{}_ms".format(q), float(np.percentile(values, q))) for q in PERCENTILES)
+    stats.update({"mean_ms": float(values.mean()), "max_ms": float(values.max()), "count": len(values)})
+    return stats
+
+
+def summarise(workers, processes, wall, options, cpu=None):
+    """
+    Description: Summary of a run
+
+    Input : The worker results, whether they were processes, the wall-clock time of the run, the run options and
+            the CPU seconds of the whole process for threads (their own thread time leaves out the prefetch threads)
+    Output: A dict of results (throughput, latency, CPU utilisation, RSS per worker)
+    """
+    requests = [request for worker in workers for request in worker["requests"]]
+    errors = dict([])
+    for worker in workers:
+        for name, count in worker["errors"].items():
+            errors[name] = errors.get(name, 0) + count
+    # Busy time of the workers (they run from their own start, after the warm-up)
+    busy = max(worker["wall"] for worker in workers)
+    if cpu is None:
+        cpu = sum(worker["cpu"] for worker in workers)
+    audio = sum(request[2] for request in requests)
+    results = {"mode": "processes" if processes else "threads", "workers": len(workers), "options": options,
+               "wall_s": wall, "requests": len(requests), "errors": errors,
+               "throughput_rps": len(requests) / busy if busy else 0.0,
+               "audio_s_per_s": audio / busy if busy else 0.0,
+               "latency": latency_stats([request[1] for request in requests]),
+               "latency_by_kind": dict((kind, latency_stats([request[1] for request in requests if request[0] == kind]))
+                                       for kind in sorted(set(request[0] for request in requests))),
+               # CPU seconds per second of the run: 1.0 is one core busy all the time
+               "cpu_cores": cpu / busy if busy else 0.0,
+               "cpu_percent": 100.0 * cpu / busy / cpu_count() if busy else 0.0,
+               "per_worker": [{"worker": worker["worker"], "pid": worker["pid"], "requests": len(worker["requests"]),
+                               "rps": len(worker["requests"]) / worker["wall"] if worker["wall"] else 0.0,
+                               "cpu_percent": 100.0 * worker["cpu"] / worker["wall"] if worker["wall"] else 0.0,
+                               "rss_mb": worker["rss_mb"], "max_rss_mb": worker["max_rss_mb"]} for worker in workers]}
+    return results
+
+
+def load_test(workers=4, processes=False, duration=None, requests=None, warmup=1, prompts=PROMPTS, weights=None,
+              language=None, seed=0, quiet=True):
+    """
+    Description: Run a load test
+
+    Input : The number of workers, whether to use processes instead of threads, the duration in seconds or the
+            requests per worker (default: 10 s), the warm-up requests per worker, the prompt mix and the weights
+            of its kinds, a language to keep (c or p, None for both), the random seed and whether to leave out the
+            linguistic information the pipeline prints (word_syn --quiet)
+    Output: A dict of results (see summarise)
+    """
+    if duration is None and requests is None:
+        duration = 10.0
+    plan, plan_weights = build_plan(prompts, weights, language)
+    options = {"duration": duration, "requests": requests, "warmup": warmup, "seed": seed, "language": language,
+               "weights": weights}
+    # Set before the worker processes are started, they get a copy of the options
+    word_syn.args.quiet = quiet
+    start, cpu_start = time.perf_counter(), time.process_time()
+    run = run_processes if processes else run_threads
+    results = run(workers, plan=plan, weights=plan_weights, duration=duration, requests=requests, warmup=warmup,
+                  seed=seed)
+    # NOTE: The CPU of the threads includes their warm-up, a small share of a run of a few seconds or more
+    cpu = None if processes else time.process_time() - cpu_start
+    return summarise(results, processes, time.perf_counter() - start, options, cpu)
+
+
+def report(results, baseline=None):
+    """Print the results (and the difference to a baseline from --compare)"""
+    def line(label, value, key=None, unit="", lower_is_better=False):
+        text = "{:<24}{:>10.1f}{}".format(label, value, unit)
+        if baseline != None and key != None:
+            old = baseline
+            for part in key.split("."):
+                old = old.get(part, {}) if isinstance(old, dict) else {}
+            if isinstance(old, (int, float)) and old:
+                text += "   (was {:.1f}{}, {:+.1f} %)".format(old, unit, 100.0 * (value / old - 1))
+        print(text)
+    print("Load test: {} worker(s) ({}), {} requests, {} error(s)".format(
+        results["workers"], results["mode"], results["requests"], sum(results["errors"].values())))
+    for name, count in sorted(results["errors"].items()):
+        print("  {}: {}".format(name, count))
+    line("Throughput:", results["throughput_rps"], "throughput_rps", " req/s")
+    line("Audio / second:", results["audio_s_per_s"], "audio_s_per_s", " s/s")
+    for q in PERCENTILES:
+        key = "p{}_ms".format(q)
+        if key in results["latency"]:
+            line("Latency p{}:".format(q), results["latency"][key], "latency." + key, " ms")
+    line("CPU (cores busy):", results["cpu_cores"], "cpu_cores")
+    line("CPU (% of machine):", results["cpu_percent"], "cpu_percent", " %")
+    print()
+    print("{:<12}{:>8}{:>10}{:>10}{:>10}".format("Kind", "count", "p50 ms", "p95 ms", "p99 ms"))
+    for kind, stats in results["latency_by_kind"].items():
+        print("{:<12}{:>8}{:>10.1f}{:>10.1f}{:>10.1f}".format(kind, stats["count"], stats["p50_ms"], stats["p95_ms"], stats["p99_ms"]))
+    print()
+    print("{:<8}{:>8}{:>10}{:>10}{:>8}{:>10}{:>12}".format("Worker", "pid", "requests", "req/s", "CPU %", "RSS MB", "peak RSS MB"))
+    for worker in results["per_worker"]:
+        print("{:<8}{:>8}{:>10}{:>10.2f}{:>8.0f}{:>10.1f}{:>12.1f}".format(worker["worker"], worker["pid"], worker["requests"],
+              worker["rps"], worker["cpu_percent"], worker["rss_mb"], worker["max_rss_mb"]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Drive the synthesizer from concurrent threads or processes and report throughput and latency.')
+    parser.add_argument('--workers', '-w', default=4, type=int, help="Number of concurrent workers")
+    parser.add_argument('--processes', action="store_true", default=False, help="Use worker processes instead of threads")
+    parser.add_argument('--duration', '-d', default=None, type=float, help="Seconds each worker runs (default: 10)")
+    parser.add_argument('--requests', '-n', default=None, type=int, help="Requests per worker (instead of a duration)")
+    parser.add_argument('--warmup', default=1, type=int, help="Warm-up requests per worker, not counted")
+    parser.add_argument('--mix', default=None, help="Weights of the prompt kinds, e.g. ivr=6,numbers=3,paragraph=1")
+    parser.add_argument('--prompts', default=None, help="Prompt file (kind<TAB>language<TAB>text per line) instead of the built-in mix")
+    parser.add_argument('--language', '-l', default=None, help="Only use prompts of this language (c or p)")
+    parser.add_argument('--seed', default=0, type=int, help="Random seed of the prompt choice")
+    parser.add_argument('--verbose', action="store_true", default=False, help="Print the linguistic information of every request (on stderr)")
+    parser.add_argument('--save', default=None, help="Save the results to a JSON file")
+    parser.add_argument('--compare', default=None, help="Compare with results saved by --save")
+    args = parser.parse_args()
+
+    prompts = load_prompts(args.prompts) if args.prompts != None else PROMPTS
+    weights = parse_mix(args.mix, prompts) if args.mix != None else None
+    results = load_test(args.workers, args.processes, args.duration, args.requests, args.warmup, prompts, weights,
+                        args.language, args.seed, not args.verbose)
+    baseline = None
+    if args.compare != None:
+        with open(args.compare, "r") as f:
+            baseline = json.loads(f.read())
+    report(results, baseline)
+    if args.save != None:
+        with open(args.save, "w") as f:
+            f.write(json.dumps(results, indent=1))
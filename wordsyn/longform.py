@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Bounded-memory long-form synthesis (articles, book chapters) from a file or stdin.
+
+The text is read line by line and synthesized paragraph by paragraph (a blank line ends a paragraph).
+A paragraph larger than the memory budget allows is cut at sentence ends (or, for a very long sentence,
+at any character). Each block is appended to the open output encoder as soon as it is rendered, so peak memory
+depends on the budget and not on the input size.
+
+Usage:
+    python3 word_syn.py -f chapter.txt -l p -c -o chapter.wav --max-memory 64
+    cat chapter.txt | python3 word_syn.py -f - -l c -o chapter.wav
+    cat chapter.txt | python3 word_syn.py -f - -l c -o - --format mulaw | <telephony sink>
+"""
+
+import re
+import sys
+
+# A Latin letter at a line break: the wrapped lines are joined with a space (no space between Chinese chars)
+latin_pattern = re.compile(r"[A-Za-z]")
+
+# Rough peak memory per input character while a block is rendered: the loaded 44.1 kHz unit (~0.3 s)
+# plus the growing output and the temporary copies of concatenation
+BYTES_PER_CHAR = 160 * 1024
+
+
+def open_text(path):
+    """A text stream for a file name, or stdin for '-'"""
+    if path == "-":
+        return sys.stdin
+    return open(path, "r", encoding="utf-8")
+
+
+def max_block_chars(max_memory):
+    """Largest block (in characters) that fits in the memory budget (in bytes)"""
+    return max(int(max_memory // BYTES_PER_CHAR), 1)
+
+
+def split_block(text, max_chars):
+    """
+    Description: Cut a paragraph into blocks of at most max_chars, at sentence ends where possible
+
+    Input : A paragraph and the block size
+    Output: Yields blocks of text
+    """
+    block = ""
+    for sentence in re.split(r"(?<=[。！？；!?;])", text):
+        # A sentence longer than a block is cut at any character
+        while len(sentence) > max_chars:
+            if block:
+                yield block
+                block = ""
+            yield sentence[:max_chars]
+            sentence = sentence[max_chars:]
+        if len(block) + len(sentence) > max_chars:
+            yield block
+            block = ""
+        block += sentence
+    if block.strip():
+        yield block
+
+
+def join_line(paragraph, line):
+    """Append a wrapped line to a paragraph, with a space where a Latin word meets the line break"""
+    if paragraph and (latin_pattern.match(paragraph[-1]) or latin_pattern.match(line[0])):
+        return paragraph + " " + line
+    return paragraph + line
+
+
+def iter_blocks(stream, max_chars):
+    """
+    Description: Read a text stream incrementally and yield it paragraph by paragraph
+
+    Input : A text stream and the largest block size in characters
+    Output: Yields blocks of text (paragraphs, or parts of a paragraph)
+    """
+    paragraph = ""
+    for line in stream:
+        line = line.strip()
+        if line:
+            paragraph = join_line(paragraph, line)
+            # Flush early when one paragraph alone goes over the block size
+            if len(paragraph) > max_chars:
+                blocks = list(split_block(paragraph, max_chars))
+                for block in blocks[:-1]:
+                    yield block
+                paragraph = blocks[-1] if blocks else ""
+        elif paragraph:
+            for block in split_block(paragraph, max_chars):
+                yield block
+            paragraph = ""
+    if paragraph:
+        for block in split_block(paragraph, max_chars):
+            yield block
+
+
+def synthesize_stream(stream, render, writer, max_memory):
+    """
+    Description: Synthesize a text stream block by block into an open writer
+
+    Input : A text stream, a render function (text -> numpy array at the writer's rate, int16 or float32 at full scale 1.0), a writer
+            with write(data) (an encoders.Encoder) and the memory budget in bytes
+    Output: Number of blocks and samples written
+    """
+    blocks = 0
+    samples = 0
+    for block in iter_blocks(stream, max_block_chars(max_memory)):
+        data = render(block)
+        writer.write(data)
+        blocks += 1
+        samples += len(data)
+    return blocks, samples
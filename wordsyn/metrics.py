@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+Description: In-process metrics of the synthesizer (counters and latency histograms).
+
+The pipeline stages update the metrics of the shared REGISTRY: requests and characters per language,
+unit loads vs. unit cache hits per voice, characters missing from the dictionary, bytes written per output
+format and the latency of every stage. Each metric has its own lock, only held for a dict update, so the
+cost per update is a few hundred nanoseconds even with many threads.
+The registry exports the Prometheus text format (to a file, or on a local HTTP endpoint) and can be
+snapshot (p50/p99 of the histograms included) and reset between batch runs.
+
+Usage:
+    with metrics.timer("concatenate"):
+        ...
+    metrics.REQUESTS.inc("p")
+    metrics.REGISTRY.write("tts.prom")        # or REGISTRY.serve(9464)
+    snapshot = metrics.REGISTRY.snapshot(reset=True)
+"""
+
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+from unit_index import write_atomic
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+                          for name, value in zip(names, values)) + "}"
+
+
+class Counter:
+    """
+    Description: A monotonic counter, optionally split by label values
+    """
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = dict([])
+
+    def inc(self, *labels, amount=1):
+        """Add amount (default 1) for the given label values"""
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def get(self, *labels):
+        return self.values.get(labels, 0)
+
+    def reset(self):
+        with self.lock:
+            self.values = dict([])
+
+    def snapshot(self):
+        with self.lock:
+            return dict((",".join(map(str, labels)), value) for labels, value in self.values.items())
+
+    def exposition(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        return ["{}{} {}".format(self.name, format_labels(self.labels, labels), value) for labels, value in values]
+
+
+class Histogram:
+    """
+    Description: Distribution of observed values (latencies) in fixed buckets, optionally split by label values
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # label values -> [bucket counts (+ one for values over the last bound), sum, count]
+        self.values = dict([])
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def quantile(self, q, *labels):
+        """
+        Description: Estimate a quantile from the buckets (linear within the bucket, as Prometheus does)
+
+        Input : The quantile (0-1) and the label values
+        Output: The estimated value, None if nothing was observed
+        """
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None or entry[2] == 0:
+                return None
+            counts, total = list(entry[0]), entry[2]
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if count and cumulative + count >= rank:
+                if index == len(self.buckets):
+                    # Over the last bound: the last bound is the best estimate
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def reset(self):
+        with self.lock:
+            self.values = dict([])
+
+    def snapshot(self):
+        with self.lock:
+            keys = [(labels, entry[1], entry[2]) for labels, entry in self.values.items()]
+        return dict((",".join(map(str, labels)), {"count": count, "sum": total, "p50": self.quantile(0.5, *labels),
+                                                  "p99": self.quantile(0.99, *labels)})
+                    for labels, total, count in keys)
+
+    def exposition(self):
+        with self.lock:
+            values = sorted((labels, list(entry[0]), entry[1], entry[2]) for labels, entry in self.values.items())
+        lines = []
+        for labels, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket
+                lines.append("{}_bucket{} {}".format(self.name, format_labels(self.labels + ("le",), labels + (bound,)), cumulative))
+            lines.append("{}_sum{} {}".format(self.name, format_labels(self.labels, labels), total))
+            lines.append("{}_count{} {}".format(self.name, format_labels(self.labels, labels), count))
+        return lines
+
+
+class Registry:
+    """
+    Description: A set of metrics with Prometheus export, snapshot and reset
+    """
+
+    def __init__(self):
+        self.metrics = []
+        self.server = None
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def reset(self):
+        for metric in self.metrics:
+            metric.reset()
+
+    def snapshot(self, reset=False):
+        """
+        Description: Current values of all metrics (e.g. at the end of a batch)
+
+        Input : Whether to reset the metrics afterwards
+        Output: A dict of metric name -> {label values joined by ",": value (counters) or count/sum/p50/p99 (histograms)}
+        """
+        snapshot = dict((metric.name, metric.snapshot()) for metric in self.metrics)
+        if reset:
+            self.reset()
+        return snapshot
+
+    def to_prometheus(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP {} {}".format(metric.name, metric.help))
+            lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+            lines.extend(metric.exposition())
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Write the Prometheus text to a file (e.g. for the node exporter textfile collector)"""
+        write_atomic(path, self.to_prometheus())
+
+    def serve(self, port, host="127.0.0.1"):
+        """
+        Description: Serve the metrics on http://host:port/metrics from a background thread
+
+        Input : The port and the address to bind (local only by default)
+        Output: The HTTP server (call shutdown() to stop it)
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+        return self.server
+
+
+# Metrics of the synthesizer
+REGISTRY = Registry()
+REQUESTS = REGISTRY.counter("tts_requests_total", "Synthesis requests", ("language",))
+CHARS = REGISTRY.counter("tts_chars_synthesized_total", "Characters synthesized", ("language",))
+MISSING_CHARS = REGISTRY.counter("tts_missing_chars_total", "Characters not found in the phone dictionary")
+UNIT_LOADS = REGISTRY.counter("tts_unit_loads_total", "Units read from disk or decoded from the unit store", ("voice",))
+UNIT_HITS = REGISTRY.counter("tts_unit_cache_hits_total", "Units served from the voice cache", ("voice",))
+UNIT_FALLBACKS = REGISTRY.counter("tts_unit_fallbacks_total", "Substitute units loaded for syllables the voice has no unit for", ("voice",))
+WORD_UNITS = REGISTRY.counter("tts_word_units_total", "Tokens served by a pre-joined word unit", ("voice",))
+BYTES_WRITTEN = REGISTRY.counter("tts_bytes_written_total", "Bytes of audio written", ("format",))
+SPLICE_BYTES = REGISTRY.counter("tts_splice_bytes_total", "Bytes of spliced outputs written from unit views or computed joins", ("source",))
+STAGE_SECONDS = REGISTRY.histogram("tts_stage_seconds", "Latency of the pipeline stages", ("stage",))
+
+
+@contextmanager
+def timer(stage):
+    """Observe the time spent in the with block as the latency of a stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage)
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Pitch-mark detection and a compact pitch-mark index for the voice packs (offline pass for
+the intonation stage, see psola.py).
+
+F0 is estimated for all frames of a unit at once (batched FFT autocorrelation), then one pitch mark is
+placed per period at the local waveform peak; unvoiced parts get evenly spaced marks. The marks of all
+units of a voice are stored in one .npz in the cache folder:
+    names   : unit names (wav file name without .wav)
+    offsets : int64, marks of unit i are marks[offsets[i]:offsets[i+1]]
+    marks   : int32 sample positions
+    voiced  : bool, one per mark
+    dir_mtime, mtimes : mtime_ns of the unit folder and of every unit when it was indexed
+The index is only used while the unit folder still holds the same wavs (same names and mtimes), so the
+marks of re-recorded or replaced units are detected again instead of taken from the old audio.
+
+Usage:
+    python3 pitchmarks.py [--voices .] [--voice jyutping-wong]
+"""
+
+import os
+import argparse
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import simpleaudio
+from unit_index import cache_path
+
+# Default F0 search range (Hz) and analysis frames (seconds)
+F0_MIN = 60
+F0_MAX = 400
+FRAME = 0.04
+HOP = 0.01
+# Normalised autocorrelation needed to call a frame voiced, and the energy floor (int16 scale, RMS)
+VOICING_THRESHOLD = 0.45
+SILENCE_RMS = 100.0
+# Spacing of marks in unvoiced parts (seconds)
+UNVOICED_STEP = 0.01
+# Units not in the index whose marks are kept after detecting them on the fly (LRU)
+EXTRA_UNITS = 256
+
+
+def estimate_f0(data, rate, fmin=F0_MIN, fmax=F0_MAX):
+    """
+    Description: Frame-wise period estimation by autocorrelation, all frames in one batched FFT
+
+    Input : A numpy array of samples and its sample rate
+    Output: Frame centres (samples), periods (samples, 0 if unvoiced) and a voiced flag per frame
+    """
+    x = np.asarray(data, dtype=np.float32)
+    frame = int(FRAME * rate)
+    hop = int(HOP * rate)
+    if len(x) < frame:
+        x = np.concatenate((x, np.zeros(frame - len(x), dtype=np.float32)))
+    frames = np.lib.stride_tricks.sliding_window_view(x, frame)[::hop]
+    frames = frames - frames.mean(axis=1, keepdims=True)
+    nfft = 1 << int(np.ceil(np.log2(2 * frame)))
+    spectrum = np.fft.rfft(frames * np.hanning(frame), nfft)
+    autocorr = np.fft.irfft(np.abs(spectrum) ** 2, nfft)[:, :frame]
+
+    low = max(int(rate / fmax), 1)
+    high = min(int(rate / fmin), frame - 1)
+    lag = low + np.argmax(autocorr[:, low:high], axis=1)
+    energy = autocorr[:, 0]
+    strength = autocorr[np.arange(len(lag)), lag] / np.maximum(energy, 1e-9)
+    # autocorr[0] of a Hann-windowed frame is about 0.375 * frame * RMS^2
+    rms = np.sqrt(energy / (0.375 * frame))
+    voiced = (strength > VOICING_THRESHOLD) & (rms > SILENCE_RMS)
+
+    centres = np.arange(len(lag)) * hop + frame // 2
+    return centres, np.where(voiced, lag, 0), voiced
+
+
+def find_marks(data, rate):
+    """
+    Description: Place one pitch mark per period (at the local peak) in voiced parts, evenly spaced marks elsewhere
+
+    Input : A numpy array of samples and its sample rate
+    Output: An int32 array of mark positions and a bool array marking the voiced ones
+    """
+    x = np.asarray(data, dtype=np.float32)
+    if len(x) == 0:
+        return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=bool)
+    centres, periods, voiced = estimate_f0(x, rate)
+    step = int(UNVOICED_STEP * rate)
+    # Period and voicing of every sample, from the nearest frames
+    positions = np.arange(len(x))
+    sample_period = np.interp(positions, centres[voiced], periods[voiced]) if voiced.any() else np.full(len(x), step)
+    sample_voiced = np.interp(positions, centres, voiced.astype(np.float32)) > 0.5
+
+    marks = []
+    flags = []
+    t = 0
+    while t < len(x):
+        if sample_voiced[t]:
+            period = int(sample_period[t])
+            # Snap to the waveform peak within a quarter period around the expected position
+            start = max(t - period // 4, 0)
+            end = min(t + period // 4 + 1, len(x))
+            peak = start + int(np.argmax(x[start:end]))
+            if marks and peak <= marks[-1]:
+                peak = marks[-1] + period
+            if peak >= len(x):
+                break
+            marks.append(peak)
+            flags.append(True)
+            t = peak + period
+        else:
+            marks.append(t)
+            flags.append(False)
+            t += step
+    return np.array(marks, dtype=np.int32), np.array(flags, dtype=bool)
+
+
+def index_path(voice):
+    return cache_path("pitchmarks.npz", voice.units)
+
+
+def unit_mtimes(folder):
+    """mtime_ns of the folder and of every wav in it (name without .wav -> mtime_ns)"""
+    mtimes = dict([])
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.endswith(".wav"):
+                mtimes[entry.name[:-4]] = entry.stat().st_mtime_ns
+    return os.stat(folder).st_mtime_ns, mtimes
+
+
+def build_index(voice):
+    """
+    Description: Detect the pitch marks of every unit of a voice and save them as one index
+
+    Input : A voices.Voice instance
+    Output: The path of the saved index
+    """
+    dir_mtime, mtimes = unit_mtimes(voice.units)
+    names = sorted(mtimes)
+    offsets = [0]
+    all_marks = []
+    all_voiced = []
+    for name in names:
+        # Read directly, the whole voice would not fit in the voice's unit cache
+        rate, data = simpleaudio.read_wav(os.path.join(voice.units, name + ".wav"))
+        # The silence threshold is on the 16 bit scale
+        marks, voiced = find_marks(simpleaudio.to_int16(data, dither=False), rate)
+        all_marks.append(marks)
+        all_voiced.append(voiced)
+        offsets.append(offsets[-1] + len(marks))
+    path = index_path(voice)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez(path, names=np.array(names), offsets=np.array(offsets, dtype=np.int64),
+             marks=np.concatenate(all_marks) if all_marks else np.zeros(0, dtype=np.int32),
+             voiced=np.concatenate(all_voiced) if all_voiced else np.zeros(0, dtype=bool),
+             dir_mtime=np.int64(dir_mtime), mtimes=np.array([mtimes[name] for name in names], dtype=np.int64))
+    return path
+
+
+class PitchmarkIndex:
+    """
+    Description: Pitch marks of the units of one voice, from the saved index (detected on the fly for
+    units that are not in it, e.g. when the offline pass has not been run or the units have changed since)
+    """
+
+    def __init__(self, voice):
+        self.voice = voice
+        self.row = dict([])
+        self.lock = threading.Lock()
+        self.extra = OrderedDict()
+        self.names = self.offsets = self.marks = self.voiced = None
+        try:
+            with np.load(index_path(voice)) as index:
+                if self.is_valid(index):
+                    self.names = index["names"]
+                    self.offsets = index["offsets"]
+                    self.marks = index["marks"]
+                    self.voiced = index["voiced"]
+                    self.row = dict((str(name), i) for i, name in enumerate(self.names))
+        except (OSError, ValueError):
+            pass
+
+    def is_valid(self, index):
+        """The index is valid when the unit folder has the wavs it was built from (names and mtimes)"""
+        if "dir_mtime" not in index or "mtimes" not in index:
+            return False
+        dir_mtime, mtimes = unit_mtimes(self.voice.units)
+        if int(index["dir_mtime"]) != dir_mtime:
+            return False
+        return sorted(mtimes) == [str(name) for name in index["names"]] and \
+            [mtimes[str(name)] for name in index["names"]] == index["mtimes"].tolist()
+
+    @property
+    def nbytes(self):
+        """Resident size of the marks (the index and the units detected on the fly)"""
+        arrays = [self.names, self.offsets, self.marks, self.voiced]
+        with self.lock:
+            arrays += [array for marks in self.extra.values() for array in marks]
+        return sum(array.nbytes for array in arrays if array is not None)
+
+    def get(self, name, data):
+        """Pitch marks and voiced flags of a unit (by wav name without .wav, data is used if it is not indexed)"""
+        i = self.row.get(name)
+        if i is not None:
+            start, end = self.offsets[i], self.offsets[i+1]
+            return self.marks[start:end], self.voiced[start:end]
+        with self.lock:
+            if name in self.extra:
+                self.extra.move_to_end(name)
+                return self.extra[name]
+        # Detected outside the lock (two threads may detect the same unit, the result is the same)
+        marks = find_marks(simpleaudio.to_int16(data, dither=False), self.voice.rate)
+        with self.lock:
+            self.extra[name] = marks
+            while len(self.extra) > EXTRA_UNITS:
+                self.extra.popitem(last=False)
+        return marks
+
+
+if __name__ == "__main__":
+    import voices
+    parser = argparse.ArgumentParser(description='Build the pitch-mark index of the voice packs.')
+    parser.add_argument('--voices', default=".", help="Folder containing voice packs (*/voice.json)")
+    parser.add_argument('--voice', default=None, help="Only index this voice")
+    args = parser.parse_args()
+    registry = voices.VoiceRegistry(args.voices)
+    for name in registry.voices:
+        if args.voice in (None, name):
+            print("Indexing pitch marks of", name, "->", build_index(registry.voices[name]))
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Overlapped frontend / unit loading / assembly stages.
+
+The frontend (word segmentation and dictionary lookup) runs on its own thread and hands every token to
+the prefetcher as soon as its syllables are known. The units of the token are loaded on a background
+thread pool right away, while the frontend moves on to the next token. The assembly stage iterates over
+the prefetcher and gets the tokens in their original order, each one as soon as all its units are loaded,
+so disk reads overlap with both the frontend and the concatenation. The queue of tokens in flight is
+bounded, the frontend waits when the assembly falls behind, so memory stays predictable. If the assembly
+fails or stops early, the prefetcher is cancelled: the frontend stops at its next token and the queue is
+drained, so the frontend thread never stays blocked on a full queue.
+
+Usage:
+    prefetcher = UnitPrefetcher(functools.partial(load_unit, voice=voice))
+    prefetcher.start(lambda: Sequence(phrase, language, voice.lexicon, on_token=prefetcher.submit))
+    for token in prefetcher:
+        ...                           # every char of the token has its unit loaded
+    inputseq = prefetcher.result()    # the Sequence built by the frontend
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Threads reading unit files (shared by all prefetchers)
+PREFETCH_WORKERS = 4
+# Largest number of tokens loaded ahead of the assembly stage
+MAX_PENDING = 32
+
+# Seconds between two checks of the cancel flag while the queue is full
+PUT_TIMEOUT = 0.1
+
+# Shared unit loading pool, created on first use
+pool = None
+pool_lock = threading.Lock()
+
+
+def get_pool():
+    """The shared unit loading pool"""
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+    return pool
+
+
+def reset_pool():
+    """In a forked child: the parent's pool threads do not exist there, create a new pool on first use"""
+    global pool, pool_lock
+    pool = None
+    pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=reset_pool)
+
+
+class PrefetchCancelled(Exception):
+    """Raised in the frontend thread when the assembly stage gave up on its tokens"""
+
+
+class UnitPrefetcher:
+    """
+    Description: Bounded queue of tokens whose units are being loaded, consumed in order
+    """
+    # End of the frontend output
+    DONE = object()
+
+    def __init__(self, load, max_pending=MAX_PENDING, executor=None, load_word=None):
+        """
+        Input : The load function (called with each Char, sets its unit), the largest number of tokens in
+                flight, optionally the executor to load units on (default: the shared pool) and a function
+                called with each token first, returning a function that loads the whole token from one
+                pre-joined word unit, or None to load its chars one by one
+        """
+        self.load = load
+        self.load_word = load_word
+        self.executor = executor if executor is not None else get_pool()
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.cancelled = threading.Event()
+        self.thread = None
+        self.output = None
+        self.error = None
+
+    def submit(self, token):
+        """Start loading the units of a token (blocks while max_pending tokens are waiting for assembly)"""
+        if self.cancelled.is_set():
+            raise PrefetchCancelled()
+        loader = self.load_word(token) if self.load_word is not None else None
+        if loader is not None:
+            futures = [self.executor.submit(loader)]
+        else:
+            futures = [self.executor.submit(self.load, eachchar) for eachchar in token.chars]
+        self.put((token, futures))
+
+    def put(self, item):
+        """Queue an item, waiting while the queue is full unless the prefetcher is cancelled"""
+        while True:
+            if self.cancelled.is_set():
+                for future in item[1] if isinstance(item, tuple) else []:
+                    future.cancel()
+                raise PrefetchCancelled()
+            try:
+                self.queue.put(item, timeout=PUT_TIMEOUT)
+                return
+            except queue.Full:
+                pass
+
+    def start(self, frontend):
+        """Run the frontend (a function calling submit() for every token) on its own thread"""
+        def run():
+            try:
+                self.output = frontend()
+            except BaseException as error:
+                self.error = error
+            finally:
+                # Never blocks for good: the consumer takes it, or cancel() drains the queue
+                try:
+                    self.put(self.DONE)
+                except PrefetchCancelled:
+                    pass
+        self.thread = threading.Thread(target=run, name="frontend", daemon=True)
+        self.thread.start()
+
+    def __iter__(self):
+        """Yield the tokens in order, each one once all its units are loaded"""
+        finished = False
+        try:
+            while True:
+                item = self.queue.get()
+                if item is self.DONE:
+                    break
+                token, futures = item
+                for future in futures:
+                    # Re-raises an error of the load function
+                    future.result()
+                yield token
+            finished = True
+        finally:
+            # A unit failed to load, or the consumer stopped iterating (GeneratorExit)
+            if not finished:
+                self.cancel()
+        if self.error is not None:
+            raise self.error
+
+    def cancel(self):
+        """Stop the frontend and drop the tokens in flight, return once the frontend thread has ended"""
+        self.cancelled.set()
+        while True:
+            try:
+                item = self.queue.get(timeout=PUT_TIMEOUT)
+            except queue.Empty:
+                if self.thread is None or not self.thread.is_alive():
+                    break
+                continue
+            if item is not self.DONE:
+                for future in item[1]:
+                    future.cancel()
+        if self.thread is not None:
+            self.thread.join()
+
+    def result(self):
+        """The output of the frontend (wait for it to finish)"""
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.output
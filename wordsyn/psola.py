@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Vectorized TD-PSOLA for the intonation stage (README step 3.8).
+
+Each syllable is re-synthesized around its pitch marks (see pitchmarks.py): synthesis marks are placed
+at the target period, starting from the first analysis mark mapped to the output time, every synthesis
+mark takes the Hann-windowed two-period grain of the nearest analysis mark, and all grains are
+overlap-added at once (one gather + one bincount), so the cost is a few NumPy operations per syllable.
+Without a change of F0 or duration the synthesis marks are the analysis marks and the unit comes back as
+it is.
+
+Usage:
+    contour = declination(len(syllables))
+    new = td_psola(data, marks, voiced, f0_ratio=contour[i], duration=1.2)
+"""
+
+import numpy as np
+
+
+def td_psola(data, marks, voiced, f0_ratio=1.0, duration=1.0):
+    """
+    Description: Change the F0 and the duration of a unit by TD-PSOLA
+
+    Input : A numpy array of samples, its pitch marks and voiced flags, the F0 ratio (scalar, or a contour
+            of any length spread over the unit) and the duration ratio (2.0 = twice as long)
+    Output: A float32 numpy array of the modified samples
+    NOTE  : Unvoiced parts keep their spacing (only their duration changes)
+    """
+    x = np.asarray(data, dtype=np.float32)
+    marks = np.asarray(marks, dtype=np.int64)
+    n_in = len(x)
+    n_out = int(round(n_in * duration))
+    if len(marks) < 2 or n_out == 0:
+        # Nothing to work with: only stretch the duration
+        return np.interp(np.arange(n_out) / duration, np.arange(n_in), x).astype(np.float32) if n_in else x
+
+    # Analysis marks extended by whole periods over both ends (the first and last periods repeat), so every
+    # input sample lies between two marks and under two grains
+    mark_voiced = np.asarray(voiced, dtype=bool)
+    first, last = max(marks[1] - marks[0], 1), max(marks[-1] - marks[-2], 1)
+    before = marks[0] - first * np.arange(-(-marks[0] // first), 0, -1)
+    after = marks[-1] + last * np.arange(1, -(-(n_in - 1 - marks[-1]) // last) + 1)
+    marks = np.concatenate((before, marks, after))
+    mark_voiced = np.concatenate((np.repeat(mark_voiced[:1], len(before)), mark_voiced, np.repeat(mark_voiced[-1:], len(after))))
+    mark_period = np.maximum(np.diff(marks), 1)
+
+    # Target period at every output sample (and a margin of periods around the output): the analysis period
+    # of the interval of the mapped input position, divided by the F0 ratio where it is voiced
+    ratio = np.asarray(f0_ratio, dtype=np.float64)
+    margin = int(np.ceil(mark_period.max() / min(ratio.min(), 1.0))) + 1
+    t = np.arange(-margin, n_out + margin)
+    interval = np.clip(np.searchsorted(marks, t / duration, side="right") - 1, 0, len(mark_period) - 1)
+    period = mark_period[interval].astype(np.float64)
+    if ratio.ndim > 0:
+        ratio = np.interp(np.linspace(0, len(ratio) - 1, n_out), np.arange(len(ratio)), ratio)
+        ratio = np.concatenate((np.repeat(ratio[:1], margin), ratio, np.repeat(ratio[-1:], margin)))
+    period = np.where(mark_voiced[interval], period / ratio, period)
+
+    # Synthesis marks: one every target period, where the accumulated phase passes an integer. The phase is
+    # 0 where the first analysis mark is mapped, so without a change the synthesis marks are the analysis marks
+    phase = np.concatenate(([0.0], np.cumsum(1.0 / period)[:-1]))
+    anchor = int(round(marks[len(before)] * duration)) + margin
+    step = np.floor(phase - phase[anchor] + 1e-6)
+    synthesis = t[np.flatnonzero(np.diff(step)) + 1]
+
+    # Nearest analysis mark of every synthesis mark
+    source = synthesis / duration
+    k = np.clip(np.searchsorted(marks, source), 1, len(marks) - 1)
+    k = np.where(np.abs(marks[k - 1] - source) <= np.abs(marks[k] - source), k - 1, k)
+    # Grains span the previous and the next analysis period: the Hann halves of neighbour marks add up to 1
+    left = mark_period[np.maximum(k - 1, 0)]
+    right = mark_period[np.minimum(k, len(mark_period) - 1)]
+
+    # All grains at once: rows = grains, columns = offsets around the mark, windowed by each grain's own Hann
+    offsets = np.arange(-left.max(), right.max() + 1)
+    half = np.where(offsets[None, :] < 0, left[:, None], right[:, None])
+    window = 0.5 + 0.5 * np.cos(np.pi * offsets[None, :] / half)
+    window[np.abs(offsets)[None, :] > half] = 0.0
+    source_pos = marks[k][:, None] + offsets[None, :]
+    inside = (source_pos >= 0) & (source_pos < n_in)
+    grains = x[np.clip(source_pos, 0, n_in - 1)] * window * inside
+
+    # Overlap-add
+    target_pos = synthesis[:, None] + offsets[None, :]
+    keep = (target_pos >= 0) & (target_pos < n_out) & (window > 0)
+    return np.bincount(target_pos[keep], weights=grains[keep], minlength=n_out).astype(np.float32)
+
+
+def declination(length, start=1.1, end=0.9):
+    """F0 ratio of each syllable for a sentence whose pitch falls linearly from start to end"""
+    if length <= 1:
+        return np.full(length, start)
+    return np.linspace(start, end, length)
+
+
+def emphasis(contour, indexes, boost=1.2):
+    """Raise the F0 ratio of the emphasised syllables"""
+    contour = np.array(contour, dtype=np.float64)
+    contour[list(indexes)] *= boost
+    return contour
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Table-driven tone sandhi / changed-tone rules (frontend step 3.6, the contextual readings).
+
+The rules of a language (RULES) say which tone a syllable takes in the context of its neighbours, e.g. a
+Mandarin third tone before another third tone becomes a second tone. They are compiled once per voice
+lexicon into small lookup tables:
+    - codepoint -> syllable ID (the first reading in the lexicon, -1 for chars it does not cover)
+    - codepoint -> context group (the chars the rules name in a context, e.g. the numerals around 一)
+    - syllable ID x tone -> syllable ID with that tone (itself if neither the lexicon nor the voice has it)
+    - (rule row, previous class, next class) -> new tone (0: unchanged)
+where the class of a syllable is its context group and tone (tone 0: a pause, punctuation or a char without
+a reading, i.e. a boundary), and the row is the current char (for the rules about one char) or its tone.
+Applying the rules to an utterance is then one pass of NumPy gathers over its codepoints, whatever the
+number of rules. Every position is rewritten from the original context (not from the result of its left
+neighbour), so a run of third tones becomes 2 ... 2 3.
+A rule only changes the tone of a syllable (through the syllable ID x tone table), never its onset or rime:
+the consonant-vowel coarticulation rules of step 3.7 are not done here.
+
+Rule format: (current, previous, next, new tone), the first rule that matches a position wins
+    current : a tone "T1".."T6" or one char
+    previous / next : space separated alternatives, each "*" (anything), "#" (a boundary), a tone "T1".."T6"
+                      or a group name of GROUPS (the chars of the group, any tone)
+    new tone: the tone the current syllable takes (its own tone to stop the later rules)
+
+Usage:
+    changed = apply("你好，一起去。", "p", voice.lexicon, voice.syllables)   -> {0: "ni2", 3: "yi4"}
+"""
+
+import numpy as np
+
+from lang_detect import TABLE_SIZE
+
+# Tone classes: 0 is a boundary, 1-6 the tone numbers, 7 a syllable without a tone number
+TONES = 8
+
+# Chars named in the contexts of the rules, per language
+GROUPS = {
+    "p": {
+        "NUM": "零〇二两三四五六七八九十百千万亿",
+        "ORDINAL": "第",
+        "DATE": "月日号年",
+    },
+    "c": {
+        "PREFIX": "阿亞",
+        "BA": "爸",
+        "MA": "媽",
+        "GO": "哥",
+        "ZE": "姐",
+        "MUI": "妹",
+        "DAI": "弟",
+    },
+}
+
+RULES = {
+    # Mandarin: 一 keeps its first tone in numbers, ordinals, dates and at the end of a phrase, otherwise it
+    # takes tone 2 before a fourth tone and tone 4 before the other tones; 不 takes tone 2 before a fourth
+    # tone; a third tone before a third tone becomes a second tone
+    "p": [
+        ("一", "NUM ORDINAL", "*", 1),
+        ("一", "*", "# NUM DATE", 1),
+        ("一", "*", "T4", 2),
+        ("一", "*", "T1 T2 T3", 4),
+        ("不", "*", "T4", 2),
+        ("T3", "*", "T3", 2),
+    ],
+    # Cantonese changed tones: reduplicated kinship terms (爸爸 baa4 baa1, 媽媽 maa4 maa1, 哥哥 go4 go1,
+    # 姐姐 ze4 ze1, 妹妹 mui6 mui2, 弟弟 dai6 dai2) and the low falling tone of a name after 阿 (阿陳 can2, but 阿爸)
+    "c": [
+        ("爸", "BA", "*", 1),
+        ("爸", "PREFIX", "*", 4),
+        ("媽", "*", "MA", 4),
+        ("哥", "*", "GO", 4),
+        ("姐", "*", "ZE", 4),
+        ("妹", "*", "MUI", 6),
+        ("弟", "DAI", "*", 2),
+        ("T4", "PREFIX", "*", 2),
+    ],
+}
+
+
+def split_tone(syllable):
+    """A romanised syllable -> (base, tone number), tone 7 when it has no tone number"""
+    if syllable[-1:].isdigit():
+        return syllable[:-1], int(syllable[-1])
+    return syllable, TONES - 1
+
+
+class SandhiEngine:
+    """
+    Description: The rules of a language compiled against a lexicon (char -> readings)
+    """
+
+    def __init__(self, lexicon, rules, groups, syllables=None):
+        """
+        Input : The lexicon, the rules and context groups of its language, and optionally the units of the voice
+                (syllables a rule may change to although no char of the lexicon reads them, e.g. ming2)
+        """
+        self.lexicon = lexicon
+        self.voice_syllables = syllables
+        # (1) Syllable inventory and the codepoint -> syllable ID table
+        syllables = sorted(set(phone for phones in lexicon.values() for phone in phones
+                               if phone not in ("sil_200", "sil_400")) | set(syllables or ()))
+        self.syllables = np.array(syllables, dtype=object)
+        ids = dict((syllable, index) for index, syllable in enumerate(syllables))
+        self.char_ids = np.full(TABLE_SIZE, -1, dtype=np.int32)
+        for char, phones in lexicon.items():
+            if len(char) == 1 and ord(char) < TABLE_SIZE and phones and phones[0] in ids:
+                self.char_ids[ord(char)] = ids[phones[0]]
+        # Tone of every syllable ID, the last entry is for -1 (no reading: a boundary)
+        self.tones = np.zeros(len(syllables) + 1, dtype=np.int8)
+        self.tones[:len(syllables)] = [split_tone(syllable)[1] for syllable in syllables]
+        # Same syllable with another tone
+        self.retone = np.repeat(np.arange(len(syllables), dtype=np.int32)[:, None], TONES, axis=1)
+        for syllable, index in ids.items():
+            base, tone = split_tone(syllable)
+            for other in range(1, TONES - 1):
+                self.retone[index, other] = ids.get(base + str(other), index)
+
+        # (2) Context groups (group 0: the chars no rule names)
+        self.group_names = ["*"] + sorted(groups)
+        self.char_groups = np.zeros(TABLE_SIZE, dtype=np.int16)
+        for number, name in enumerate(self.group_names[1:], 1):
+            for char in groups[name]:
+                if self.char_groups[ord(char)]:
+                    raise ValueError("{} is in two context groups".format(char))
+                self.char_groups[ord(char)] = number
+        classes = len(self.group_names) * TONES
+
+        # (3) Rule rows: 0 (no rule), one per tone a rule names, one per char a rule names
+        tone_rows = sorted(set(int(current[1:]) for current, _, _, _ in rules if self.is_tone(current)))
+        chars = sorted(set(current for current, _, _, _ in rules if not self.is_tone(current)))
+        self.tone_rows = np.zeros(TONES, dtype=np.int16)
+        for row, tone in enumerate(tone_rows, 1):
+            self.tone_rows[tone] = row
+        self.char_rows = np.zeros(TABLE_SIZE, dtype=np.int16)
+        for row, char in enumerate(chars, len(tone_rows) + 1):
+            self.char_rows[ord(char)] = row
+        self.table = np.zeros((len(tone_rows) + len(chars) + 1, classes, classes), dtype=np.int8)
+
+        # (4) Fill the table, the last rule first so the earlier rules overwrite it (the first match wins)
+        for current, previous, following, tone in reversed(rules):
+            rows = [self.tone_rows[int(current[1:])]] if self.is_tone(current) else [self.char_rows[ord(current)]]
+            if self.is_tone(current):
+                # The chars with their own row still follow the rules of their tone (after their own rules)
+                rows += [self.char_rows[ord(char)] for char in chars
+                         if self.char_ids[ord(char)] >= 0 and self.tones[self.char_ids[ord(char)]] == int(current[1:])]
+            before, after = self.context(previous), self.context(following)
+            for row in rows:
+                for previous_class in before:
+                    self.table[row, previous_class, after] = tone
+
+    @staticmethod
+    def is_tone(spec):
+        return len(spec) == 2 and spec[0] == "T" and spec[1].isdigit()
+
+    def context(self, spec):
+        """The class numbers matched by a context (see the rule format)"""
+        matched = set()
+        groups = range(len(self.group_names))
+        for item in spec.split():
+            if item == "*":
+                matched.update(range(len(self.group_names) * TONES))
+            elif item == "#":
+                matched.add(0)
+            elif self.is_tone(item):
+                matched.update(group * TONES + int(item[1:]) for group in groups)
+            elif item in self.group_names:
+                group = self.group_names.index(item)
+                matched.update(range(group * TONES, (group + 1) * TONES))
+            else:
+                raise ValueError("Unknown context in a sandhi rule: {}".format(item))
+        return sorted(matched)
+
+    def rewrite(self, text):
+        """
+        Description: Apply the rules to a text, one vectorized pass
+
+        Input : The (normalized) text
+        Output: The syllable IDs before and after the rules (-1 for chars without a reading)
+        """
+        codepoints = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+        codepoints = np.where(codepoints < TABLE_SIZE, codepoints, 0)
+        ids = self.char_ids[codepoints]
+        tones = self.tones[ids]
+        classes = self.char_groups[codepoints] * TONES + tones
+        # Neighbour classes, the ends of the text are boundaries
+        previous = np.concatenate(([0], classes[:-1]))
+        following = np.concatenate((classes[1:], [0]))
+        rows = np.where(self.char_rows[codepoints] > 0, self.char_rows[codepoints], self.tone_rows[tones])
+        new_tones = self.table[rows, previous, following]
+        changed = (new_tones > 0) & (ids >= 0)
+        result = ids.copy()
+        result[changed] = self.retone[ids[changed], new_tones[changed]]
+        return ids, result
+
+    def apply(self, text):
+        """
+        Description: The readings the rules change in a text
+
+        Input : The (normalized) text
+        Output: A dict position of the char in the text -> its new syllable (only the changed chars)
+        """
+        ids, result = self.rewrite(text)
+        positions = np.flatnonzero(ids != result)
+        return dict(zip(positions.tolist(), self.syllables[result[positions]].tolist()))
+
+
+# One engine per language, rebuilt when the lexicon of the language changes (e.g. another voice)
+_engines = dict([])
+
+
+def get_engine(language, lexicon, syllables=None):
+    """The compiled rules of a language for a lexicon and the units of a voice (None if the language has no rules)"""
+    if language not in RULES:
+        return None
+    engine = _engines.get(language)
+    if engine is None or engine.lexicon is not lexicon or engine.voice_syllables is not syllables:
+        engine = _engines[language] = SandhiEngine(lexicon, RULES[language], GROUPS[language], syllables)
+    return engine
+
+
+def apply(text, language, lexicon, syllables=None):
+    """
+    Description: Tone sandhi / changed tones of a text
+
+    Input : The normalized text, the language (c or p), the lexicon of the voice (char -> readings) and
+            optionally the names of its units (see voices.Voice.syllables)
+    Output: A dict position of the char in the text -> its new syllable (only the changed chars)
+    """
+    engine = get_engine(language, lexicon, syllables)
+    if engine is None:
+        return dict([])
+    return engine.apply(text)
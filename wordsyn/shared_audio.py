@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Zero-copy audio transfer from worker processes to the parent.
+
+A worker writes its finished samples once into a shared memory segment (or a memory-mapped temp file) and
+only sends back a small descriptor (kind, name, offset, length, rate, dtype). The parent maps the same
+memory and reads the samples in place, so the cost of handing over a result does not grow with its length
+(pickling the array would copy it twice more). The parent owns the memory after the hand-over and frees it
+with release(); until then the segment stays allocated even if the worker exits.
+
+Usage:
+    prepare()                             # parent process, before the workers start
+    # worker process
+    descriptor = export(data, rate)
+    # parent process
+    with attach(descriptor) as audio:
+        output = process(audio.data)      # do not keep references to audio.data after the with block
+"""
+
+import os
+import tempfile
+from collections import namedtuple
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+# Transfer backends
+SHARED_MEMORY = "shm"
+MMAP_FILE = "file"
+# Folder of the memory-mapped temp files (RAM-backed where available)
+MMAP_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+# What is sent over the queue instead of the samples
+Descriptor = namedtuple("Descriptor", "kind name offset length rate dtype")
+
+
+def prepare():
+    """
+    Description: Parent side, call before starting the worker processes
+
+    Starts the resource tracker of the parent, so forked workers share it: a segment created by a worker
+    is then owned by one tracker (no warnings when the workers exit), and it is still freed at shutdown if
+    the parent never releases it.
+    """
+    resource_tracker.ensure_running()
+
+
+def export(data, rate, kind=SHARED_MEMORY):
+    """
+    Description: Worker side, copy samples into shared memory once
+
+    Input : A numpy array of samples, its sample rate and the backend (SHARED_MEMORY or MMAP_FILE)
+    Output: A Descriptor for attach() in the parent (the parent has to release it)
+    """
+    data = np.ascontiguousarray(data)
+    if kind == SHARED_MEMORY:
+        # NOTE: A segment cannot be empty, an empty result still takes one byte
+        segment = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+        np.ndarray(data.shape, dtype=data.dtype, buffer=segment.buf)[:] = data
+        name = segment.name
+        # Only this process's mapping is closed, the segment lives on until the parent unlinks it
+        segment.close()
+    elif kind == MMAP_FILE:
+        handle, name = tempfile.mkstemp(suffix=".pcm", dir=MMAP_DIR)
+        with os.fdopen(handle, "wb") as f:
+            f.write(memoryview(data).cast("B"))
+    else:
+        raise ValueError("Unknown transfer backend: {}".format(kind))
+    return Descriptor(kind, name, 0, len(data), rate, data.dtype.str)
+
+
+class SharedAudio:
+    """
+    Description: Parent side, the samples of a descriptor mapped in place (read-only view)
+    """
+
+    def __init__(self, descriptor):
+        self.descriptor = descriptor
+        self.rate = descriptor.rate
+        dtype = np.dtype(descriptor.dtype)
+        self.segment = None
+        if descriptor.kind == SHARED_MEMORY:
+            self.segment = shared_memory.SharedMemory(name=descriptor.name)
+            self.data = np.ndarray(descriptor.length, dtype=dtype, buffer=self.segment.buf, offset=descriptor.offset)
+        elif descriptor.length == 0:
+            # An empty file cannot be memory-mapped
+            self.data = np.zeros(0, dtype=dtype)
+        else:
+            self.data = np.memmap(descriptor.name, dtype=dtype, mode="r", offset=descriptor.offset, shape=(descriptor.length,))
+        self.data.flags.writeable = False
+
+    def release(self):
+        """Unmap and free the memory (every view of self.data must be gone by then)"""
+        if self.data is None:
+            return
+        self.data = None
+        if self.segment is not None:
+            try:
+                self.segment.close()
+            except BufferError:
+                # A view is still alive (e.g. held by the traceback of an error): the mapping goes away with
+                # it, the segment is freed by unlink() anyway
+                pass
+            self.segment.unlink()
+            self.segment = None
+        else:
+            os.remove(self.descriptor.name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+def attach(descriptor):
+    """Map the samples of a descriptor from export() (call release() on the result when done)"""
+    return SharedAudio(descriptor)
@@ -1,7 +1,8 @@
-import pyaudio
+# NOTE: pyaudio (PortAudio) is only imported when a stream is opened for playing or recording
+import os
 import numpy as np
-import wave
 import math
+import struct
 import random
 
 from time import sleep
@@ -12,23 +13,171 @@ from time import sleep
 # seed the random number generator
 random.seed()
 
+# PortAudio sample formats (same values as pyaudio.paFloat32 ... pyaudio.paUInt8) and their sample size in bytes
+paFloat32 = 1
+paInt32 = 2
+paInt24 = 4
+paInt16 = 8
+paInt8 = 16
+paUInt8 = 32
+SAMPLE_SIZES = {paFloat32: 4, paInt32: 4, paInt24: 3, paInt16: 2, paInt8: 1, paUInt8: 1}
+# Numpy type of the samples of every format (24 bit samples are held in the top 3 bytes of an int32)
+NP_TYPES = {paFloat32: np.float32, paInt32: np.int32, paInt24: np.int32, paInt16: np.int16, paInt8: np.int8, paUInt8: np.uint8}
+# Bits of every integer format (the quantisation step of the dithered output)
+SAMPLE_BITS = {paInt32: 32, paInt24: 24, paInt16: 16, paInt8: 8, paUInt8: 8}
+
+# WAV format tags
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+# (format tag, bits per sample) -> format (8 bit WAV is unsigned)
+WAV_FORMATS = {(WAVE_FORMAT_PCM, 8): paUInt8, (WAVE_FORMAT_PCM, 16): paInt16, (WAVE_FORMAT_PCM, 24): paInt24,
+               (WAVE_FORMAT_PCM, 32): paInt32, (WAVE_FORMAT_IEEE_FLOAT, 32): paFloat32}
+
+# Random generator of the output dither
+dither_rng = np.random.default_rng()
+
 # Some default values for the audio format
 CHUNK = 256
-FORMAT = pyaudio.paInt16
+FORMAT = paInt16
 CHANNELS = 1
 RATE = 48000
 # This is needed for rescaling
 MAX_AMP = 2**15 - 1
 
 
-class Audio(pyaudio.PyAudio):
+# Sample format conversions
+#  - The working format of all mixing and gain stages is float32 at full scale 1.0, integer samples are
+#    converted once on the way in (to_float32) and once, dithered, on the way out (from_float32)
+
+# Convert samples of any type to the float32 working format (full scale 1.0)
+#  - float32 input is returned as is (no copy unless copy=True), integers are scaled by their type
+def to_float32(data, copy=False):
+    data = np.asarray(data)
+    if data.dtype == np.float32:
+        return data.copy() if copy else data
+    if data.dtype.kind == "f":
+        return data.astype(np.float32)
+    half = 2.0 ** (data.dtype.itemsize * 8 - 1)
+    if data.dtype.kind == "u":
+        return (data.astype(np.float32) - np.float32(half)) * np.float32(1.0 / half)
+    return data.astype(np.float32) * np.float32(1.0 / half)
+
+
+# Convert float samples (full scale 1.0) to an integer (or float) type, with TPDF dither of +/- 1 LSB
+#   dtype  - The numpy type of the output
+#   bits   - The resolution of the output if lower than the type (e.g. 24 for 24 bit samples in an int32)
+#   dither - Add triangular dither before rounding (decorrelates the rounding error from the signal)
+def from_float32(data, dtype=np.int16, bits=None, dither=True):
+    dtype = np.dtype(dtype)
+    if dtype.kind == "f":
+        return np.asarray(data, dtype=dtype)
+    width = dtype.itemsize * 8
+    bits = bits or width
+    # Samples in units of the output LSB
+    x = np.asarray(data, dtype=np.float64) * 2.0 ** (bits - 1)
+    if dither:
+        x = x + (dither_rng.random(x.shape) - dither_rng.random(x.shape))
+    x = np.clip(np.rint(x), -2.0 ** (bits - 1), 2.0 ** (bits - 1) - 1) * 2.0 ** (width - bits)
+    if dtype.kind == "u":
+        x += 2.0 ** (width - 1)
+    return x.astype(dtype)
+
+
+# Convert samples of any type to int16 (16 bit output, e.g. a WAV or G.711 encoder)
+def to_int16(data, dither=True):
+    data = np.asarray(data)
+    if data.dtype == np.int16:
+        return data
+    return from_float32(to_float32(data), np.int16, dither=dither)
+
+
+# Average interleaved channels into one (float32 working format)
+def downmix(data, channels):
+    x = to_float32(data)
+    if channels == 1:
+        return x
+    frames = len(x) // channels
+    return x[:frames * channels].reshape(frames, channels).mean(axis=1, dtype=np.float32)
+
+
+# Samples of a format from raw bytes, as a view of the buffer where possible (all formats but 24 bit)
+#   buffer - bytes, bytearray (the view is then writable) or memoryview
+#   offset - Start of the samples in the buffer, length - Size of the samples in bytes (default: to the end)
+def decode(buffer, format, offset=0, length=None):
+    size = SAMPLE_SIZES[format]
+    if length is None:
+        length = len(buffer) - offset
+    count = length // size
+    if format == paInt24:
+        # Spread the 3 bytes of every sample over the top of an int32 (little-endian)
+        packed = np.frombuffer(buffer, dtype=np.uint8, count=count * 3, offset=offset).reshape(count, 3)
+        unpacked = np.zeros((count, 4), dtype=np.uint8)
+        unpacked[:, 1:] = packed
+        return unpacked.view("<i4").ravel()
+    return np.frombuffer(buffer, dtype=NP_TYPES[format], count=count, offset=offset)
+
+
+# Raw bytes of samples in a format (a contiguous array, written without another copy)
+def encode(data, format):
+    data = np.ascontiguousarray(data, dtype=NP_TYPES[format])
+    if format == paInt24:
+        return np.ascontiguousarray(data.astype("<i4").view(np.uint8).reshape(-1, 4)[:, 1:])
+    return data
+
+
+# Parse the header of a WAV file in a buffer
+#  - returns (format, channels, rate, offset of the samples, size of the samples in bytes)
+#  - PCM 8/16/24/32 bit, float32 and WAVE_FORMAT_EXTENSIBLE are supported, a streaming data size
+#    (0xFFFFFFFF, unknown length) means "up to the end of the buffer"
+def parse_wav(buffer):
+    view = memoryview(buffer)
+    if len(view) < 12 or bytes(view[0:4]) != b"RIFF" or bytes(view[8:12]) != b"WAVE":
+        raise ValueError("Not a WAV file")
+    position = 12
+    fmt = None
+    while position + 8 <= len(view):
+        chunk_id = bytes(view[position:position + 4])
+        chunk_size = struct.unpack_from("<I", view, position + 4)[0]
+        body = position + 8
+        if chunk_id == b"fmt ":
+            format_tag, channels, rate, byte_rate, block_align, bits = struct.unpack_from("<HHIIHH", view, body)
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40:
+                # The real format tag is the start of the sub-format GUID
+                format_tag = struct.unpack_from("<H", view, body + 24)[0]
+            fmt = (format_tag, channels, rate, bits)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("WAV data chunk before the fmt chunk")
+            format_tag, channels, rate, bits = fmt
+            if (format_tag, bits) not in WAV_FORMATS:
+                raise ValueError("Unsupported WAV format: tag {}, {} bits".format(format_tag, bits))
+            format = WAV_FORMATS[(format_tag, bits)]
+            length = min(chunk_size, len(view) - body)
+            # Whole frames only
+            length -= length % (channels * SAMPLE_SIZES[format])
+            return format, channels, rate, body, length
+        # Chunks are padded to an even size
+        position = body + chunk_size + (chunk_size & 1)
+    raise ValueError("WAV file without a data chunk")
+
+
+# Read a whole file into a writable buffer
+def read_file(path):
+    with open(path, "rb") as f:
+        buffer = bytearray(os.fstat(f.fileno()).st_size)
+        length = f.readinto(buffer)
+    return buffer[:length] if length < len(buffer) else buffer
+
+
+class Audio:
 
     def __init__(self, channels=1,
                  rate=RATE,
                  chunk=CHUNK,
                  format=FORMAT):
-        # Initialise the parent class
-        pyaudio.PyAudio.__init__(self)
+        # PortAudio is initialised on the first open() (playing or recording), not for every Audio object
+        self.pa = None
 
         # Set the format to that specified
         self.chan = channels
@@ -50,10 +199,60 @@ class Audio(pyaudio.PyAudio):
     def __del__(self):
         self.terminate()
 
+    # Open a PortAudio stream (initialises PortAudio on first use)
+    def open(self, **kwargs):
+        if self.pa is None:
+            import pyaudio
+            self.pa = pyaudio.PyAudio()
+        return self.pa.open(**kwargs)
+
+    # Release PortAudio
+    def terminate(self):
+        if getattr(self, "pa", None) is not None:
+            self.pa.terminate()
+            self.pa = None
+
+    # Size in bytes of a sample of the given format
+    def get_sample_size(self, format):
+        return SAMPLE_SIZES[format]
+
+    # Integer format of the given sample size in bytes (1 byte is unsigned, as in WAV files)
+    def get_format_from_width(self, width):
+        formats = {1: paUInt8, 2: paInt16, 3: paInt24, 4: paInt32}
+        if width not in formats:
+            raise ValueError("Unsupported sample width: {}".format(width))
+        return formats[width]
+
+    # The samples in the float32 working format (full scale 1.0)
+    def get_float(self):
+        return to_float32(self.data)
+
+    # Set the samples from the float32 working format, converted (dithered) to the format of this object
+    def set_float(self, data, dither=True):
+        if self.format == paFloat32:
+            self.data = np.asarray(data, dtype=np.float32)
+        else:
+            self.data = from_float32(data, self.nptype, bits=SAMPLE_BITS[self.format], dither=dither)
+
+    # Change the sample format (one dithered conversion, e.g. float32 working format -> 16 bit output)
+    def convert(self, format, dither=True):
+        data = self.get_float()
+        self.format = format
+        self.nptype = self.get_np_type(format)
+        self.set_float(data, dither)
+
+    # Average all channels into one (the data becomes float32)
+    def downmix(self):
+        if self.chan > 1:
+            self.data = downmix(self.data, self.chan)
+            self.format = paFloat32
+            self.nptype = np.float32
+            self.chan = 1
+
     # Get a chunk of data from the current input stream
     def get_chunk(self):
         tmpstr = self.istream.read(self.chunk)
-        array = np.fromstring(tmpstr, dtype=self.nptype)
+        array = decode(tmpstr, self.format)
         self.data = np.append(self.data, array)
     
     # Put a chunk of data to the current output stream        
@@ -65,12 +264,11 @@ class Audio(pyaudio.PyAudio):
         if slice_to > self.data.shape[0]:
             raise IndexError
         array = self.data[slice_from:slice_to]
-        self.ostream.write(array.tostring())
+        self.ostream.write(encode(array, self.format).tobytes())
         self.chunk_index += 1
         
     # Open an input stream
-    # We just call the inherited open function in the parent class 
-    # with the correct format data
+    # We just call the open function above with the correct format data
     def open_input_stream(self):
         self.istream = self.open(format=self.format,
                                  channels=self.chan,
@@ -132,77 +330,57 @@ class Audio(pyaudio.PyAudio):
         self.close_output_stream()
 
     # Save the data to a file
-    def save(self, path):
-        # Create a 'string' of the data
-        raw = self.data.tostring()
-        # Open the file for writing
-        wf = wave.open(path, 'wb')
-        # Set the header information
-        wf.setnchannels(self.chan)
-        wf.setsampwidth(self.get_sample_size(self.format))
-        wf.setframerate(self.rate)
-        # Write the data
-        wf.writeframes(raw)
-        # Close the file
-        wf.close()
+    #   format - Sample format of the file (default: the format of the data), the data is converted
+    #            with dither when it differs (e.g. paInt16 for a float32 object)
+    def save(self, path, format=None, dither=True):
+        import encoders
+        format = self.format if format is None else format
+        if format == self.format and self.data.dtype == NP_TYPES[format]:
+            samples = encode(self.data, format)
+        else:
+            samples = encode(from_float32(self.get_float(), NP_TYPES[format], bits=SAMPLE_BITS.get(format), dither=dither), format)
+        format_tag = WAVE_FORMAT_IEEE_FLOAT if format == paFloat32 else WAVE_FORMAT_PCM
+        with open(path, "wb") as f:
+            f.write(encoders.wav_header(self.rate, self.chan, SAMPLE_SIZES[format], samples.nbytes, format_tag))
+            # View the data as bytes (no copy)
+            f.write(memoryview(samples).cast("B"))
     
-    # Load data from a file    
-    def load(self, path):
-        # Open the file for reading
-        wf = wave.open(path, "rb")
+    # Load data from a file (8/16/24/32 bit PCM or float32 WAV)
+    #   mono - Downmix a multi-channel file to one channel (the data is then float32)
+    def load(self, path, mono=False):
+        buffer = read_file(path)
         # Get information from the files header
-        self.format = self.get_format_from_width(wf.getsampwidth())
+        self.format, self.chan, self.rate, offset, length = parse_wav(buffer)
         self.nptype = self.get_np_type(self.format)
-        self.chan = wf.getnchannels()
-        self.rate = wf.getframerate()
-        # Set the internal data attribute to an empty array of the right type
-        self.data = np.array([], dtype=self.nptype)
-        # Read a chunk of data from the file
-        raw = wf.readframes(self.chunk)
-        # Loop while there is data in the file
-        while raw:
-            # Convert the raw data to a numpy array
-            array = np.fromstring(raw, dtype=self.nptype)
-            # Append the array to the class data attribute
-            self.data = np.append(self.data, array)
-            # Read the next chunk, ready for the next loop iteration
-            raw = wf.readframes(self.chunk)
-        # Close the file
-        wf.close()
+        # The samples are a (writable) view of the file buffer, no copy
+        self.data = decode(buffer, self.format, offset, length)
+        if mono:
+            self.downmix()
     
     # Convert the pyaudio data format type to the numpy type 
-    #  - This really needs expanding to deal with other data types, e.g. 8bit and 24bit audio
     def get_np_type(self, type):
-        if type == pyaudio.paInt16:
-            return np.int16
+        if type not in NP_TYPES:
+            raise ValueError("Unsupported sample format: {}".format(type))
+        return NP_TYPES[type]
     
-    # Convert the numpy data format type to the pyaudio type    
+    # Convert the numpy data format type to the pyaudio type (int32 samples are paInt32, not paInt24)
     def get_pa_type(self, type):
-        if type == np.int16:
-            return pyaudio.paInt16
+        formats = {np.dtype(np.float32): paFloat32, np.dtype(np.int32): paInt32, np.dtype(np.int16): paInt16,
+                   np.dtype(np.int8): paInt8, np.dtype(np.uint8): paUInt8}
+        if np.dtype(type) not in formats:
+            raise ValueError("Unsupported sample type: {}".format(type))
+        return formats[np.dtype(type)]
     
     # Add an echo the the current audio data
     #   repeat - How many delayed repeats to add
     #   delay  - How long to delay each repeat (in samples)
+    #  - the original is at half amplitude and every repeat halves again, so the sum doesn't 'clip'
     def add_echo(self, repeat, delay):
-        # get the length of the existing data
-        length = self.data.shape[0]
-        # create a new array with the required extra length
-        array = np.zeros(length + repeat*delay, dtype=np.float)
-
-        # loop for the number of delays + 1
-        #  - we use the 0th iteration of the loop to reduce the amplitude of the original
-        #    waveform, so when we add to it we don't 'clip'
-        for i in range(0, repeat+1):
-            # Get start and end times for the current offset
-            start = i*delay
-            end = length + i*delay
-            # Calculate the current scaling factor
-            scale = 2**(i+1)
-            # Add a scaled version of self.data to 'window' of the new array
-            array[start:end] += self.data / scale
+        import effects
+        # Block-based delay line (see effects.py), the output gets repeat*delay samples longer
+        chain = effects.EffectsChain([effects.Echo(delay, decay=0.5, repeats=repeat), effects.Gain(-20 * math.log10(2))])
         # Set the class data attribute to the new array
-        self.data = np.rint(array).astype(self.nptype)
+        self.set_float(chain.apply(self.get_float()))
 
     def rescale(self, val):
         # Check argument passed
@@ -216,42 +394,42 @@ class Audio(pyaudio.PyAudio):
         #     if abs(self.data[i]) > peak:
         #         peak = abs(self.data[i])
 
-        peak = np.max(np.abs(self.data))
+        data = self.get_float()
+        peak = np.max(np.abs(data)) if len(data) else 0.0
+        # Nothing to scale in silence
+        if peak == 0:
+            return
 
-        # Calculate the rescaling factor
-        rescale_factor = val*MAX_AMP/peak
+        # Calculate the rescaling factor (full scale is 1.0 in the float32 working format)
+        rescale_factor = val/peak
 
-        self.data = (self.data * rescale_factor).astype(self.nptype)
+        self.set_float(data * np.float32(rescale_factor))
 
     def create_tone(self, frequency, length, amplitude):
         if not 0 <= amplitude <= 1:
             raise ValueError("Expected amplitude between 0 and 1")
 
-        # create new array of requested length
-        s = np.zeros(length, self.nptype)
-
-        # iterate through array, creating waveform sample by sample
-        for i in range(0, length):
-            s[i] = amplitude * MAX_AMP \
-                   * math.sin(frequency * i * 2 * math.pi/self.rate)
+        # create the waveform for the requested length (float32 working format)
+        s = amplitude * np.sin(frequency * np.arange(length) * 2 * math.pi/self.rate)
 
         # set instance data to the newly created array
-        self.data = s
+        self.set_float(s)
 
     def create_noise(self, length, amplitude):
 
         if not 0 <= amplitude <= 1:
             raise ValueError("Expected amplitude between 0 and 1")
 
-        # create new array of requested length
-        s = np.zeros(length, self.nptype)
-
-        # iterate through array, creating waveform sample by sample
-        for i in range(0, length):
-            s[i] = amplitude * MAX_AMP * random.random()
+        # create new array of requested length (exact digital silence for amplitude 0, no dither)
+        if amplitude == 0:
+            self.data = np.zeros(length, self.nptype)
+            if self.format == paUInt8:
+                self.data += 128
+            return
+        s = amplitude * dither_rng.random(length)
 
         # set instance data to the newly created array
-        self.data = s
+        self.set_float(s)
 
     # This version adds to the existing object. 
     # Cons of this approach: changes the original object, 
@@ -260,20 +438,21 @@ class Audio(pyaudio.PyAudio):
     def add(self, other):
         # Find the length of the longest
         length = max(self.data.shape[0], other.data.shape[0])
-        # Create an empty array of this length
-        array = np.zeros(length, dtype=self.nptype)
+        # Create an empty array of this length (float32 working format)
+        array = np.zeros(length, dtype=np.float32)
         # Add in each data at half amplitute (so it doesn't clip)
-        array += self.data / 2.0
-        array += other.data / 2.0
+        array[:len(self.data)] += self.get_float() / 2.0
+        array[:len(other.data)] += other.get_float() / 2.0
         # Update the stored array in the current object.
-        self.data = array
+        self.set_float(array)
 
     def __len__(self):
         return self.data.shape[0]
 
     def get_samplerange(self):
-        if self.nptype == np.int16:
-            return math.pow(2, 16)
+        if self.format == paFloat32:
+            return 2.0
+        return math.pow(2, SAMPLE_BITS[self.format])
 
     def compute_fft(self, start, end):
         dur = end - start
@@ -284,6 +463,10 @@ class Audio(pyaudio.PyAudio):
 
         return fft * np.hanning(len(fft))
 
+    def resample(self, rate):
+        self.set_float(resample(self.get_float(), self.rate, rate))
+        self.rate = rate
+
     def change_speed(self, factor):
         indxs = np.round(np.arange(0, len(self.data), factor))
         indxs = indxs[indxs < len(self.data)].astype(int)
@@ -294,12 +477,13 @@ class Audio(pyaudio.PyAudio):
         if apply_hanning:
             amp_window = np.hanning(windowsize)
         else:
-            amp_window = np.ones(windowsize, dtype=np.float)
+            amp_window = np.ones(windowsize, dtype=float)
         result = np.zeros(int(len(self.data) / factor + windowsize))
 
-        for i in np.arange(0, len(self.data)-(windowsize+overlap), overlap*factor, dtype=np.int):
-            a1 = self.data[i: i + windowsize]
-            a2 = self.data[i + overlap: i + windowsize + overlap]
+        data = self.get_float()
+        for i in np.arange(0, len(data)-(windowsize+overlap), overlap*factor, dtype=int):
+            a1 = data[i: i + windowsize]
+            a2 = data[i + overlap: i + windowsize + overlap]
 
             s1 = np.fft.fft(amp_window * a1)
             s2 = np.fft.fft(amp_window * a2)
@@ -308,9 +492,9 @@ class Audio(pyaudio.PyAudio):
 
             i2 = int(i/factor)
             result[i2:i2 + windowsize] += amp_window*np.real(a2_rephased)
-        result = ((2**(16-4)) * result/result.max())
+        result = (2.0**-4) * result/result.max()
 
-        self.data = result.astype(self.nptype)
+        self.set_float(result)
 
     def plot_waveform(self, start=0, end=-1, x_unit="samples"):
         array = self.data[start:end]
@@ -352,21 +536,44 @@ def sum_audio(audio_objects):
     # Work out the required scaling factor to prevent clipping
     scale = 1.0/len(audio_objects)
 
-    # make an array of zeros
-    # - should really check that the dtype of each of the objects is the same and use that dtype!
-    array = np.zeros(length, dtype=np.int16)
+    # make an array of zeros (float32 working format, whatever the formats of the objects)
+    array = np.zeros(length, dtype=np.float32)
     
     # Add each audio_object to the array
     for obj in audio_objects:
-        array += np.rint(obj.data * scale).astype(np.int16)
+        array[:len(obj)] += obj.get_float() * np.float32(scale)
     
-    # Create a new object to return
-    new_object = Audio()
+    # Create a new object to return (float32, converted once when it is saved or played)
+    new_object = Audio(rate=audio_objects[0].rate, format=paFloat32)
     new_object.data = array
     
     return new_object
 
 
+# Read a whole wav file in one go (no PyAudio instance needed), returns (rate, numpy array)
+#  - the samples keep their type (a view of the file buffer, no copy), a multi-channel file is
+#    downmixed to float32
+def read_wav(path):
+    buffer = read_file(path)
+    try:
+        format, channels, rate, offset, length = parse_wav(buffer)
+    except ValueError as error:
+        raise ValueError("{}: {}".format(error, path))
+    data = decode(buffer, format, offset, length)
+    if channels > 1:
+        data = downmix(data, channels)
+    return rate, data
+
+
+# Resample an array from one sample rate to another by linear interpolation (returns a float array)
+def resample(data, rate, new_rate):
+    if rate == new_rate or len(data) == 0:
+        return data
+    length = int(round(len(data) * float(new_rate) / rate))
+    positions = np.arange(length) * (float(rate) / new_rate)
+    return np.interp(positions, np.arange(len(data)), data)
+
+
 def test_add():
     c = Audio()
     e = Audio()
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Scatter-gather output, an utterance as a plan of segments written straight from the unit samples.
+
+Most of an output is unmodified unit samples: without -c every unit is copied as it is, with -c only the
+10 msc around every join is cross-faded. Instead of joining everything into one float32 array, converting
+it to int16 and writing that, the concatenation can build a SegmentPlan, the output as a list of segments:
+    - views of the int16 units, as the voice keeps them (the wav buffers, or the memory-mapped word units)
+    - computed float32 segments: the cross-faded joins, silences and anything rendered in float32 (e.g.
+      the English runs), the only samples that are materialized and converted (dithered) at the output
+The WAV / raw encoders then emit the plan with vectored writes (os.writev, up to IOV_MAX buffers per call):
+the unit samples go from their own buffers to the file, without a copy into one output array.
+
+Usage:
+    plan = SegmentPlan()
+    plan.append(voice.unit("nei5"))
+    plan.crossfade(voice.unit("hou2"), 320)
+    with encoders.open_encoder("wav", "output.wav", rate) as encoder:
+        encoder.write_plan(plan)
+"""
+
+import os
+
+import numpy as np
+
+import metrics
+import simpleaudio
+
+# Largest number of buffers in one writev call
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+# Buffers of one write call (the computed segments of a batch are converted when it is written)
+BATCH = min(IOV_MAX, 1024) if IOV_MAX > 0 else 1024
+
+# Samples written as they are: 16 bit little-endian PCM
+PCM16 = np.dtype("<i2")
+
+
+def is_view(segment):
+    """Whether a segment is written as it is (int16 samples) instead of converted"""
+    return segment.dtype == PCM16
+
+
+class SegmentPlan:
+    """
+    Description: An output as an ordered list of segments (int16 unit views and computed float32 arrays)
+    """
+
+    def __init__(self, segments=None):
+        self.segments = []
+        self.length = 0
+        for segment in segments or []:
+            self.append(segment)
+
+    def append(self, data):
+        """Append samples: int16 as a view (written as they are), anything else as a computed float32 segment"""
+        data = np.asarray(data)
+        if len(data) == 0:
+            return
+        if data.dtype != PCM16:
+            data = simpleaudio.to_float32(data)
+        self.segments.append(np.ascontiguousarray(data))
+        self.length += len(data)
+
+    def extend(self, other):
+        """Append the segments of another plan (or an array)"""
+        if not isinstance(other, SegmentPlan):
+            return self.append(other)
+        for segment in other.segments:
+            self.append(segment)
+
+    def take_tail(self, count):
+        """Remove the last count samples, return them as float32 (the views before them stay views)"""
+        tail = []
+        while count > 0 and self.segments:
+            segment = self.segments.pop()
+            if len(segment) > count:
+                self.segments.append(segment[:len(segment) - count])
+                segment = segment[len(segment) - count:]
+            tail.append(simpleaudio.to_float32(segment))
+            count -= len(segment)
+            self.length -= len(segment)
+        return np.concatenate(tail[::-1]) if tail else np.zeros(0, dtype=np.float32)
+
+    def take_head(self, count):
+        """Remove the first count samples, return them as float32"""
+        head = []
+        while count > 0 and self.segments:
+            segment = self.segments.pop(0)
+            if len(segment) > count:
+                self.segments.insert(0, segment[count:])
+                segment = segment[:count]
+            head.append(simpleaudio.to_float32(segment))
+            count -= len(segment)
+            self.length -= len(segment)
+        return np.concatenate(head) if head else np.zeros(0, dtype=np.float32)
+
+    def crossfade(self, data, overlap):
+        """
+        Description: Append samples with a linear crossfade over the last overlap samples (as word_syn.concatenate -c)
+
+        Input : An array or a SegmentPlan, and the crossfade length
+        NOTE  : Only the overlap is computed, the rest of the appended samples keeps its segments
+        """
+        other = SegmentPlan(data.segments if isinstance(data, SegmentPlan) else [data])
+        ramp = np.arange(overlap) / float(overlap)
+        join = self.take_tail(overlap) * ramp[::-1] + other.take_head(overlap) * ramp
+        self.append(join.astype(np.float32))
+        self.extend(other)
+
+    def materialize(self):
+        """The whole output as one float32 array (e.g. to play it or run it through the effects)"""
+        if not self.segments:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate([simpleaudio.to_float32(segment) for segment in self.segments])
+
+    def batches(self):
+        """
+        Description: The output as int16 buffers, a batch of up to BATCH buffers at a time
+
+        Output: Yields lists of (memoryview of the bytes, True for a view written as it is)
+        """
+        batch = []
+        for segment in self.segments:
+            if is_view(segment):
+                batch.append((memoryview(segment).cast("B"), True))
+            else:
+                # The one dithered conversion of the computed samples
+                batch.append((memoryview(simpleaudio.to_int16(segment)).cast("B"), False))
+            if len(batch) == BATCH:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def write_to(self, file):
+        """
+        Description: Write the plan as 16 bit PCM to a binary file, with vectored writes if it has a descriptor
+
+        Input : A binary file-like object
+        Output: The number of bytes written
+        """
+        try:
+            file.flush()
+            fd = file.fileno()
+        except (AttributeError, OSError, ValueError):
+            fd = None
+        written = 0
+        for batch in self.batches():
+            buffers = [buffer for buffer, view in batch]
+            if fd is None:
+                for buffer in buffers:
+                    file.write(buffer)
+            else:
+                writev(fd, buffers)
+            for buffer, view in batch:
+                metrics.SPLICE_BYTES.inc("view" if view else "computed", amount=len(buffer))
+                written += len(buffer)
+        return written
+
+    @property
+    def nbytes(self):
+        return self.length * PCM16.itemsize
+
+    def __len__(self):
+        return self.length
+
+
+def writev(fd, buffers):
+    """os.writev of all the buffers, continuing after a partial write"""
+    while buffers:
+        count = os.writev(fd, buffers)
+        while buffers and count >= len(buffers[0]):
+            count -= len(buffers[0])
+            buffers = buffers[1:]
+        if buffers and count:
+            buffers = [buffers[0][count:]] + buffers[1:]
+
+
+def stitch(results, rate, overlap=0, alignment=None):
+    """
+    Description: code_switch.stitch for pieces that are SegmentPlans: join them in order into one plan
+
+    Input : A list of (rate, samples or SegmentPlan) or (rate, samples or SegmentPlan, alignment) results, the
+            output sample rate, the crossfade at every boundary and optionally an alignment.Alignment that the
+            alignment of every piece is appended to
+    Output: A SegmentPlan (pieces at another rate are resampled, i.e. computed)
+    """
+    plan = SegmentPlan()
+    for index, result in enumerate(results):
+        piece = result[1]
+        if result[0] != rate:
+            piece = simpleaudio.resample(simpleaudio.to_float32(
+                piece.materialize() if isinstance(piece, SegmentPlan) else piece), result[0], rate)
+        offset = len(plan)
+        # Same boundaries as code_switch.stitch: both sides long enough to fade
+        if overlap and index > 0 and len(piece) > overlap and len(plan) > overlap:
+            offset -= overlap
+            plan.crossfade(piece, overlap)
+        else:
+            plan.extend(piece)
+        if alignment is not None and len(result) > 2 and result[2] is not None:
+            alignment.extend(result[2], offset)
+    return plan
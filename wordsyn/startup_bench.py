@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Start-up benchmark, based on python -X importtime.
+
+Every run is a fresh interpreter, so the numbers include everything a one-shot CLI call pays before it
+can synthesize: the imports of the module and their import-time work. The median over the runs is
+reported with the modules that cost the most (cumulative time), and can be saved to a JSON file and
+compared with a later run (e.g. before / after a change). Modules that should only be imported on first
+use (LAZY_MODULES) are flagged when the import pulls them in, and --compare lists the modules that are
+imported now but were not in the saved run; --check exits with an error if any lazy module is imported.
+NOTE  : The first run also writes the .pyc files, it is not counted in the median (use --runs 1 --keep-first to see it)
+
+Usage:
+    python3 startup_bench.py                               # import of word_syn
+    python3 startup_bench.py --module eng_diphone_synth --top 20
+    python3 startup_bench.py --phrase "你好" -l p           # whole one-shot synthesis from the command line
+    python3 startup_bench.py --save before.json
+    python3 startup_bench.py --compare before.json
+    python3 startup_bench.py --check
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+# Folder of the synthesizer modules (the runs are started from here)
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Modules only needed by optional stages or options, imported where they are used (never at start-up)
+LAZY_MODULES = ["jieba", "opencc", "pyaudio", "pycantonese", "sandhi", "psola", "pitchmarks", "effects", "longform",
+                "shared_audio", "multiprocessing.shared_memory", "document", "word_units", "unit_store",
+                "cmudict_compiled", "eng_diphone_synth"]
+
+
+def parse_importtime(stderr):
+    """
+    Description: Parse the output of python -X importtime
+
+    Input : The stderr of the interpreter
+    Output: A dict of module name -> (self time, cumulative time) in microseconds
+    """
+    modules = dict([])
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(own), int(cumulative))
+    return modules
+
+
+def import_run(module):
+    """One fresh interpreter importing a module: (wall-clock seconds, module times)"""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                            cwd=HERE, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError("Importing {} failed:\n{}".format(module, result.stderr.splitlines()[-1]))
+    return wall, parse_importtime(result.stderr)
+
+
+def cli_run(phrase, options):
+    """One one-shot command line synthesis: wall-clock seconds"""
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "word_syn.py", phrase] + options, cwd=HERE, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError("Synthesis failed:\n{}".format(result.stderr))
+    return wall
+
+
+def benchmark(module="word_syn", runs=5, phrase=None, options=(), keep_first=False):
+    """
+    Description: Run the start-up benchmark
+
+    Input : The module to import, the number of runs, an optional phrase for a one-shot CLI run (with its
+            command line options), and whether to count the first run (that also compiles the .pyc files)
+    Output: A dict of results (median wall-clock and import times in ms, the import times per module)
+    """
+    if not keep_first:
+        import_run(module)
+    walls, totals, profiles = [], [], []
+    for _ in range(runs):
+        wall, modules = import_run(module)
+        walls.append(wall)
+        totals.append(modules[module][1])
+        profiles.append(modules)
+    # Module times of the median run
+    median_run = sorted(range(runs), key=lambda index: totals[index])[runs // 2]
+    results = {"module": module, "runs": runs,
+               "wall_ms": statistics.median(walls) * 1000, "import_ms": statistics.median(totals) / 1000.0,
+               "modules": dict((name, cumulative / 1000.0) for name, (own, cumulative) in profiles[median_run].items())}
+    if phrase != None:
+        results["phrase"] = phrase
+        results["cli_ms"] = statistics.median([cli_run(phrase, list(options)) for _ in range(runs)]) * 1000
+    return results
+
+
+def eager_imports(results):
+    """The modules of LAZY_MODULES that the import pulled in"""
+    return [name for name in LAZY_MODULES if name in results["modules"]]
+
+
+def report(results, top=15, baseline=None):
+    """Print the results (and the difference to a baseline from --compare)"""
+    def line(label, key):
+        text = "{:<28}{:>10.1f} ms".format(label, results[key])
+        if baseline != None and key in baseline:
+            text += "   (was {:.1f} ms, {:+.1f} %)".format(baseline[key], 100.0 * (results[key] / baseline[key] - 1))
+        print(text)
+    print("Start-up of {} (median of {} runs)".format(results["module"], results["runs"]))
+    line("Interpreter + import:", "wall_ms")
+    line("Import " + results["module"] + ":", "import_ms")
+    if "cli_ms" in results:
+        line("One-shot synthesis:", "cli_ms")
+    print()
+    print("Slowest imports (cumulative):")
+    slowest = sorted(results["modules"].items(), key=lambda item: -item[1])[:top]
+    for name, cumulative in slowest:
+        text = "  {:<40}{:>8.1f} ms".format(name, cumulative)
+        if baseline != None and name in baseline.get("modules", {}):
+            text += "   (was {:.1f} ms)".format(baseline["modules"][name])
+        print(text)
+    eager = eager_imports(results)
+    if eager:
+        print()
+        print("*** WARNING: Imported at start-up, only needed on first use:", ", ".join(eager))
+    if baseline != None:
+        gone = [name for name in baseline.get("modules", {}) if name not in results["modules"]]
+        if gone:
+            print()
+            print("No longer imported:", ", ".join(sorted(gone)))
+        new = [name for name in results["modules"] if name not in baseline.get("modules", {})]
+        if new:
+            print()
+            print("New imports:", ", ".join(sorted(new)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Measure the start-up time of the synthesizer with python -X importtime.')
+    parser.add_argument('--module', default="word_syn", help="Module to import")
+    parser.add_argument('--runs', default=5, type=int, help="Number of fresh interpreters (the median is reported)")
+    parser.add_argument('--keep-first', action="store_true", dest="keep_first", default=False,
+                        help="Also count the first run (it writes the .pyc files)")
+    parser.add_argument('--top', default=15, type=int, help="Number of slowest imports to show")
+    parser.add_argument('--phrase', default=None, help="Also time a one-shot CLI synthesis of this phrase")
+    parser.add_argument('--language', '-l', default=None, help="Language option of the one-shot synthesis")
+    parser.add_argument('--save', default=None, help="Save the results to a JSON file")
+    parser.add_argument('--compare', default=None, help="Compare with results saved by --save")
+    parser.add_argument('--check', action="store_true", default=False,
+                        help="Exit with an error if a module of LAZY_MODULES is imported at start-up")
+    args = parser.parse_args()
+
+    options = ["-l", args.language] if args.language != None else []
+    results = benchmark(args.module, args.runs, args.phrase, options, args.keep_first)
+    baseline = None
+    if args.compare != None:
+        with open(args.compare, "r") as f:
+            baseline = json.loads(f.read())
+    report(results, args.top, baseline)
+    if args.save != None:
+        with open(args.save, "w") as f:
+            f.write(json.dumps(results, indent=1))
+    if args.check and eager_imports(results):
+        sys.exit(1)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Description: g711.py against the reference G.711 implementation, sample by sample for every 16 bit input.
+
+Usage:
+    python3 -m pytest -q test_g711.py
+"""
+
+import numpy as np
+
+import g711
+
+SEG_UEND = [0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF]
+SEG_AEND = [0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF]
+ALL_SAMPLES = np.arange(-32768, 32768, dtype=np.int16)
+
+
+def search(value, table):
+    """Index of the first segment end >= value (8 if none)"""
+    for index, end in enumerate(table):
+        if value <= end:
+            return index
+    return len(table)
+
+
+def linear2ulaw(pcm):
+    """Reference linear2ulaw (14 bit input, as the reference g711.c)"""
+    pcm = pcm >> 2
+    if pcm < 0:
+        pcm, mask = -pcm, 0x7F
+    else:
+        mask = 0xFF
+    pcm = min(pcm, 8159) + (0x84 >> 2)
+    seg = search(pcm, SEG_UEND)
+    if seg >= 8:
+        return 0x7F ^ mask
+    return ((seg << 4) | ((pcm >> (seg + 1)) & 0xF)) ^ mask
+
+
+def ulaw2linear(code):
+    """Reference ulaw2linear"""
+    code = ~code & 0xFF
+    t = (((code & 0x0F) << 3) + 0x84) << ((code & 0x70) >> 4)
+    return 0x84 - t if code & 0x80 else t - 0x84
+
+
+def linear2alaw(pcm):
+    """Reference linear2alaw (13 bit input)"""
+    pcm = pcm >> 3
+    if pcm >= 0:
+        mask = 0xD5
+    else:
+        mask, pcm = 0x55, -pcm - 1
+    seg = search(pcm, SEG_AEND)
+    if seg >= 8:
+        return 0x7F ^ mask
+    code = seg << 4
+    code |= (pcm >> (1 if seg < 2 else seg)) & 0xF
+    return code ^ mask
+
+
+def alaw2linear(code):
+    """Reference alaw2linear"""
+    code ^= 0x55
+    t = (code & 0x0F) << 4
+    seg = (code & 0x70) >> 4
+    if seg == 0:
+        t += 8
+    else:
+        t = (t + 0x108) << (seg - 1)
+    return t if code & 0x80 else -t
+
+
+def test_mulaw_encode_bit_exact():
+    reference = np.array([linear2ulaw(int(pcm)) for pcm in ALL_SAMPLES], dtype=np.uint8)
+    assert np.array_equal(g711.mulaw_encode(ALL_SAMPLES), reference)
+
+
+def test_mulaw_table_bit_exact():
+    reference = np.array([ulaw2linear(code) for code in range(256)], dtype=np.int16)
+    assert np.array_equal(g711.MULAW_TABLE, reference)
+    # Known points of the mu-law table: both zeros and the two extremes
+    assert list(g711.MULAW_TABLE[[0xFF, 0x7F, 0x00, 0x80]]) == [0, 0, -32124, 32124]
+
+
+def test_alaw_encode_bit_exact():
+    reference = np.array([linear2alaw(int(pcm)) for pcm in ALL_SAMPLES], dtype=np.uint8)
+    assert np.array_equal(g711.alaw_encode(ALL_SAMPLES), reference)
+
+
+def test_alaw_table_bit_exact():
+    reference = np.array([alaw2linear(code) for code in range(256)], dtype=np.int16)
+    assert np.array_equal(g711.ALAW_TABLE, reference)
+    assert list(g711.ALAW_TABLE[[0xD5, 0x55, 0xAA, 0x2A]]) == [8, -8, 32256, -32256]
+
+
+def test_decode_encode_round_trip():
+    # Every decoded value encodes back to its code (mu-law has two zeros, 0x7F is encoded as 0xFF)
+    codes = np.arange(256, dtype=np.uint8)
+    mulaw = g711.mulaw_encode(g711.MULAW_TABLE[codes])
+    assert np.array_equal(mulaw, np.where(codes == 0x7F, 0xFF, codes))
+    assert np.array_equal(g711.alaw_encode(g711.ALAW_TABLE[codes]), codes)
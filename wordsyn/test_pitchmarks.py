@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Description: The pitch-mark index (pitchmarks.py) is only used for the wavs it was built from.
+
+Usage:
+    python3 -m pytest -q test_pitchmarks.py
+"""
+
+import os
+import types
+import wave
+
+import numpy as np
+import pytest
+
+import pitchmarks
+import unit_index
+
+RATE = 16000
+
+
+def write_unit(folder, name, frequency):
+    t = np.arange(RATE // 4) / float(RATE)
+    data = (10000 * np.sin(2 * np.pi * frequency * t)).astype("<i2")
+    with wave.open(os.path.join(folder, name + ".wav"), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(RATE)
+        f.writeframes(data.tobytes())
+    return data
+
+
+@pytest.fixture
+def voice(tmp_path, monkeypatch):
+    monkeypatch.setattr(unit_index, "CACHE_DIR", str(tmp_path / "cache"))
+    units = tmp_path / "units"
+    units.mkdir()
+    write_unit(str(units), "aa1", 120.0)
+    write_unit(str(units), "baa2", 200.0)
+    return types.SimpleNamespace(units=str(units), rate=RATE)
+
+
+def test_index_is_used(voice):
+    pitchmarks.build_index(voice)
+    index = pitchmarks.PitchmarkIndex(voice)
+    assert set(index.row) == {"aa1", "baa2"}
+    marks, voiced = index.get("aa1", None)
+    assert len(marks) > 0 and len(marks) == len(voiced)
+
+
+def test_replaced_unit_invalidates_index(voice):
+    pitchmarks.build_index(voice)
+    old = pitchmarks.PitchmarkIndex(voice).get("aa1", None)[0]
+    data = write_unit(voice.units, "aa1", 250.0)
+    os.utime(os.path.join(voice.units, "aa1.wav"), ns=(1, 1))
+    index = pitchmarks.PitchmarkIndex(voice)
+    assert index.row == {}
+    marks = index.get("aa1", data)[0]
+    assert np.array_equal(marks, pitchmarks.find_marks(data, RATE)[0])
+    assert not np.array_equal(marks, old)
+
+
+def test_added_unit_invalidates_index(voice):
+    pitchmarks.build_index(voice)
+    write_unit(voice.units, "caai4", 150.0)
+    assert pitchmarks.PitchmarkIndex(voice).row == {}
+
+
+def test_extra_units_are_bounded(voice, monkeypatch):
+    monkeypatch.setattr(pitchmarks, "EXTRA_UNITS", 2)
+    index = pitchmarks.PitchmarkIndex(voice)
+    data = write_unit(voice.units, "tmp", 150.0)
+    for name in ["a", "b", "c"]:
+        index.get(name, data)
+    assert list(index.extra) == ["b", "c"]
+    assert index.nbytes == sum(array.nbytes for marks in index.extra.values() for array in marks)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Description: TD-PSOLA (psola.py): the identity transform gives the unit back, F0 and duration move by the ratios.
+
+Usage:
+    python3 -m pytest -q test_psola.py
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+import pitchmarks
+import psola
+import simpleaudio
+
+RATE = 16000
+UNITS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "jyutping-wong-44100-v9", "jyutping-wong")
+
+
+def peak_frequency(data, rate):
+    """Frequency of the spectral peak of the middle of a signal"""
+    middle = data[len(data) // 8:len(data) - len(data) // 8]
+    spectrum = np.abs(np.fft.rfft(middle * np.hanning(len(middle)), 1 << 17))
+    return np.argmax(spectrum) * rate / float(1 << 17)
+
+
+def sine(frequency, seconds=0.5):
+    t = np.arange(int(seconds * RATE)) / float(RATE)
+    return (0.5 * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+
+def test_identity_pulse_train():
+    # Marks that do not start at sample 0: the grains must stay on their pulses
+    x = np.zeros(3000, dtype=np.float32)
+    marks = np.arange(37, 3000, 160)
+    x[marks] = 1.0
+    y = psola.td_psola(x, marks, np.ones(len(marks), dtype=bool))
+    assert len(y) == len(x)
+    assert np.abs(y - x).max() < 1e-5
+
+
+def test_identity_irregular_marks():
+    rng = np.random.default_rng(0)
+    marks = np.cumsum(rng.integers(90, 130, 40)) + 11
+    x = rng.standard_normal(marks[-1] + 60).astype(np.float32)
+    y = psola.td_psola(x, marks, rng.random(len(marks)) > 0.3)
+    assert np.abs(y - x).max() < 1e-5
+
+
+@pytest.mark.skipif(not os.path.isdir(UNITS), reason="needs the jyutping-wong voice pack")
+@pytest.mark.parametrize("name", ["aa1", "baa2", "caai4"])
+def test_identity_unit(name):
+    rate, data = simpleaudio.read_wav(os.path.join(UNITS, name + ".wav"))
+    x = simpleaudio.to_float32(data)
+    marks, voiced = pitchmarks.find_marks(simpleaudio.to_int16(data, dither=False), rate)
+    y = psola.td_psola(x, marks, voiced)
+    assert np.abs(y - x).max() < 1e-3 * np.abs(x).max()
+
+
+@pytest.mark.parametrize("ratio", [0.8, 1.25])
+def test_f0_ratio(ratio):
+    x = sine(150.0)
+    marks, voiced = pitchmarks.find_marks((x * 20000).astype(np.int16), RATE)
+    y = psola.td_psola(x, marks, voiced, f0_ratio=ratio)
+    assert len(y) == len(x)
+    assert abs(peak_frequency(y, RATE) - 150.0 * ratio) < 3.0
+
+
+def test_duration_keeps_f0():
+    x = sine(150.0)
+    marks, voiced = pitchmarks.find_marks((x * 20000).astype(np.int16), RATE)
+    y = psola.td_psola(x, marks, voiced, duration=1.5)
+    assert len(y) == int(round(len(x) * 1.5))
+    assert abs(peak_frequency(y, RATE) - 150.0) < 3.0
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Description: The tone sandhi / changed-tone rules of sandhi.py on the lexicons of the voice packs.
+
+Usage:
+    python3 -m pytest -q test_sandhi.py
+"""
+
+import os
+
+import pytest
+
+import sandhi
+import voices
+
+FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+
+def voice(name):
+    registry = voices.VoiceRegistry(FOLDER)
+    if name not in registry.voices:
+        pytest.skip("needs the {} voice pack".format(name))
+    return registry.voices[name]
+
+
+@pytest.fixture(scope="module")
+def mandarin():
+    return voice("pinyin-yali")
+
+
+@pytest.fixture(scope="module")
+def cantonese():
+    return voice("jyutping-wong")
+
+
+@pytest.mark.parametrize("text, changed", [
+    ("你好", {0: "ni2"}),
+    ("一起", {0: "yi4"}),
+    ("一个", {0: "yi2"}),
+    ("不是", {0: "bu2"}),
+    ("第一", {}),
+    ("一月", {}),
+    ("你好，一起去。", {0: "ni2", 3: "yi4"}),
+])
+def test_mandarin(mandarin, text, changed):
+    assert sandhi.apply(text, "p", mandarin.lexicon, mandarin.syllables) == changed
+
+
+def test_third_tone_run(mandarin):
+    # Rewritten from the original context: 2 ... 2 3
+    assert sandhi.apply("我很好", "p", mandarin.lexicon, mandarin.syllables) == {0: "wo2", 1: "hen2"}
+
+
+def test_target_not_in_lexicon(mandarin):
+    # No char of the lexicon reads wo2: without the units of the voice the syllable keeps its tone
+    assert sandhi.apply("我很好", "p", mandarin.lexicon) == {1: "hen2"}
+
+
+@pytest.mark.parametrize("text, changed", [
+    ("爸爸", {1: "baa1"}),
+    ("媽媽", {0: "maa4"}),
+    ("哥哥", {0: "go4"}),
+    ("阿陳", {1: "can2"}),
+    ("阿爸", {}),
+])
+def test_cantonese(cantonese, text, changed):
+    assert sandhi.apply(text, "c", cantonese.lexicon, cantonese.syllables) == changed
+
+
+def test_no_rules():
+    assert sandhi.apply("hello", "e", {}) == {}
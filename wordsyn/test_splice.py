@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""
+Description: splice.py against the joined output: a SegmentPlan gives the samples of the one-array path
+(word_syn.concatenate, code_switch.stitch, --no-direct), and writes its int16 views as they are.
+
+Usage:
+    python3 -m pytest -q test_splice.py
+"""
+
+import io
+
+import numpy as np
+import pytest
+
+import code_switch
+import simpleaudio
+import splice
+
+
+def units(count, seed=0, shortest=400):
+    """Random int16 units of different lengths (longer than a crossfade, as the recorded units)"""
+    rng = np.random.default_rng(seed)
+    return [rng.integers(-20000, 20000, rng.integers(shortest, 3000)).astype(np.int16) for i in range(count)]
+
+
+def joined_crossfade(pieces, overlap):
+    """The one-array crossfade of word_syn.concatenate -c: fade out the tail, fade in and add the head"""
+    output = simpleaudio.to_float32(pieces[0], copy=True)
+    ramp = np.arange(overlap) / float(overlap)
+    for piece in pieces[1:]:
+        piece = simpleaudio.to_float32(piece, copy=True)
+        output[-overlap:] = output[-overlap:] * ramp[::-1] + piece[:overlap] * ramp
+        output = np.concatenate((output, piece[overlap:]))
+    return output
+
+
+def test_append_keeps_views():
+    pieces = units(5)
+    plan = splice.SegmentPlan(pieces)
+    assert len(plan) == sum(len(piece) for piece in pieces)
+    assert all(splice.is_view(segment) for segment in plan.segments)
+    assert np.array_equal(plan.materialize(), simpleaudio.to_float32(np.concatenate(pieces)))
+
+
+def test_crossfade_equals_joined():
+    pieces = units(6, seed=1)
+    plan = splice.SegmentPlan([pieces[0]])
+    for piece in pieces[1:]:
+        plan.crossfade(piece, 320)
+    expected = joined_crossfade(pieces, 320)
+    assert len(plan) == len(expected)
+    np.testing.assert_allclose(plan.materialize(), expected, atol=1e-6)
+    # Only the joins are computed
+    assert sum(len(segment) for segment in plan.segments if not splice.is_view(segment)) == 320 * (len(pieces) - 1)
+
+
+@pytest.mark.parametrize("overlap", [0, 320])
+def test_stitch_equals_code_switch_stitch(overlap):
+    # Pieces shorter than the crossfade are joined without it
+    pieces = units(4, seed=2, shortest=100) + [np.zeros(50, dtype=np.int16)]
+    results = [(simpleaudio.RATE, piece) for piece in pieces]
+    plans = [(rate, splice.SegmentPlan([piece])) for rate, piece in results]
+    expected = code_switch.stitch(results, simpleaudio.RATE, overlap=overlap)
+    output = splice.stitch(plans, simpleaudio.RATE, overlap=overlap)
+    assert len(output) == len(expected)
+    np.testing.assert_allclose(output.materialize(), expected, atol=1e-6)
+
+
+@pytest.mark.parametrize("vectored", [True, False])
+def test_write_to_equals_joined_pcm(tmp_path, vectored):
+    pieces = units(3, seed=3)
+    plan = splice.SegmentPlan([pieces[0]])
+    plan.crossfade(pieces[1], 320)
+    plan.append(np.zeros(100, dtype=np.float32))
+    plan.append(pieces[2])
+    if vectored:
+        path = tmp_path / "plan.raw"
+        with open(path, "wb") as f:
+            written = plan.write_to(f)
+        data = path.read_bytes()
+    else:
+        f = io.BytesIO()
+        written = plan.write_to(f)
+        data = f.getvalue()
+    assert written == len(data) == plan.nbytes
+    pcm = np.frombuffer(data, dtype=splice.PCM16)
+    # The views are written as they are, the computed samples within the dither (1 LSB) of the joined output
+    tail = len(pieces[2]) + 100
+    assert np.array_equal(pcm[:len(pieces[0]) - 320], pieces[0][:-320])
+    assert np.array_equal(pcm[-len(pieces[2]):], pieces[2])
+    assert np.array_equal(pcm[len(pcm) - tail - len(pieces[1]) + 320:len(pcm) - tail], pieces[1][320:])
+    joined = simpleaudio.to_int16(plan.materialize(), dither=False)
+    assert np.abs(pcm.astype(np.int32) - joined).max() <= 1
+
+
+@pytest.mark.parametrize("crossfade", [False, True])
+def test_synthesize_plan_equals_no_direct(crossfade):
+    # The whole frontend and voice: needs jieba and opencc
+    pytest.importorskip("jieba")
+    pytest.importorskip("opencc")
+    import word_syn
+    phrase = "今日天氣好好"
+    joined = word_syn.synthesize(phrase, language="c", crossfade=crossfade, plan=False)
+    plan = word_syn.synthesize(phrase, language="c", crossfade=crossfade, plan=True)
+    assert isinstance(plan.data, splice.SegmentPlan)
+    assert len(plan.data) == len(joined.data)
+    np.testing.assert_allclose(plan.data.materialize(), joined.get_float(), atol=1e-6)
+    assert plan.alignment.to_dict() == joined.alignment.to_dict()
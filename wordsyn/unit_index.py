@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Persistent, invalidation-aware index of a unit (wav) folder.
+
+Walking a voice folder with os.walk on every run costs thousands of stat calls before a single unit is
+loaded. Instead we keep a small JSON index (filename -> relative path) in a cache directory together with
+the modification time of every directory that was walked. Adding, removing or renaming a file changes the
+mtime of the directory holding it, so validating the index only needs one stat per directory.
+
+Usage:
+    index = UnitIndex("./diphones")
+    path = index.path("t-ax.wav")
+"""
+
+import os
+import json
+import hashlib
+
+# Cache folder for all derived data (unit indexes, compiled dictionaries...), can be moved with TTS_CACHE_DIR
+CACHE_DIR = os.environ.get("TTS_CACHE_DIR",
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), ".tts_cache"))
+
+# Bump when the layout of the index file changes
+INDEX_VERSION = 1
+
+
+def cache_path(name, source=None):
+    """
+    Description: Build the path of a cache file
+
+    Input : A cache file name, and optionally the source folder/file the cache is derived from
+    Output: Full path in CACHE_DIR (the source path is hashed into the name so different folders don't clash)
+    """
+    if source is not None:
+        key = hashlib.sha1(os.path.abspath(source).encode("utf-8")).hexdigest()[:12]
+        name = key + "_" + name
+    return os.path.join(CACHE_DIR, name)
+
+
+def write_atomic(path, text):
+    """
+    Description: Write a text file via a temp file + rename so a concurrent reader never sees half a file
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+class UnitIndex:
+    """
+    Description: Filename -> path map of every file in a unit folder, cached on disk and rebuilt
+    only when one of the indexed directories has changed.
+    """
+
+    def __init__(self, folder, suffix=".wav"):
+        self.folder = folder
+        self.suffix = suffix
+        self.index_file = cache_path("unit_index.json", folder)
+        # filename -> path relative to the folder
+        self.files = dict([])
+        # relative directory -> mtime_ns when it was indexed
+        self.dirs = dict([])
+        self.load()
+
+    def load(self):
+        """Load the cached index, rebuild it if it is missing or out of date"""
+        try:
+            with open(self.index_file, "r") as f:
+                cached = json.loads(f.read())
+            assert cached["version"] == INDEX_VERSION and cached["suffix"] == self.suffix
+            self.files = cached["files"]
+            self.dirs = cached["dirs"]
+            if self.is_valid():
+                return
+        except (OSError, ValueError, KeyError, AssertionError):
+            pass
+        self.rebuild()
+
+    def is_valid(self):
+        """The index is valid when no indexed directory has been modified since it was built"""
+        for reldir, mtime in self.dirs.items():
+            try:
+                if os.stat(os.path.join(self.folder, reldir)).st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def rebuild(self):
+        """Walk the folder once (top-down, so a file in a shallower folder wins over a deeper duplicate) and save the index"""
+        self.files = dict([])
+        self.dirs = dict([])
+        pending = [""]
+        while pending:
+            reldir = pending.pop(0)
+            fulldir = os.path.join(self.folder, reldir)
+            self.dirs[reldir] = os.stat(fulldir).st_mtime_ns
+            subdirs = []
+            with os.scandir(fulldir) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        subdirs.append(os.path.join(reldir, entry.name))
+                    elif entry.name.endswith(self.suffix):
+                        self.files.setdefault(entry.name, os.path.join(reldir, entry.name))
+            pending.extend(sorted(subdirs))
+        try:
+            write_atomic(self.index_file, json.dumps({"version": INDEX_VERSION, "suffix": self.suffix,
+                                                      "dirs": self.dirs, "files": self.files}))
+        except OSError:
+            # A read-only cache only costs us the walk on the next run
+            pass
+
+    def path(self, filename):
+        """Full path of an indexed file, raise KeyError if it is not in the folder"""
+        return os.path.join(self.folder, self.files[filename])
+
+    def __contains__(self, filename):
+        return filename in self.files
+
+    def __len__(self):
+        return len(self.files)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Compressed voice-pack unit store (8 bit mu-law / A-law per unit).
+
+The voice build step packs all unit wavs of a voice into two files in the voice folder:
+    units.<codec>.npy  : uint8 codes of all units, one after the other
+    units.<codec>.json : codec, sample rate and the [start, end] code range of every unit
+and adds "store": "units.<codec>" to the voice.json manifest. At runtime only the codes stay resident
+(half the size of 16 bit PCM), a unit is decoded when a request needs it with one lookup in the 256-entry
+decoding table, and the voice keeps a small LRU of decoded units (see voices.Voice).
+
+Usage:
+    python3 unit_store.py --voices . --codec mulaw
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+
+import g711
+import simpleaudio
+
+
+class CompressedUnitStore:
+    """
+    Description: Read-only compressed units of one voice
+    """
+
+    def __init__(self, prefix):
+        with open(prefix + ".json", "r") as f:
+            info = json.loads(f.read())
+        self.codec = info["codec"]
+        self.rate = info["rate"]
+        self.units = info["units"]
+        self.table = g711.CODECS[self.codec][1]
+        self.codes = np.load(prefix + ".npy")
+
+    def decode(self, name):
+        """int16 samples of a unit (by wav name without .wav), raise KeyError if it is not in the store"""
+        start, end = self.units[name]
+        return self.table[self.codes[start:end]]
+
+    def __contains__(self, name):
+        return name in self.units
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes
+
+
+def build_store(folder, prefix, codec="mulaw"):
+    """
+    Description: Encode every wav of a unit folder into a compressed store
+
+    Input : The unit folder, the output prefix (without .npy/.json) and the codec (mulaw or alaw)
+    Output: Size of the PCM data and of the codes, in bytes
+    """
+    encode = g711.CODECS[codec][0]
+    names = sorted(name[:-4] for name in os.listdir(folder) if name.endswith(".wav"))
+    units = dict([])
+    codes = []
+    position = 0
+    rate = None
+    for name in names:
+        unit_rate, data = simpleaudio.read_wav(os.path.join(folder, name + ".wav"))
+        assert rate in (None, unit_rate), "All units of a voice must have the same sample rate"
+        rate = unit_rate
+        codes.append(encode(simpleaudio.to_int16(data)))
+        units[name] = [position, position + len(data)]
+        position += len(data)
+    codes = np.concatenate(codes) if codes else np.zeros(0, dtype=np.uint8)
+    np.save(prefix + ".npy", codes)
+    with open(prefix + ".json", "w") as f:
+        f.write(json.dumps({"codec": codec, "rate": rate, "units": units}))
+    return 2 * len(codes), codes.nbytes
+
+
+def build_voice(manifest, codec="mulaw"):
+    """Compress the units of a voice pack and point its manifest to the store"""
+    with open(manifest, "r") as f:
+        info = json.loads(f.read())
+    folder = os.path.dirname(manifest)
+    store = "units." + codec
+    pcm_bytes, code_bytes = build_store(os.path.join(folder, info.get("units", ".")), os.path.join(folder, store), codec)
+    info["store"] = store
+    with open(manifest, "w") as f:
+        f.write(json.dumps(info))
+    return pcm_bytes, code_bytes
+
+
+if __name__ == "__main__":
+    import glob
+    import voices
+    parser = argparse.ArgumentParser(description='Build the compressed unit store of the voice packs.')
+    parser.add_argument('--voices', default=".", help="Folder containing voice packs (*/voice.json)")
+    parser.add_argument('--codec', default="mulaw", choices=sorted(g711.CODECS), help="Companding codec")
+    args = parser.parse_args()
+    for manifest in sorted(glob.glob(os.path.join(args.voices, "*", voices.MANIFEST))):
+        pcm_bytes, code_bytes = build_voice(manifest, args.codec)
+        print("Compressed", manifest, ": {:.1f} MB -> {:.1f} MB".format(pcm_bytes / 2**20, code_bytes / 2**20))
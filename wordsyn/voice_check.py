@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Voice-pack validator and missing-unit fallback table (voice build step).
+
+Every syllable of the lexicon of a voice is checked against its units (the wav folder, or the compressed
+store). A syllable without a usable unit (no wav, an empty or unreadable wav, or a wav whose format differs
+from the rest of the voice) gets a substitute, in this order:
+    1. the same syllable with another tone (the closest tone number)
+    2. the nearest syllable sharing its onset or its rime (same onset class / same vowel nucleus first,
+       the same tone preferred)
+    3. silence
+The table is saved as fallback.json in the voice folder, and the voice.json manifest points to it with
+"fallback": "fallback.json". At runtime the voice resolves a missing syllable with one dict lookup (see
+voices.Voice.unit_name), without probing the filesystem or raising on the hot path.
+
+Usage:
+    python3 voice_check.py --voices .
+    python3 voice_check.py --voice jyutping-wong --check-only
+"""
+
+import os
+import json
+import wave
+import argparse
+
+# Bump when the layout of fallback.json changes
+FALLBACK_VERSION = 1
+FALLBACK_FILE = "fallback.json"
+# Length of the silence used when nothing is close enough (seconds)
+SILENCE = 0.2
+
+# Onsets per language, grouped by place / manner of articulation (same group = close substitute)
+ONSET_CLASSES = {
+    "p": [["b", "p", "m", "f"], ["d", "t", "n", "l"], ["g", "k", "h"], ["j", "q", "x"],
+          ["zh", "ch", "sh", "r"], ["z", "c", "s"], ["y", "w"]],
+    "c": [["b", "p", "m", "f"], ["d", "t", "n", "l"], ["g", "k", "ng", "h"], ["gw", "kw", "w"],
+          ["z", "c", "s", "j"]],
+}
+VOWELS = "aeiouvy"
+
+
+def split_syllable(syllable, language):
+    """
+    Description: Split a romanised syllable into onset, rime and tone
+
+    Input : A syllable with its tone number (e.g. "gwong2") and the language (c or p)
+    Output: (onset, rime, tone), e.g. ("gw", "ong", "2"); a syllabic nasal (e.g. "ng5") has no onset
+    """
+    tone = syllable[-1] if syllable[-1].isdigit() else ""
+    base = syllable[:-1] if tone else syllable
+    onsets = sorted((onset for group in ONSET_CLASSES[language] for onset in group), key=len, reverse=True)
+    for onset in onsets:
+        # The rest must hold a vowel, otherwise the whole syllable is a syllabic nasal (e.g. "ng", not "n" + "g")
+        if base.startswith(onset) and nucleus(base[len(onset):]):
+            return onset, base[len(onset):], tone
+    return "", base, tone
+
+
+def onset_class(onset, language):
+    for index, group in enumerate(ONSET_CLASSES[language]):
+        if onset in group:
+            return index
+    return -1
+
+
+def nucleus(rime):
+    """The first vowel of a rime ("" for a syllabic nasal)"""
+    for letter in rime:
+        if letter in VOWELS:
+            return letter
+    return ""
+
+
+def substitute_cost(missing, candidate, language):
+    """
+    Description: How far a candidate unit is from a missing syllable (smaller is closer)
+
+    Input : The (onset, rime, tone) of the missing syllable and of the candidate, and the language
+    Output: The cost, None if they share neither onset nor rime (not a usable substitute)
+    """
+    onset, rime, tone = missing
+    other_onset, other_rime, other_tone = candidate
+    if onset != other_onset and rime != other_rime:
+        return None
+    cost = 0.0
+    if onset != other_onset:
+        cost += 1.0 if onset_class(onset, language) == onset_class(other_onset, language) else 2.0
+    if rime != other_rime:
+        cost += 1.0 if nucleus(rime) == nucleus(other_rime) else 3.0
+    if tone != other_tone:
+        # Any other tone costs less than changing a sound, the closest tone number first
+        distance = abs(int(tone) - int(other_tone)) if tone and other_tone else 9
+        cost += 0.5 + 0.01 * distance
+    return cost
+
+
+def fallback_table(missing, available, language):
+    """
+    Description: Pick a substitute unit for every missing syllable
+
+    Input : The missing syllables, the names of the usable units and the language (c or p)
+    Output: A dict missing syllable -> unit name ("" for silence)
+    """
+    candidates = [(name, split_syllable(name, language)) for name in sorted(available)]
+    table = dict([])
+    for syllable in sorted(missing):
+        parts = split_syllable(syllable, language)
+        best, best_cost = "", None
+        for name, candidate in candidates:
+            cost = substitute_cost(parts, candidate, language)
+            if cost is not None and (best_cost is None or cost < best_cost):
+                best, best_cost = name, cost
+        table[syllable] = best
+    return table
+
+
+def usable_units(voice):
+    """
+    Description: Units of a voice that can be played, and the common sample rate
+
+    Input : A voices.Voice
+    Output: (set of unit names, sample rate, dict of unit name -> problem for the rejected wavs)
+    """
+    if voice.store_path is not None:
+        store = voice.load_store()
+        return set(name for name, (start, end) in store.units.items() if end > start), store.rate, dict([])
+    formats, problems = dict([]), dict([])
+    for entry in os.scandir(voice.units):
+        if not entry.name.endswith(".wav"):
+            continue
+        name = entry.name[:-len(".wav")]
+        try:
+            with wave.open(entry.path, "rb") as f:
+                if f.getnframes() == 0:
+                    problems[name] = "empty"
+                    continue
+                formats[name] = (f.getframerate(), f.getnchannels(), f.getsampwidth())
+        except (wave.Error, EOFError, OSError) as error:
+            problems[name] = "unreadable ({})".format(error)
+    if not formats:
+        return set(), None, problems
+    # The format of most units is the voice format, the others would be played at the wrong rate
+    common = max(set(formats.values()), key=list(formats.values()).count)
+    for name, unit_format in formats.items():
+        if unit_format != common:
+            problems[name] = "format {} Hz, {} channel(s), {} byte(s) (voice: {} Hz, {} channel(s), {} byte(s))".format(
+                *(unit_format + common))
+    return set(name for name in formats if name not in problems), common[0], problems
+
+
+def check_voice(voice):
+    """
+    Description: Check every lexicon syllable of a voice against its units
+
+    Input : A voices.Voice
+    Output: A report dict (syllables checked, missing syllables, rejected units, fallback table, sample rate)
+    """
+    available, rate, problems = usable_units(voice)
+    syllables = set()
+    for char, phones in voice.lexicon.items():
+        for phone in phones:
+            if phone in ("sil_200", "sil_400"):
+                continue
+            syllables.add(phone if phone[-1].isdigit() else phone + voice.default_tone)
+    missing = syllables - available
+    return {"voice": voice.name, "checked": len(syllables), "missing": sorted(missing), "problems": problems,
+            "fallback": fallback_table(missing, available, voice.language), "rate": rate}
+
+
+def save_fallback(manifest, report):
+    """Write fallback.json next to a voice manifest and point the manifest to it"""
+    folder = os.path.dirname(manifest)
+    rate = report["rate"] or 0
+    with open(os.path.join(folder, FALLBACK_FILE), "w") as f:
+        f.write(json.dumps({"version": FALLBACK_VERSION, "rate": rate, "silence": int(SILENCE * rate),
+                            "units": report["fallback"]}, indent=1, sort_keys=True))
+    with open(manifest, "r") as f:
+        info = json.loads(f.read())
+    info["fallback"] = FALLBACK_FILE
+    with open(manifest, "w") as f:
+        f.write(json.dumps(info))
+
+
+def print_report(report):
+    print("{}: {} syllables checked, {} missing".format(report["voice"], report["checked"], len(report["missing"])))
+    for name, problem in sorted(report["problems"].items()):
+        print("  rejected unit {}: {}".format(name, problem))
+    for syllable in report["missing"]:
+        print("  {:<10} -> {}".format(syllable, report["fallback"][syllable] or "(silence)"))
+
+
+if __name__ == "__main__":
+    import glob
+    import voices
+    parser = argparse.ArgumentParser(description='Check the voice packs and build their missing-unit fallback tables.')
+    parser.add_argument('--voices', default=".", help="Folder containing voice packs (*/voice.json)")
+    parser.add_argument('--voice', default=None, help="Only check this voice")
+    parser.add_argument('--check-only', action="store_true", dest="check_only", default=False,
+                        help="Only report, do not write the fallback tables")
+    args = parser.parse_args()
+    for manifest in sorted(glob.glob(os.path.join(args.voices, "*", voices.MANIFEST))):
+        voice = voices.Voice.from_manifest(manifest)
+        if args.voice not in (None, voice.name):
+            continue
+        report = check_voice(voice)
+        print_report(report)
+        if not args.check_only:
+            save_fallback(manifest, report)
@@ -0,0 +1,354 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Multi-voice registry with lazy loading and memory-bounded eviction.
+
+A voice pack is a folder with a voice.json manifest, e.g. jyutping-wong-44100-v9/voice.json:
+    {"name": "jyutping-wong", "language": "c", "units": "jyutping-wong", "lexicon": "../phonedict_dict_can"}
+("units" and "lexicon" are relative to the manifest, an optional "store" points to compressed units
+built by unit_store.py, which are then decoded on demand into a small LRU instead of read from the wavs,
+an optional "fallback" to the missing-unit table built by voice_check.py, and an optional "words" to the
+pre-joined units of the frequent words built by word_units.py). The registry discovers all packs under a directory,
+but nothing is read until a voice is first used: the lexicon is loaded on the first request and unit wavs
+on the first time each syllable is needed. The resident memory of every voice (lexicon + cached units) is
+tracked, and the least-recently-used voices are unloaded when the total goes over the memory budget.
+
+Usage:
+    registry = VoiceRegistry(".", memory_budget=256*2**20)
+    voice = registry.for_language("c")
+    phones = voice.lexicon["你"]
+    data = voice.unit("nei5")
+    print(registry.stats())
+"""
+
+import os
+import sys
+import json
+import glob
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import simpleaudio
+import metrics
+
+# Manifest file name of a voice pack
+MANIFEST = "voice.json"
+
+
+class Voice:
+    """
+    Description: One voice pack: its lexicon and a cache of its unit wavs, both loaded lazily
+    """
+
+    def __init__(self, name, language, units, lexicon, default_tone="5", registry=None, store=None, cache_units=256,
+                 fallback=None, words=None):
+        self.name = name
+        self.language = language
+        # Unit folder and lexicon path
+        self.units = units
+        self.lexicon_path = lexicon
+        # Tone appended to syllables without one (e.g. neutral tone in Mandarin)
+        self.default_tone = default_tone
+        self.registry = registry
+        self.lock = threading.RLock()
+        self.rate = None
+        self._lexicon = None
+        self.lexicon_bytes = 0
+        self.cache = OrderedDict()
+        self.cache_bytes = 0
+        # Compressed unit store (optional), and the number of decoded units kept for it (LRU)
+        self.store_path = store
+        self.store = None
+        self.cache_units = cache_units
+        # Missing-unit table (optional): syllable -> substitute unit name ("" for silence), loaded with the lexicon
+        self.fallback_path = fallback
+        self.fallback = dict([])
+        self.silence = None
+        # Pre-joined units of the frequent words (optional, memory-mapped on first use)
+        self.words_path = words
+        self.words = None
+        # Names of the units the voice has (e.g. for the tone sandhi rules), listed on first use
+        self._syllables = None
+        self.syllables_bytes = 0
+        # Pitch marks of the units (for the intonation stage), loaded on first use
+        self.pitchmark_index = None
+        # Statistics
+        self.load_time = 0.0
+        self.loads = 0
+        self.unit_hits = 0
+        self.unit_misses = 0
+        self.unit_time = 0.0
+        self.fallbacks = 0
+
+    @classmethod
+    def from_manifest(cls, manifest, registry=None):
+        """Create a voice from its voice.json (paths in the manifest are relative to it)"""
+        with open(manifest, "r") as f:
+            info = json.loads(f.read())
+        folder = os.path.dirname(manifest)
+        store = os.path.join(folder, info["store"]) if "store" in info else None
+        fallback = os.path.join(folder, info["fallback"]) if "fallback" in info else None
+        words = os.path.join(folder, info["words"]) if "words" in info else None
+        return cls(info["name"], info["language"], os.path.join(folder, info.get("units", ".")),
+                   os.path.join(folder, info["lexicon"]), info.get("default_tone", "5"), registry, store,
+                   fallback=fallback, words=words)
+
+    @property
+    def loaded(self):
+        return self._lexicon is not None
+
+    @property
+    def lexicon(self):
+        """Phone dictionary of the voice (char -> list of syllables), loaded on first use"""
+        if self._lexicon is None:
+            self.load()
+        return self._lexicon
+
+    def load(self):
+        with self.lock:
+            if self._lexicon is not None:
+                return
+            start = time.perf_counter()
+            with open(self.lexicon_path, "r") as f:
+                lexicon = json.loads(f.read())
+            # special char
+            lexicon["sil_200"] = ["sil_200"]
+            lexicon["sil_400"] = ["sil_400"]
+            if self.fallback_path is not None:
+                with open(self.fallback_path, "r") as f:
+                    table = json.loads(f.read())
+                self.fallback = table["units"]
+                self.silence = np.zeros(table["silence"], dtype=np.int16)
+                self.silence.setflags(write=False)
+                self.rate = self.rate or table["rate"] or None
+            # Rough resident size of the dict, its keys and the syllable lists
+            self.lexicon_bytes = sys.getsizeof(lexicon) + sum(
+                sys.getsizeof(char) + sys.getsizeof(phones) + sum(sys.getsizeof(phone) for phone in phones)
+                for char, phones in lexicon.items())
+            self._lexicon = lexicon
+            self.load_time += time.perf_counter() - start
+            self.loads += 1
+
+    def unload(self):
+        """Drop the lexicon, all cached units, the unit names and the pitch marks (loaded again on their next use)"""
+        with self.lock:
+            self._lexicon = None
+            self.lexicon_bytes = 0
+            self.store = None
+            self.words = None
+            self._syllables = None
+            self.syllables_bytes = 0
+            self.pitchmark_index = None
+            self.cache = OrderedDict()
+            self.cache_bytes = 0
+
+    def load_store(self):
+        """Load the compressed unit store on first use"""
+        with self.lock:
+            if self.store is None:
+                import unit_store
+                start = time.perf_counter()
+                self.store = unit_store.CompressedUnitStore(self.store_path)
+                self.rate = self.store.rate
+                self.load_time += time.perf_counter() - start
+        return self.store
+
+    def load_words(self):
+        """Map the pre-joined word units on first use (None if the voice has none)"""
+        if self.words_path is None:
+            return None
+        with self.lock:
+            if self.words is None:
+                import word_units
+                self.words = word_units.WordInventory(self.words_path)
+        return self.words
+
+    @property
+    def syllables(self):
+        """Names of the units of the voice (from the compressed store, or the wavs of the unit folder)"""
+        if self._syllables is None:
+            if self.store_path is not None:
+                names = self.load_store().units
+            else:
+                names = [name[:-len(".wav")] for name in os.listdir(self.units) if name.endswith(".wav")]
+            syllables = frozenset(names)
+            self.syllables_bytes = sys.getsizeof(syllables) + sum(sys.getsizeof(name) for name in syllables)
+            self._syllables = syllables
+        return self._syllables
+
+    def unit_name(self, phone):
+        """
+        Description: Name of the unit played for a syllable (wav name without .wav)
+
+        Input : A syllable as found in the lexicon
+        Output: The unit name, its substitute from the fallback table if the voice has no unit for it,
+                or "" for silence
+        """
+        if not phone[-1].isdigit():
+            phone = phone + self.default_tone
+        return self.fallback.get(phone, phone)
+
+    def unit_path(self, phone):
+        return os.path.join(self.units, self.unit_name(phone) + ".wav")
+
+    def unit(self, phone):
+        """
+        Description: Samples of one syllable unit, read from disk on its first use
+
+        Input : A syllable as found in the lexicon (e.g. "nei5")
+        Output: A read-only int16 numpy array (copy it before modifying it in place)
+        """
+        data = self.cache.get(phone)
+        if data is not None:
+            self.unit_hits += 1
+            metrics.UNIT_HITS.inc(self.name)
+            if self.store_path is not None:
+                with self.lock:
+                    if phone in self.cache:
+                        self.cache.move_to_end(phone)
+            return data
+        start = time.perf_counter()
+        name = self.unit_name(phone)
+        if name != phone and name != phone + self.default_tone:
+            self.fallbacks += 1
+            metrics.UNIT_FALLBACKS.inc(self.name)
+        if name == "":
+            rate, data = self.rate, self.silence
+        elif self.store_path is not None and name in self.load_store():
+            # Decode only this unit from the compressed store
+            rate, data = self.store.rate, self.store.decode(name)
+        else:
+            rate, data = simpleaudio.read_wav(os.path.join(self.units, name + ".wav"))
+        data.setflags(write=False)
+        with self.lock:
+            self.rate = rate
+            if phone not in self.cache:
+                self.cache[phone] = data
+                self.cache_bytes += data.nbytes
+                # With a compressed store only a small LRU of decoded units is kept
+                if self.store_path is not None:
+                    while len(self.cache) > self.cache_units:
+                        evicted = self.cache.popitem(last=False)[1]
+                        self.cache_bytes -= evicted.nbytes
+            self.unit_misses += 1
+            self.unit_time += time.perf_counter() - start
+        metrics.UNIT_LOADS.inc(self.name)
+        metrics.STAGE_SECONDS.observe(time.perf_counter() - start, "unit_load")
+        if self.registry is not None:
+            self.registry.enforce_budget(keep=self)
+        return data
+
+    def pitchmarks(self, phone):
+        """
+        Description: Pitch marks of one syllable unit, from the offline index (see pitchmarks.py)
+
+        Input : A syllable as found in the lexicon
+        Output: An int32 array of mark positions and a bool array of voiced flags
+        """
+        if self.pitchmark_index is None:
+            import pitchmarks
+            self.pitchmark_index = pitchmarks.PitchmarkIndex(self)
+        name = self.unit_name(phone)
+        return self.pitchmark_index.get(name, self.unit(phone))
+
+    def memory(self):
+        """Resident memory of the voice in bytes"""
+        store_bytes = self.store.nbytes if self.store is not None else 0
+        index = self.pitchmark_index
+        marks_bytes = index.nbytes if index is not None else 0
+        return self.lexicon_bytes + self.cache_bytes + store_bytes + self.syllables_bytes + marks_bytes
+
+    def stats(self):
+        lookups = self.unit_hits + self.unit_misses
+        return {"language": self.language, "loaded": self.loaded, "memory": self.memory(),
+                "loads": self.loads, "load_time": self.load_time, "units_cached": len(self.cache),
+                "unit_hits": self.unit_hits, "unit_misses": self.unit_misses, "unit_time": self.unit_time,
+                "unit_fallbacks": self.fallbacks,
+                "unit_hit_rate": self.unit_hits / lookups if lookups else 0.0}
+
+
+class VoiceRegistry:
+    """
+    Description: All voices found under a directory, kept within a memory budget (LRU eviction)
+    """
+
+    def __init__(self, voice_dir=".", memory_budget=None):
+        """
+        Input : Directory to search for voice packs (*/voice.json) and the memory budget in bytes (None: unbounded)
+        """
+        self.memory_budget = memory_budget
+        self.lock = threading.RLock()
+        self.voices = dict([])
+        # Default voice per language (first discovered, or set with set_default)
+        self.defaults = dict([])
+        # Loaded voices, least recently used first
+        self.lru = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.discover(voice_dir)
+
+    def discover(self, voice_dir):
+        for manifest in sorted(glob.glob(os.path.join(voice_dir, "*", MANIFEST))):
+            self.add(Voice.from_manifest(manifest))
+
+    def add(self, voice, default=False):
+        voice.registry = self
+        with self.lock:
+            self.voices[voice.name] = voice
+            if default or voice.language not in self.defaults:
+                self.defaults[voice.language] = voice.name
+        return voice
+
+    def set_default(self, language, name):
+        self.defaults[language] = name
+
+    def get(self, name):
+        """A voice by name, its lexicon loaded (raise KeyError for an unknown voice)"""
+        voice = self.voices[name]
+        with self.lock:
+            if name in self.lru:
+                self.hits += 1
+                self.lru.move_to_end(name)
+            else:
+                self.misses += 1
+                self.lru[name] = voice
+        voice.load()
+        self.enforce_budget(keep=voice)
+        return voice
+
+    def for_language(self, language):
+        """The default voice of a language (c or p)"""
+        return self.get(self.defaults[language])
+
+    def memory(self):
+        return sum(voice.memory() for voice in self.voices.values())
+
+    def enforce_budget(self, keep=None):
+        """Unload least-recently-used voices until the total memory fits the budget (never the voice in use)"""
+        if self.memory_budget is None:
+            return
+        with self.lock:
+            for name in list(self.lru):
+                if self.memory() <= self.memory_budget:
+                    break
+                if self.voices[name] is keep:
+                    continue
+                self.voices[name].unload()
+                del self.lru[name]
+                self.evictions += 1
+            # Still over budget with only the voice in use left: drop its unit cache (the lexicon stays)
+            if keep is not None and self.memory() > self.memory_budget:
+                with keep.lock:
+                    keep.cache = OrderedDict()
+                    keep.cache_bytes = 0
+
+    def stats(self):
+        """Load times, hit rates and resident memory of the registry and of every voice"""
+        lookups = self.hits + self.misses
+        return {"memory": self.memory(), "memory_budget": self.memory_budget,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "voices": dict((name, voice.stats()) for name, voice in self.voices.items())}
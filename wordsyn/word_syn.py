@@ -9,6 +9,7 @@ New user please install:
 
 Usage:
     python word_syn.py <input_sequence> <language: c or p>
+    (English words in the input are synthesised by eng_diphone_synth.py, see --engDiphones and --workers)
 
 Example:
     python3 word_syn.py "1/1/2001，999！翻译都要执行多个翻译系统，这带来巨大的计算成本。如今，许多领域都正在被神经网路技术颠覆。" -l p -p -v 80 -c
@@ -73,22 +74,38 @@ PROCEDURE
 """
 
 # (Part 0) - Import necessary libraries
-import json, sys, re, argparse, pickle
+import os, sys, re, time, argparse, functools
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from pprint import pprint
 # Please put the py file in the same dir
 # FOLLOWUP: later should optimize this and re-write the load methods
 import simpleaudio
-# import eng_diphone_synth
+# Splits code-switched input into Chinese / English runs (English runs go to eng_diphone_synth)
+import code_switch
+# Codepoint lookup tables for auto-selecting Cantonese / Mandarin
+import lang_detect
+# Voice packs and their lexicons, loaded on first use
+import voices
+# Streaming output encoders (wav, raw, mulaw, alaw)
+import encoders
+# Char / token timing sidecar of the output
+import alignment
+# Background unit loading overlapped with the frontend and concatenation
+import prefetch
+# Counters and latency histograms of the pipeline stages
+import metrics
+# Scatter-gather output: unit views and computed joins written with vectored writes
+import splice
 
-# New user please install: pip install -U pycantonese
-import pycantonese as pc
 # New user please install: pip install opencc-python-reimplemented
-from opencc import OpenCC
 # REMOVED: New user please install: pip install pkuseg
 # REMOVED: import pkuseg
 # New user please install: pip install jieba
-import jieba
+# NOTE: OpenCC and jieba are imported on first use (get_converter() / get_jieba()) to keep start-up fast,
+# pycantonese is only needed by the dictionary build scripts
+# NOTE: So are the modules of the optional stages, in the functions that use them: sandhi (tone sandhi rules),
+# psola (-i / -s), effects (-v / --effects), longform (-f), shared_audio (--processes) and document (--document)
 
 # (PART 1) Argv management and global variables
 # (1.1) - Argv to argparse
@@ -98,61 +115,123 @@ parser = argparse.ArgumentParser(
 parser.add_argument('--canPhones', default="./jyutping-wong-44100-v9/jyutping-wong/", help="Folder containing Cantonese wavs")
 parser.add_argument('--mandPhones', default="./pinyin-yali-44100/", help="Folder containing Mandarin wavs")
 # User interface
-parser.add_argument('phrase', nargs=1, help="The phrase to be synthesised")
+parser.add_argument('phrase', nargs='?', default="", help="The phrase to be synthesised")
+parser.add_argument('--infile', '-f', action="store", dest="infile", type=str, default=None,
+                    help="Long-form mode: read the text from a file ('-' for stdin) and write it paragraph by paragraph to --outfile")
+parser.add_argument('--document', default=None,
+                    help="Document mode: keep the audio of every sentence in this folder and re-render only the changed sentences on the next run")
+parser.add_argument('--max-memory', action="store", dest="max_memory", type=int, default=64,
+                    help="Long-form mode: memory budget in MB for the audio of one block")
 parser.add_argument('--language', "-l", action="store", dest="language", type=str, help="Choose the language for output", default=None)
+parser.add_argument('--quiet', '-q', action="store_true", default=False,
+                    help="Do not print the linguistic information of the input (printed on stderr, stdout only carries the audio with -o -)")
 parser.add_argument('--play', '-p', action="store_true", default=False, help="Play the output audio")
-parser.add_argument('--outfile', '-o', action="store", dest="outfile", type=str, help="Save the output audio to a file", default=None)
+parser.add_argument('--outfile', '-o', action="store", dest="outfile", type=str, help="Save the output audio to a file ('-' for stdout)", default=None)
+parser.add_argument('--format', default="wav", choices=sorted(encoders.ENCODERS),
+                    help="Output format: wav, headerless 16 bit raw PCM, or 8 kHz mu-law / A-law for telephony")
+parser.add_argument('--no-direct', action="store_false", dest="direct", default=True,
+                    help="Join the whole output in memory before saving it, instead of writing the unit samples straight from the voice (see splice.py)")
+parser.add_argument('--effects', default=None,
+                    help="Effects chain applied to the output, e.g. dc,echo:0.25:0.4,reverb:1.0:0.2,fade:0.01:0.2,gain:-3 (see effects.py)")
 parser.add_argument('--crossfade', '-c', action="store_true", default=False,
 					help="Enable slightly smoother concatenation by cross-fading between tokens")
 parser.add_argument('--volume', '-v', default=None, type=int, help="An int between 0 and 100 representing the desired volume")
+parser.add_argument('--loudness', default=-16.0, type=float,
+                    help="Loudness (LUFS) of the output at -v 100, lower volumes are quieter by 20*log10(volume/100) dB")
 parser.add_argument('--speed', '-s', default=None, type=float, help="A float between 0 - 3 representing the desired speed")
+parser.add_argument('--intonation', '-i', action="store_true", default=False,
+                    help="Apply a falling (declination) pitch contour over each sentence")
+parser.add_argument('--no-sandhi', action="store_false", dest="sandhi", default=True,
+                    help="Read every char with its dictionary tone (no tone sandhi / changed tones, see sandhi.py)")
 # FOLLOWUP: Add -> voice options? speed? emotion? 
 
+parser.add_argument('--engDiphones', default="./diphones", help="Folder containing English diphone wavs (for code-switched input)")
+parser.add_argument('--workers', '-w', default=4, type=int, help="Number of workers rendering Chinese/English segments concurrently")
+parser.add_argument('--jobs', '-j', default=1, type=int, help="Number of workers rendering the sentences of the input concurrently")
+parser.add_argument('--processes', action="store_true", default=False,
+                    help="Render the sentences in worker processes instead of threads (uses all cores, voices are loaded before the workers start)")
+parser.add_argument('--metrics', default=None, help="Write the metrics of the run to this file (Prometheus text format)")
+parser.add_argument('--voices', default=".", help="Folder containing voice packs (*/voice.json)")
+parser.add_argument('--voice', default=None, help="Name of the voice pack to use (default: the voice of the selected language)")
+parser.add_argument('--voiceMemory', default=512, type=int, help="Memory budget for loaded voices in MB")
+
 # (1.2) Parse arguments from the command line
-try: 
-    # Test if the user gave any argument
-    assert len(sys.argv) > 1
-    # If yes, parse all arguments 
-    args = parser.parse_args() 
-except:
-    if len(sys.argv) == 1: 
-        # If the user didn't input any argument, show the usage information
-        print(parser.format_usage()) 
-        # Gives instructions before quit
-        print("*** ERROR: Required input phrase is missing, please provide an input string argument for synthesis.")
-    else:
-        # Otherwise, refer to an error message
-        print("*** ERROR: Please check the missing/incorrect argument.")
-        print("Usage Examples with input types:")
-        print("\t  -volume \t<int: 0-100>")
-        print("\t  -outfile \t<string: filename>")
-    exit()
+def parse_arguments():
+    """Parse the command line, show the usage information and quit if it is incorrect"""
+    try: 
+        # Test if the user gave any argument
+        assert len(sys.argv) > 1
+        # If yes, parse all arguments 
+        return parser.parse_args() 
+    except:
+        if len(sys.argv) == 1: 
+            # If the user didn't input any argument, show the usage information
+            print(parser.format_usage()) 
+            # Gives instructions before quit
+            print("*** ERROR: Required input phrase is missing, please provide an input string argument for synthesis.")
+        else:
+            # Otherwise, refer to an error message
+            print("*** ERROR: Please check the missing/incorrect argument.")
+            print("Usage Examples with input types:")
+            print("\t  -volume \t<int: 0-100>")
+            print("\t  -outfile \t<string: filename>")
+        exit()
+
+# Default options when this file is imported as a module (replaced by the command line in __main__)
+args = parser.parse_args([""])
 
 # (1.3) Global variables
+def log(*values):
+    """Diagnostics of the pipeline, on stderr so that stdout can carry the audio (-o -), nothing with --quiet"""
+    if not args.quiet:
+        print(*values, file=sys.stderr)
+
 def check_lang(input_sequence):
     """Determine the language variaty of the input sequence and auto-select the langugae for synthesis."""
-    # FOLLOWUP!: add classification methods
-    language = 'p'
-    return language
+    # Vectorized lookup of script (simplified/traditional), Cantonese-specific characters and dictionary coverage
+    return lang_detect.check_lang(input_sequence)
 
-def assign_paths(language):
-    """Select the required database according to the option given. If no language option is given, auto select by check_lang()."""    
+def get_registry():
+    """The voice registry, created on first use from the --voices folder"""
+    global registry
+    if registry is None:
+        registry = voices.VoiceRegistry(args.voices, memory_budget=args.voiceMemory*2**20)
+        # Folders given with --canPhones / --mandPhones replace the discovered voices of that language
+        for language, folder, default, dictpath in (("c", args.canPhones, parser.get_default("canPhones"), 'phonedict_dict_can'),
+                                                    ("p", args.mandPhones, parser.get_default("mandPhones"), "phonedict_dict_pth_perc")):
+            if folder != default or language not in registry.defaults:
+                registry.add(voices.Voice("custom-" + language, language, folder, dictpath), default=True)
+    return registry
+
+def assign_paths(language, input_sequence=""):
+    """Select the required voice (database and dictionary) according to the option given. If no language option is given, auto select by check_lang()."""    
+    # A voice chosen by name decides the language
+    if args.voice != None:
+        voice = get_registry().get(args.voice)
+        return voice.language, voice
     # If no selected option, auto-select
     if language == None:
-        language = check_lang(args.phrase[0])  
-        args.language = language  
-    # Cantonese
-    if language == "c":
-        path = args.canPhones
-        dictpath = 'phonedict_dict_can'
-    # Mandarin
-    elif language == "p":
-        path = args.mandPhones
-        dictpath = "phonedict_dict_pth_perc"
-    return path, dictpath
-
-# (1.3) Select reuired database/dictionary accoring to the given lang option
-path, dictpath = assign_paths(args.language)
+        language = check_lang(input_sequence)  
+    # Cantonese (c) or Mandarin (p)
+    return language, get_registry().for_language(language)
+
+def get_jieba():
+    """jieba, imported on first use (it loads its dictionary on the first cut)"""
+    import jieba
+    return jieba
+
+# OpenCC converters by config, created on first use
+converters = dict([])
+
+def get_converter(config):
+    """The OpenCC converter of a config (t2s or s2t), created once and reused"""
+    if config not in converters:
+        from opencc import OpenCC
+        converters[config] = OpenCC(config)
+    return converters[config]
+
+# (1.4) Voice registry (loads voices lazily and keeps them within --voiceMemory)
+registry = None
 
 # (PART 2) Define Functions and Classes
 """
@@ -166,7 +245,10 @@ path, dictpath = assign_paths(args.language)
 
 (2.3) User interface functions
     adjust_volume() : Volume Control
+    apply_effects() : Effects chain on the output
     save()          : Basic user interface to save the audio
+    save_alignment(): Save the char / token timing sidecar
+    save_metrics()  : Save the metrics of the run
     play_audio()    : Basic user interface to play the audio
 """
 
@@ -175,9 +257,15 @@ class Sequence:
     seq info, contain char info in each item in a list
     """
 
-    def __init__(self, string=""): 
+    def __init__(self, string="", language="p", phonedict=None, on_token=None, syllables=None): 
         
         # (Step 0) - Define attributes
+        self.language = language
+        self.phonedict = phonedict
+        # Units of the voice, syllables the tone sandhi rules may change to (see voices.Voice.syllables)
+        self.syllables = syllables
+        # Called with every token as soon as it is created (e.g. to prefetch its units)
+        self.on_token = on_token
         self.utterance = ""
         self.norm_utterance = ""
         self.tokens = []
@@ -189,16 +277,26 @@ class Sequence:
     def sayText(self,string):
         self.utterance = string
         self.norm_utterance = self.normalize(self.utterance) 
-        self.seglist = jieba.cut(self.norm_utterance, cut_all=False)
+        # Step 3.6 - Contextual readings (tone sandhi, changed tones) of the whole utterance, before the
+        # tokens are handed to on_token (their units may be loaded right away)
+        self.readings = dict([])
+        if args.sandhi and self.phonedict != None:
+            import sandhi
+            self.readings = sandhi.apply(self.norm_utterance, self.language, self.phonedict, self.syllables)
+        self.seglist = get_jieba().cut(self.norm_utterance, cut_all=False)
         # self.seglist = self.word_seg(self.norm_utterance)
         self.tokens = []
+        offset = 0
         for each in self.seglist:
-            self.tokens.append(Token(each))
+            self.tokens.append(Token(each, self.phonedict, self.readings, offset))
+            offset += len(each)
+            if self.on_token != None:
+                self.on_token(self.tokens[-1])
 
     # FOLLOWUP: SUPER SLOW!
     def word_seg(self, string):
         """Word seg"""
-        print('Around 15s:')
+        log('Around 15s:')
         seg = pkuseg.pkuseg()   #以默认配置加载模型
         tokens = seg.cut(string)	#进行分词
         return tokens
@@ -218,11 +316,11 @@ class Sequence:
     def text_conversion(self, string):
         """S2T/T2S Conversion by OpenCC (https://github.com/BYVoid/OpenCC)"""
         # convert from Traditional Chinese to Simplified Chinese
-        if args.language == 'p':
-            cc = OpenCC('t2s') 
+        if self.language == 'p':
+            cc = get_converter('t2s') 
         # convert from Simplified Chinese to Traditional Chinese
-        elif args.language == 'c':
-            cc = OpenCC('s2t')  
+        elif self.language == 'c':
+            cc = get_converter('s2t')  
         return cc.convert(string)
 
     def nsw_conversion(self, string):
@@ -301,7 +399,7 @@ class Sequence:
                 output = year_output + "年" + output 
 
         # Provide a message to inform users about the auto number/date conversion
-        print("Translated number expressions: " + number_seq + " ->" + re.sub("\s+"," ",output))
+        log("Translated number expressions: " + number_seq + " ->" + re.sub("\s+"," ",output))
 
         return output
 
@@ -340,26 +438,29 @@ class Sequence:
         return number_words
 
     def print_seq_info(self):
-        pprint("Surface utterance sequence: {}".format(self.utterance))
-        print()
-        pprint("Normalized utterance sequence: {}".format(self.norm_utterance))
-        print()
+        # On stderr: stdout only carries the audio when it is written to a pipe (-o -)
+        if args.quiet:
+            return
+        pprint("Surface utterance sequence: {}".format(self.utterance), stream=sys.stderr)
+        log()
+        pprint("Normalized utterance sequence: {}".format(self.norm_utterance), stream=sys.stderr)
+        log()
         tokenlist = [] 
         for eachtoken in self.tokens:
             token = ""
             for eachchar in eachtoken.chars:
                 token = token + eachchar.char
             tokenlist.append(token)
-        pprint("List of tokens: {}".format(tokenlist))
-        print()
+        pprint("List of tokens: {}".format(tokenlist), stream=sys.stderr)
+        log()
 
         charlist = [] 
         for eachtoken in self.tokens:
             for eachchar in eachtoken.chars:
                 charlist.append(eachchar.char)
         
-        pprint("List of chars: {}".format(charlist))
-        print()
+        pprint("List of chars: {}".format(charlist), stream=sys.stderr)
+        log()
 
     # def strB2Q(ustring):
     #     # modified from https://codertw.com/%E7%A8%8B%E5%BC%8F%E8%AA%9E%E8%A8%80/373914/
@@ -382,36 +483,41 @@ class Sequence:
     #     return outputString
 
 class Token:
-    def __init__(self, string):
+    def __init__(self, string, phonedict=None, readings=None, offset=0):
 
         self.token = []
 
         self.chars = []
-        for each in string:
-            self.chars.append(Char(each))
+        for index, each in enumerate(string):
+            self.chars.append(Char(each, phonedict))
+            # Contextual reading from the sandhi rules (readings: position in the utterance -> syllable)
+            if readings and offset + index in readings:
+                self.chars[-1].set_reading(readings[offset + index])
 
 class Char:
     """
     char info, each char info
     """
-    # prepare phone dict
-    phonedict = dict([])
-    f = open(dictpath, 'r')
-    phonedict = json.loads(f.read())
-
-    # special char
-    phonedict["sil_200"] = ["sil_200"]
-    phonedict["sil_400"] = ["sil_400"]
 
-    def __init__(self, string):
+    def __init__(self, string, phonedict):
+        # The char of the text (punctuation keeps its char here, self.char is the pause it is read as)
+        self.text = string
         self.char = self.normalize(string)
-        self.phone = self.phonedict[self.char]
+        try:
+            self.phone = phonedict[self.char]
+        except KeyError:
+            metrics.MISSING_CHARS.inc()
+            raise
         self.onset = ""
         self.nu = ""
         self.coda = ""
         self.tone = ""
         self.stress = False
 
+    def set_reading(self, syllable):
+        """Read the char as syllable (put first, the lexicon list itself is shared and left untouched)"""
+        self.phone = [syllable] + [phone for phone in self.phone if phone != syllable]
+
     def normalize(self, string):
         string = re.sub("，", "sil_200", string)
         string = re.sub(r"[：；。？！]", "sil_400", string)
@@ -419,146 +525,640 @@ class Char:
 
 # (2.3) User interface functions
 
+def volume_chain(volume=None, rate=simpleaudio.RATE):
+    """
+    Description: Streaming volume control: loudness normalisation to the target of -v and a look-ahead peak limiter
+
+    Input: Required volume adjustment value 0 to 100 and the sample rate
+    Output:An effects.EffectsChain (None without -v), its latency is the loudness window (400 ms)
+    """
+    if volume == None:
+        return None
+    # Ensure the volume scaling is in the expected range
+    if volume < 0 or volume > 100:
+        raise ValueError("Expected scaling factor between 0 and 100.")
+    import effects
+    if volume == 0:
+        return effects.EffectsChain([effects.Gain(float("-inf"))])
+    # Conver the input int 0-100 to a loudness target relative to --loudness (at -v 100)
+    return effects.loudness_chain(args.loudness + 20 * np.log10(volume / 100.0), rate)
+
 def adjust_volume(volume=None, object=None):
     """
-    Description: Volume Control
+    Description: Volume Control (same loudness for every prompt, no sample over -1 dBFS)
     
     Input: Required volume adjustment value 0 to 100 and the object to adjust
     Output:The volume adjusted audio object
     """
-    if volume != None:
-        # Ensure the volume scaling is in the expected range
-        if volume < 0 or volume > 100:
-            raise ValueError("Expected scaling factor between 0 and 100.")
-        # Conver the input int 0-100 to a float number between 0-1 and rescale accordingly
-        object.rescale(volume/100.0)
+    chain = volume_chain(volume, object.rate)
+    if chain != None:
+        with metrics.timer("volume"):
+            object.set_float(chain.apply(object.get_float()))
     # Return the modified audio object
     return object 
 
-def save(output_file=None, object=None):
+def apply_effects(effects_spec=None, object=None):
+    """
+    Description: Run the output through an effects chain (see effects.parse_chain), block by block
+
+    Input: The effects description (e.g. "dc,reverb:1.0:0.2") and the object to process
+    Output:The processed audio object (longer by the tails of the effects, e.g. the reverb decay)
+    """
+    if effects_spec != None:
+        import effects
+        with metrics.timer("effects"):
+            object.set_float(effects.parse_chain(effects_spec, object.rate).apply(object.get_float()))
+    return object
+
+def save(output_file=None, object=None, format="wav"):
     """
-    Description: Basic user interface to save the audio
+    Description: Basic user interface to save the audio ('-' writes to stdout)
     """
     if output_file != None:
-        object.save(output_file)
+        with metrics.timer("save"), encoders.open_encoder(format, output_file, object.rate) as encoder:
+            if isinstance(object.data, splice.SegmentPlan):
+                # Unit samples straight from the voice, only the joins are converted
+                encoder.write_plan(object.data)
+            else:
+                encoder.write(object.data)
+        if output_file == "-":
+            return encoder.out_rate
         print("It is saved as:", output_file)
         # (EXTRA) Ensure user understand the potential error
-        if ".wav" not in output_file:
+        if format == "wav" and ".wav" not in output_file:
             print("*** WARNING: File might not be saved properly if your file extension is not .wav")
+        return encoder.out_rate
 
-def save_pickle(output_file=None, object=None):
+def save_alignment(output_file=None, timing=None, rate=None):
     """
-    Description: Basic user interface to save the pickle file 
+    Description: Basic user interface to save the alignment sidecar (<output_file>.align.json) 
+
+    Input : The output file name, the Alignment of the output and the sample rate of the saved file
     """
-    if output_file != None:
-        with open(output_file+'.pickle', 'wb') as out:
-            pickle.dump(object, out)
+    if output_file != None and output_file != "-":
+        if rate != None:
+            timing = timing.rescaled(rate)
+        timing.save(output_file + alignment.SUFFIX)
+
+def save_metrics(metrics_file=None):
+    """
+    Description: Basic user interface to save the metrics of the run (Prometheus text format)
+    """
+    if metrics_file != None:
+        metrics.REGISTRY.write(metrics_file)
 
 def play_audio(play=False, object=None):
     """
     Description: Basic user interface to play the audio
     """
     if play == True:
+        if isinstance(object.data, splice.SegmentPlan):
+            object.data = object.data.materialize()
         object.play()
 
-# Main module
-def main():
-    # Step 1 - Get input utterance sequence
-    inputseq = args.phrase[0]
-    # Step 2 - Put the text in a Sequence instance
-    inputseq = Sequence(inputseq)
+# (2.4) Synthesis functions
+
+def split_sentences(text):
+    """
+    Description: Split a text after sentence-final punctuation (and line breaks), keeping the punctuation
+
+    Input : A string
+    Output: A list of non-empty sentences
+    """
+    sentences = re.split(r"(?<=[。！？；!?;\n])", text)
+    return [sentence.strip() for sentence in sentences if sentence.strip() != ""]
+
+def synthesize(phrase, language=None, crossfade=False, intonation=False, speed=None, plan=False):
+    """
+    Description: Synthesize a Chinese (Cantonese or Mandarin) phrase
+
+    Input : The phrase, language option (c or p, auto-select if None), the crossfade option,
+            the intonation option, the speed (0-3, None keeps the recorded durations) and whether to
+            return the output as a splice.SegmentPlan (views of the units, see concatenate)
+    Output: An Audio object with the concatenated output (volume not adjusted)
+    """
+    start = time.perf_counter()
+    language, voice = assign_paths(language, phrase)
+    metrics.REQUESTS.inc(language)
+    # Step 2 and 3 - Put the text in a Sequence instance on the frontend thread, the units of every token
+    # are loaded in the background as soon as the token is known
+    # Tokens with a pre-joined word unit are loaded as one unit, unless the syllables are retargeted one by one
+    # or joined without the crossfade the word units were built with (units separated by gaps)
+    # TD-PSOLA rewrites every sample, a plan only makes sense for the recorded units
+    plan = plan and not intonation and speed == None
+    words = crossfade and not intonation and speed == None
+    load_word = functools.partial(word_loader, voice=voice, copy=not plan) if words else None
+    prefetcher = prefetch.UnitPrefetcher(functools.partial(load_unit, voice=voice, copy=not plan), load_word=load_word)
+    def frontend():
+        with metrics.timer("frontend"):
+            return Sequence(phrase, language, voice.lexicon, on_token=prefetcher.submit, syllables=voice.syllables)
+    prefetcher.start(frontend)
+    tokens = prefetcher
+    try:
+        # Step 3.8 - Intonation / duration by TD-PSOLA (the contour needs whole sentences, wait for all units)
+        if intonation or speed != None:
+            tokens = list(prefetcher)
+            with metrics.timer("intonation"):
+                apply_intonation(prefetcher.result(), voice, intonation=intonation, speed=speed)
+        # Step 4 - Concatenate the tokens in order as their units arrive (includes waiting for the units)
+        with metrics.timer("concatenate"):
+            output = concatenate(crossfade=crossfade, tokens=tokens, plan=plan)
+        prefetcher.result()
+    except BaseException:
+        # Do not leave the frontend thread blocked on the queue of a failed request
+        prefetcher.cancel()
+        raise
+    output.alignment.params.update({"language": language, "voice": voice.name})
+    metrics.CHARS.inc(language, amount=len(output.alignment))
+    metrics.STAGE_SECONDS.observe(time.perf_counter() - start, "synthesize")
+    return output
+
+def build_sequence(phrase, language=None):
+    """
+    Description: Frontend stage, put the text in a Sequence instance
+
+    Input : The phrase and language option (c or p, auto-select if None)
+    Output: The Sequence instance and the selected voice
+    """
+    # Select reuired database/dictionary accoring to the given lang option
+    language, voice = assign_paths(language, phrase)
+    return Sequence(phrase, language, voice.lexicon, syllables=voice.syllables), voice
+
+def load_unit(eachchar, voice, copy=True):
+    """
+    Description: Load the wav (or create the silence) of one char, saved as eachchar.eachphone
+
+    Input : A Char instance, the voice and whether to copy the unit (False keeps the read-only int16 samples
+            of the voice, for an output written as a splice.SegmentPlan)
+    """
+    eachchar.eachphone = simpleaudio.Audio(format=simpleaudio.paFloat32)
 
+    # Audio instance to handle audio information
+    sound_obj = simpleaudio.Audio(rate=48000, format=simpleaudio.paFloat32)
+
+    if eachchar.phone[0] in ["sil_200","sil_400"]:
+        if eachchar.phone[0] == "sil_200":
+            sound_obj.create_noise(9600,0)
+        if eachchar.phone[0] == "sil_400":
+            sound_obj.create_noise(19200,0)
+        # Digital silence is written as it is in a plan (no dither, nothing to compute)
+        eachchar.eachphone.data = sound_obj.data if copy else np.zeros(len(sound_obj.data), dtype=np.int16)
+    else:
+        phone = str(eachchar.phone[0])
+        eachchar.path = voice.unit_path(phone)
+        # Units are cached by the voice, converted to a new float32 array so the crossfade can scale the samples in place
+        eachchar.eachphone.data = simpleaudio.to_float32(voice.unit(phone), copy=True) if copy else voice.unit(phone)
+        eachchar.eachphone.rate = voice.rate
+
+def word_loader(eachtoken, voice, copy=True):
+    """
+    Description: Match a token against the pre-joined word units of the voice (see word_units.py)
+    NOTE  : Word units are joined with the crossfade of -c, only use them for a crossfaded output
+
+    Input : A Token instance, the voice and whether to copy the unit (see load_unit)
+    Output: A function loading the token from its word unit, None if there is no unit for its syllables
+    """
+    if voice.words_path == None or len(eachtoken.chars) < 2:
+        return None
+    key = voice.load_words().get([str(eachchar.phone[0]) for eachchar in eachtoken.chars])
+    if key == None:
+        return None
+    return functools.partial(load_word, eachtoken, voice, key, copy=copy)
+
+def load_word(eachtoken, voice, key, copy=True):
+    """Load the word unit of a token, saved as eachtoken.word (its chars get no unit of their own)"""
+    data, bounds = voice.load_words().unit(key)
+    eachtoken.word = simpleaudio.Audio(rate=voice.load_words().rate, format=simpleaudio.paFloat32)
+    # Converted to a new float32 array so the crossfade can scale the samples in place (or kept as a view
+    # of the memory-mapped word units for a splice.SegmentPlan)
+    eachtoken.word.data = simpleaudio.to_float32(data, copy=True) if copy else data
+    eachtoken.word.bounds = bounds
+    eachtoken.word.name = key
+    metrics.WORD_UNITS.inc(voice.name)
+
+def load_token(eachtoken, voice, words=True):
+    """Load the units of one token: its word unit if there is one (and words is set), otherwise every char"""
+    loader = word_loader(eachtoken, voice) if words else None
+    if loader != None:
+        loader()
+        return
+    for eachchar in eachtoken.chars:
+        load_unit(eachchar, voice)
+
+def load_units(inputseq, voice, words=True):
+    """Load stage, load the wav of every char in the sequence (or of its tokens with a word unit, for a crossfaded output)"""
     # hkcan_corpus = pc.hkcancor()
     # for each in inputseq.tokens:
     #     wordinfo = hkcan_corpus.search(character=each)
         # pprint(len(wordinfo))
         # pprint(wordinfo[:3])
     
+    for eachtoken in inputseq.tokens:
+        load_token(eachtoken, voice, words)
+
+def apply_intonation(inputseq, voice, intonation=True, speed=None):
+    """
+    Description: Intonation stage, retarget the F0 and duration of every syllable by TD-PSOLA
+
+    Input : A Sequence instance with loaded units, the voice, the intonation option (declination over
+            each sentence) and the speed (0-3, None keeps the recorded durations)
+    """
+    if speed != None and not 0 < speed <= 3:
+        raise ValueError("Expected speed between 0 and 3.")
+    duration = 1.0 if speed == None else 1.0 / speed
+
+    # Group the syllables into sentences (split at long pauses) for the declination contour
+    sentences = [[]]
     for eachtoken in inputseq.tokens:
         for eachchar in eachtoken.chars:
- 
-            eachchar.eachphone = simpleaudio.Audio()
-
-            # Audio instance to handle audio information
-            sound_obj = simpleaudio.Audio(rate=48000)
-
-            if eachchar.phone[0] in ["sil_200","sil_400"]:
-                if eachchar.phone[0] == "sil_200":
-                    sound_obj.create_noise(9600,0)
-                if eachchar.phone[0] == "sil_400":
-                    sound_obj.create_noise(19200,0)
-                eachchar.eachphone.data = sound_obj.data
-            else:
-                phone = str(eachchar.phone[0])
-                if not phone[-1].isdigit():
-                    phone = phone + "5"
-                eachchar.path = path + phone + ".wav"
-                eachchar.eachphone.load(eachchar.path)
+            if eachchar.phone[0] == "sil_400":
+                sentences.append([])
+            elif eachchar.phone[0] != "sil_200":
+                sentences[-1].append(eachchar)
+
+    import psola
+    for sentence in sentences:
+        contour = psola.declination(len(sentence)) if intonation else np.ones(len(sentence))
+        for eachchar, f0_ratio in zip(sentence, contour):
+            marks, voiced = voice.pitchmarks(str(eachchar.phone[0]))
+            data = psola.td_psola(eachchar.eachphone.data, marks, voiced, f0_ratio=f0_ratio, duration=duration)
+            # Kept in the float32 working format, converted once at the output
+            eachchar.eachphone.data = data
+
+def concatenate(inputseq=None, crossfade=False, tokens=None, plan=False):
+    """
+    Description: Concatenation stage, join the loaded wavs of all chars (with optional crossfade)
 
-    output = simpleaudio.Audio()
+    Input : A Sequence instance with loaded units and the crossfade option, or instead of the Sequence an
+            iterable yielding its tokens in order once their units are loaded (see prefetch.UnitPrefetcher),
+            and whether to build a splice.SegmentPlan instead of one array (units loaded with copy=False)
+    Output: An Audio object with the concatenated output (its data is the SegmentPlan with plan), and the
+            sample offsets of every char / token in output.alignment
+    """
+    output = simpleaudio.Audio(format=simpleaudio.paFloat32)
+    output.alignment = alignment.Alignment(output.rate)
+    if tokens == None:
+        tokens = inputseq.tokens
+    # Length of the output so far
+    position = 0
+    # Joined in one go at the end, the tail of the last piece is still scaled / cross-faded in place
+    # (or kept as the segments of a plan: the unit samples are then never copied)
+    pieces = splice.SegmentPlan() if plan else []
+    # Linear fade in / fade out levels (divided by 320) over the 320 data points (10 msc) near the edges of the units
+    fade_in = np.arange(320.0)
+    fade_out = fade_in[::-1]
 
     # Variable to track diphone index and processing char_index
     char_index = 0
-    # Normal concatenation without smoother
-    charlist = []
-    for eachtoken in inputseq.tokens:
-        for eachchar in eachtoken.chars:
-            charlist.append(eachchar.char)
-    
-    for eachtoken in inputseq.tokens:
-        for eachchar in eachtoken.chars:
-            empty_spacing = simpleaudio.Audio(rate=16000)
-            empty_spacing.create_noise(40,0)
+    empty_spacing = simpleaudio.Audio(rate=16000, format=simpleaudio.paFloat32)
+    empty_spacing.create_noise(40,0)
+    if plan:
+        empty_spacing.data = np.zeros(40, dtype=np.int16)
 
+    for eachtoken in tokens:
+        token = output.alignment.add_token("".join(eachchar.text for eachchar in eachtoken.chars), position, position)
+        # The units of the token: one per char, or its pre-joined word unit with the [start, end] of every char in it
+        word = getattr(eachtoken, "word", None)
+        if word != None:
+            units = [(word.data, word.name, list(zip(eachtoken.chars, word.bounds)))]
+        else:
+            # (a pause has no unit file: its unit is the silence it is read as)
+            units = [(eachchar.eachphone.data, os.path.basename(eachchar.path) if hasattr(eachchar, "path") else str(eachchar.phone[0]),
+                      [(eachchar, None)]) for eachchar in eachtoken.chars]
+        for unit_index, (data, unit, chars) in enumerate(units):
             temp_diphone = simpleaudio.Audio(rate=16000)
-            temp_diphone.data = eachchar.eachphone.data
-            if args.crossfade == False:
-                output.data = np.concatenate((output.data, temp_diphone.data))
-                output.data = np.concatenate((output.data, empty_spacing.data))
+            temp_diphone.data = data
+            # Start of this unit in the output (the crossfade overlaps it with the previous one)
+            start = position - 320 if crossfade and char_index > 0 else position
+            for eachchar, bounds in chars:
+                char_start, char_end = (start, start + len(data)) if bounds == None else (start + bounds[0], start + bounds[1])
+                # The source char (punctuation too) and the syllable it is read as ("" for a pause)
+                syllable = "" if eachchar.char in ("sil_200", "sil_400") else str(eachchar.phone[0])
+                output.alignment.add_char(eachchar.text, syllable, unit, token, char_start, char_end)
+            if unit_index == 0:
+                output.alignment.token_start[token] = start
+            output.alignment.token_end[token] = start + len(temp_diphone.data)
+            position = start + len(temp_diphone.data)
+            if crossfade == False:
+                pieces.append(temp_diphone.data)
+                pieces.append(empty_spacing.data)
+                position += len(empty_spacing.data)
             # If smoother is used, implement Extension E - Smoother Concatenation
-            else:            
-                adjust_level = 0.0
-                # This loop rescales the 320 data points (10 msc) near the both edges of the diphone
-                for index in range(0,321):    
-                    if char_index > 0:
-                        # Except the first diphone:
-                        # Scale the data points in the initial 10 msc of current working diphone
-                        # Order: Start scaling from the 1st point, 2nd, 3rd... througout the loop (From edge of diphone towards the middle)
-                        temp_diphone.data[index] = temp_diphone.data[index] * adjust_level/320.0
-                    if char_index < len(charlist)-1:
-                        # Except the last diphone:
-                        # Scale the data points in the last 10 msc of of current working diphone
-                        # Order: Start scaling from the last point, 2nd last, 3rd last... througout the loop (From edge of diphone towards the middle)
-                        temp_diphone.data[-(index+1)] = temp_diphone.data[-(index+1)] * adjust_level/320.0
-                    # Turn louder when moving inward in the next round of the loop
-                    adjust_level+=1
-                
-                # After rescale all, seperate the whole diphone into two portions: (1) initial 10msc, and (2) everything after 10msc
-                np.initial10msc = temp_diphone.data[:320]
-                np.after10msc = temp_diphone.data[320:]
-
-                # Combine diphone portions together in the output.data
-                if char_index == 0:
-                    # For the 1st diphone, concatenate the whole rocessed diphone data
-                    output.data = np.concatenate((output.data, temp_diphone.data))
-                else:
-                    # For later diphones, addup/cross-fade the first 10 msc of the current diphone with last 10 msc of the previous diphone (which saved in the output.data in the previous round)
-                    output.data[-320:] = output.data[-320:] + np.initial10msc
-                    # Concatenate the remaining part of the processed diphone data
-                    output.data = np.concatenate((output.data, np.after10msc))
+            elif char_index == 0:
+                # For the 1st diphone, keep the whole diphone data
+                pieces.append(temp_diphone.data)
+            elif plan:
+                # Only the 10 msc join is computed, the rest of the unit stays a view of the voice's samples
+                pieces.crossfade(temp_diphone.data, 320)
+            else:
+                # Except the first diphone: scale the initial 10 msc of current working diphone (louder towards the middle)
+                temp_diphone.data[:320] = temp_diphone.data[:320] * fade_in / 320.0
+                # The previous diphone is not the last one: scale its last 10 msc (the last diphone of the output is never scaled)
+                while len(pieces[-1]) < 320:
+                    pieces[-2:] = [np.concatenate(pieces[-2:])]
+                pieces[-1][-320:] = pieces[-1][-320:] * fade_out / 320.0
+                # Addup/cross-fade the first 10 msc of the current diphone with last 10 msc of the previous diphone
+                pieces[-1][-320:] = pieces[-1][-320:] + temp_diphone.data[:320]
+                # Keep the remaining part of the processed diphone data
+                pieces.append(temp_diphone.data[320:])
             # Increase monitereing index
             char_index += 1
+
+    if plan:
+        output.data = pieces
+    elif pieces:
+        output.data = np.concatenate(pieces)
+    return output
+
+def render_chinese(phrase, language=None, crossfade=False, intonation=False, speed=None, plan=False):
+    """Segment renderer for code-switched input: Chinese run -> (rate, samples or splice.SegmentPlan, alignment)"""
+    output = synthesize(phrase, language=language, crossfade=crossfade, intonation=intonation, speed=speed, plan=plan)
+    return output.rate, output.data, output.alignment
+
+def render_english(phrase, crossfade=False):
+    """Segment renderer for code-switched input: English run -> (rate, samples, alignment) by the diphone synthesizer"""
+    import eng_diphone_synth
+    metrics.REQUESTS.inc("en")
+    with metrics.timer("english"):
+        utt = eng_diphone_synth.Utterance(input_text=phrase)
+        diphone_synth = eng_diphone_synth.Synth(wav_folder=args.engDiphones, diphone_seq=utt.diphone_seq,
+                                                diph_emphasis=utt.diph_emphasis, smoother=crossfade)
+    metrics.CHARS.inc("en", amount=len(phrase))
+    output = diphone_synth.output
+    # NOTE: Diphones do not map to single chars, the English run is aligned as one token
+    timing = alignment.Alignment(output.rate, {"language": "en"})
+    timing.add_token(phrase, 0, len(output.data))
+    return output.rate, output.data, timing
+
+def input_language(text):
+    """The language of a whole input: -l, or detected once so that every sentence is read by the same voice"""
+    if args.language != None or args.voice != None:
+        return args.language
+    return check_lang(text)
+
+def render_mixed(phrase, rate=simpleaudio.RATE, timing=None, language=None):
+    """
+    Description: Split the input into Chinese / English runs, render them concurrently and stitch them in order
+
+    Input : The phrase (options are taken from the command line), the output sample rate, optionally an
+            Alignment that the char / token offsets of the output are appended to, and the language of the
+            Chinese runs (default: -l, auto-selected per run if None)
+    Output: A float32 numpy array (working format, full scale 1.0), or a splice.SegmentPlan (see direct_output())
+    """
+    runs = code_switch.split_runs(phrase)
+    renderers = {
+        code_switch.CHINESE: functools.partial(render_chinese, language=args.language if language == None else language,
+                                              crossfade=args.crossfade,
+                                              intonation=args.intonation, speed=args.speed, plan=direct_output()),
+        code_switch.ENGLISH: functools.partial(render_english, crossfade=args.crossfade),
+    }
+    return code_switch.render_runs(runs, renderers, rate=rate, workers=args.workers, alignment=timing)
+
+def direct_output():
+    """
+    Description: Whether the output is written straight from the unit samples (see splice.py): it is saved
+                 as 16 bit PCM and no later stage rewrites it sample by sample (effects, volume, TD-PSOLA)
+    """
+    return (args.direct and args.outfile != None and args.format in ("wav", "raw") and args.effects == None
+            and args.volume == None and not args.intonation and args.speed == None and args.document == None
+            and args.infile == None and not args.processes)
+
+def render_sentence(sentence, language=None):
+    """Sentence renderer for the sentence pool: sentence (and the language of the input) -> (rate, samples, alignment)"""
+    timing = alignment.Alignment(simpleaudio.RATE)
+    return simpleaudio.RATE, render_mixed(sentence, timing=timing, language=language), timing
+
+def render_sentence_shared(sentence, language=None):
+    """Sentence renderer for worker processes: the samples are handed back in shared memory (see shared_audio)"""
+    import shared_audio
+    rate, data, timing = render_sentence(sentence, language)
+    return rate, shared_audio.export(data, rate), timing
+
+def init_worker(options):
+    """Initializer of the worker processes: use the options of the parent process"""
+    global args
+    args = options
+
+def preload_voices(phrase=""):
+    """Load the lexicon (and unit store) of the voices a phrase may need, and the jieba dictionary"""
+    if args.voice != None:
+        selected = [get_registry().get(args.voice)]
+    else:
+        selected = [get_registry().for_language(language) for language in ([args.language] if args.language else ["c", "p"])]
+    for voice in selected:
+        voice.load()
+        if voice.store_path != None:
+            voice.load_store()
+    get_jieba().initialize()
+
+def sentence_pool(jobs=1, processes=False):
+    """
+    Description: Worker pool rendering the sentences of an input concurrently
+
+    Input : The number of workers and whether to use processes instead of threads
+    Output: An executor, or None for serial rendering (jobs <= 1)
+    NOTE  : Worker processes are forked after the voices are loaded, so they share the pages of the
+            lexicon and unit store with the parent instead of loading their own copy
+    """
+    if jobs <= 1:
+        return None
+    if processes:
+        from concurrent.futures import ProcessPoolExecutor
+        import shared_audio
+        preload_voices()
+        shared_audio.prepare()
+        return ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(args,))
+    return ThreadPoolExecutor(max_workers=jobs)
+
+def render_sentences(phrase, rate=simpleaudio.RATE, timing=None, executor=None):
+    """
+    Description: Split the input into sentences, render them concurrently and stitch them in order
+
+    Input : The phrase (options are taken from the command line), the output sample rate, optionally an
+            Alignment that the char / token offsets of the output are appended to, and the sentence pool
+            (see sentence_pool(), None renders the whole phrase at once)
+    Output: A float32 numpy array (working format, full scale 1.0)
+    """
+    sentences = split_sentences(phrase)
+    # Select the language once so every sentence uses the same voice
+    language = input_language(phrase)
+    if executor is None or len(sentences) <= 1:
+        return render_mixed(phrase, rate=rate, timing=timing, language=language)
+    # Sentence boundaries get the same 10 msc crossfade as the units inside a sentence
+    overlap = 320 if args.crossfade else 0
+    from concurrent.futures import ProcessPoolExecutor
+    if not isinstance(executor, ProcessPoolExecutor):
+        results = list(executor.map(functools.partial(render_sentence, language=language), sentences))
+        return code_switch.stitch(results, rate, overlap=overlap, alignment=timing)
+    # Worker processes only send back a descriptor, the samples are read in place from shared memory
+    shared = []
+    try:
+        for result in shared_results(executor, sentences, language):
+            shared.append(result)
+        return code_switch.stitch([(sentence_rate, audio.data, sentence_timing) for sentence_rate, audio, sentence_timing in shared],
+                                  rate, overlap=overlap, alignment=timing)
+    finally:
+        # Stitched (or failed): every attached segment is released
+        for sentence_rate, audio, sentence_timing in shared:
+            audio.release()
+
+def shared_results(executor, sentences, language=None):
+    """
+    Description: Render sentences in worker processes and map their samples in order
+
+    Input : A ProcessPoolExecutor, a list of sentences and the language of the input
+    Output: Yields (rate, shared_audio.SharedAudio, alignment) for every sentence, the caller releases them
+    NOTE  : After an error (or if the caller stops early) the samples the other workers exported are released here
+    """
+    import shared_audio
+    futures = [executor.submit(render_sentence_shared, sentence, language) for sentence in sentences]
+    index = -1
+    try:
+        for index, future in enumerate(futures):
+            sentence_rate, descriptor, sentence_timing = future.result()
+            yield sentence_rate, shared_audio.attach(descriptor), sentence_timing
+    finally:
+        for future in futures[index + 1:]:
+            if future.cancel():
+                continue
+            try:
+                sentence_rate, descriptor, sentence_timing = future.result()
+            except Exception:
+                continue
+            shared_audio.attach(descriptor).release()
+
+def render_each(sentences, executor=None, language=None):
+    """
+    Description: Render sentences one by one, in the sentence pool if there is one
+
+    Input : A list of sentences (options are taken from the command line), the sentence pool (see sentence_pool())
+            and the language of the input (see input_language())
+    Output: Yields (rate, float32 samples, alignment) for every sentence in order
+    """
+    if executor is None:
+        for sentence in sentences:
+            yield render_sentence(sentence, language)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+    if not isinstance(executor, ProcessPoolExecutor):
+        for result in executor.map(functools.partial(render_sentence, language=language), sentences):
+            yield result
+        return
+    # Worker processes hand back the samples in shared memory, released once the caller has used them
+    results = shared_results(executor, sentences, language)
+    try:
+        for sentence_rate, audio, sentence_timing in results:
+            try:
+                yield sentence_rate, audio.data, sentence_timing
+            finally:
+                audio.release()
+    finally:
+        results.close()
+
+def document_options(language=None):
+    """The options that change the audio of a sentence (part of its key in document mode), with the language of the input"""
+    return {"language": language, "voice": args.voice, "voices": os.path.abspath(args.voices),
+            "crossfade": args.crossfade, "intonation": args.intonation, "speed": args.speed, "sandhi": args.sandhi}
+
+def render_document(text, rate=simpleaudio.RATE, timing=None, executor=None):
+    """
+    Description: Document mode, render only the sentences that are not in the --document folder and splice the output
+
+    Input : The text (options are taken from the command line), the output sample rate, optionally an Alignment
+            that the char / token offsets of the output are appended to, and the sentence pool
+    Output: A float32 numpy array (working format, full scale 1.0)
+    """
+    import document
+    sentences = split_sentences(text)
+    cache = document.SentenceCache(args.document)
+    # Sentence boundaries get the same 10 msc crossfade as the units inside a sentence
+    overlap = 320 if args.crossfade else 0
+    # Select the language once so every sentence uses the same voice (and is keyed with it)
+    language = input_language(text)
+    render = functools.partial(render_each, executor=executor, language=language)
+    output, rendered, spans = document.render_document(sentences, render, document_options(language), cache, rate,
+                                                       overlap=overlap, timing=timing)
+    changed = ", ".join("{:.2f}-{:.2f} s".format(start / float(rate), end / float(rate)) for start, end in spans)
+    log("Document: {} of {} sentences rendered{}".format(rendered, len(sentences), " (changed: " + changed + ")" if changed else ""))
+    return output
+
+def render_block(block, executor=None):
+    """Long-form renderer: without -l the language is selected from the first block and kept for the whole text"""
+    if args.language == None and args.voice == None:
+        args.language = check_lang(block)
+        log("Language selected from the first paragraph:", args.language)
+    return render_sentences(block, executor=executor)
+
+def main_longform():
+    """
+    Description: Long-form mode, synthesize --infile paragraph by paragraph straight into --outfile
+    NOTE  : --effects and -v are streamed in front of the encoder (constant latency and memory)
+    """
+    if args.outfile == None:
+        print("*** ERROR: Long-form mode (--infile) needs an output file (-o <filename>).", file=sys.stderr)
+        exit()
+    if args.play:
+        print("*** WARNING: Playing is not supported in long-form mode, the output is only saved.", file=sys.stderr)
+    import longform, effects
+    chain = volume_chain(args.volume, simpleaudio.RATE)
+
+    stream = longform.open_text(args.infile)
+    executor = sentence_pool(args.jobs, args.processes)
+    render = functools.partial(render_block, executor=executor)
+    writer = encoders.open_encoder(args.format, args.outfile, simpleaudio.RATE)
+    # Streamed through the chains in front of the encoder: the volume control, then the effects before it
+    if chain != None:
+        writer = effects.EffectWriter(chain, writer)
+    if args.effects != None:
+        writer = effects.EffectWriter(effects.parse_chain(args.effects, simpleaudio.RATE), writer)
+    with writer:
+        blocks, samples = longform.synthesize_stream(stream, render, writer, args.max_memory*2**20)
+    if executor != None:
+        executor.shutdown()
+    if args.outfile == "-":
+        return
+    print("It is saved as:", args.outfile, "({} blocks, {:.1f} s)".format(blocks, samples / float(simpleaudio.RATE)))
+
+# Main module
+def main():
+    # Long-form input from a file or stdin (streamed, unless the sentences are kept for the next run)
+    if args.infile != None and args.document == None:
+        return main_longform()
+
+    # Step 1 - Get input utterance sequence
+    inputseq = args.phrase
+    if args.infile != None:
+        import longform
+        inputseq = longform.open_text(args.infile).read()
+
+    # Step 2 to 4 - Split the input into sentences and Chinese / English runs, render them concurrently and stitch them in order
+    # Float32 working format up to the output, converted (dithered) once when it is saved or played
+    output = simpleaudio.Audio(format=simpleaudio.paFloat32)
+    timing = alignment.Alignment(output.rate, {"crossfade": args.crossfade, "intonation": args.intonation,
+                                               "speed": args.speed, "volume": args.volume, "loudness": args.loudness,
+                                               "format": args.format})
+    executor = sentence_pool(args.jobs, args.processes)
+    if args.document != None:
+        output.data = render_document(inputseq, rate=output.rate, timing=timing, executor=executor)
+    else:
+        output.data = render_sentences(inputseq, rate=output.rate, timing=timing, executor=executor)
+    if executor != None:
+        executor.shutdown()
     
-    # Step 5 - Further adjustment on overall volume to the final output (if the user use -v <0-100>)
+    # Step 5 - Effects chain (if the user use --effects) and further adjustment on overall volume to the final output (if the user use -v <0-100>)
+    output = apply_effects(effects_spec=args.effects, object=output)
     output = adjust_volume(volume=args.volume, object=output)
 
     # Step 6 - Save it to the target file (if the user use -o <args.outfile>)
-    save(output_file=args.outfile, object=output)
+    rate = save(output_file=args.outfile, object=output, format=args.format)
 
-    save_pickle(output_file=args.outfile, object=output)
+    # Char / token timing next to the audio (<outfile>.align.json)
+    save_alignment(output_file=args.outfile, timing=timing, rate=rate)
         
     # Step 7 - Play the final sound output (if the user use -p)
     play_audio(play=args.play, object=output)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_arguments()
+    main()
+    save_metrics(metrics_file=args.metrics)
\ No newline at end of file
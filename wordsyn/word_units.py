@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Description: Pre-joined multi-syllable units for the most frequent words of a voice (voice build step).
+
+The top-N words are rendered once from the syllable units of the voice, joined with the same 10 msc linear
+crossfade as word_syn.concatenate -c, and stored in the voice folder:
+    words.npy  : int16 samples of all word units, one after the other (memory-mapped at runtime)
+    words.json : sample rate, and for every word unit (keyed by its syllables) its [start, end], the
+                 [start, end] of every syllable inside it (for the char timing of the alignment) and its word
+The voice.json manifest points to them with "words": "words". A word unit is keyed by its syllables after
+the tone sandhi rules (e.g. "ni2 hao3"), so at runtime a jieba token whose chars read exactly these
+syllables is served by one unit: one slice instead of a read and a join per syllable. The units are joined
+with the crossfade of -c, so they are only used for a crossfaded output (without -c every syllable keeps
+its own unit and the gaps between them).
+
+Word frequencies come from a list (--words, word<TAB>count per line, e.g. counted from the traffic logs), or
+from the dictionary of jieba, the segmenter whose tokens are matched at runtime (converted to traditional
+chars for Cantonese if OpenCC is installed). Words of 2 to 4 chars that the lexicon covers are kept.
+
+Usage:
+    python3 word_units.py --voices . --top 2000
+    python3 word_units.py --voice jyutping-wong --words cantonese_words.tsv --top 5000
+"""
+
+import os
+import json
+import argparse
+
+import numpy as np
+
+import sandhi
+import simpleaudio
+from unit_index import write_atomic
+
+# Bump when the layout of words.json changes
+WORDS_VERSION = 1
+WORDS_PREFIX = "words"
+# Crossfade between the syllables of a word, same as word_syn.concatenate -c (10 msc)
+OVERLAP = 320
+# Longest word kept (chars)
+MAX_WORD = 4
+
+
+def word_key(syllables):
+    """Key of a word unit: its syllables, e.g. "ni2 hao3" """
+    return " ".join(syllables)
+
+
+class WordInventory:
+    """
+    Description: Read-only pre-joined word units of one voice
+    """
+
+    def __init__(self, prefix):
+        with open(prefix + ".json", "r") as f:
+            info = json.loads(f.read())
+        self.rate = info["rate"]
+        # key -> [start, end, [[start, end] of every syllable], word]
+        self.words = info["words"]
+        # Memory-mapped: only the pages of the words in use become resident
+        self.data = np.load(prefix + ".npy", mmap_mode="r")
+
+    def get(self, syllables):
+        """The key of the word unit reading these syllables, None if there is none"""
+        key = word_key(syllables)
+        return key if key in self.words else None
+
+    def unit(self, key):
+        """int16 samples of a word unit (a read-only view) and the [start, end] of its syllables"""
+        start, end, bounds = self.words[key][:3]
+        return self.data[start:end], bounds
+
+    def __contains__(self, key):
+        return key in self.words
+
+    def __len__(self):
+        return len(self.words)
+
+
+def join_units(units, overlap=OVERLAP):
+    """
+    Description: Join units with a linear crossfade (as word_syn.concatenate -c)
+
+    Input : A list of float32 arrays and the crossfade length
+    Output: The joined float32 array and the [start, end] of every unit in it
+    """
+    fade_in = np.arange(overlap, dtype=np.float32) / overlap
+    fade_out = fade_in[::-1]
+    output = np.zeros(sum(len(unit) for unit in units), dtype=np.float32)
+    bounds = []
+    position = 0
+    for index, unit in enumerate(units):
+        unit = simpleaudio.to_float32(unit, copy=True)
+        start = position - overlap if index > 0 and len(unit) >= overlap and position >= overlap else position
+        if start < position:
+            output[start:position] *= fade_out
+            unit[:overlap] *= fade_in
+            output[start:position] += unit[:overlap]
+            output[position:position + len(unit) - overlap] = unit[overlap:]
+        else:
+            output[start:start + len(unit)] = unit
+        bounds.append([start, start + len(unit)])
+        position = start + len(unit)
+    return output[:position], bounds
+
+
+def word_frequencies(language, words_file=None):
+    """
+    Description: Word frequencies from a list, or from the jieba dictionary
+
+    Input : The language (c or p) and optionally a list (word, or word<TAB>count per line, in order of frequency)
+    Output: A dict word -> count
+    """
+    frequencies = dict([])
+    if words_file != None:
+        with open(words_file, "r", encoding="utf-8") as f:
+            lines = [line.rstrip("\n").split("\t") for line in f if line.strip() and not line.startswith("#")]
+        for rank, fields in enumerate(lines):
+            # Without counts the order of the list is the rank
+            count = float(fields[1]) if len(fields) > 1 else float(len(lines) - rank)
+            frequencies[fields[0].strip()] = frequencies.get(fields[0].strip(), 0.0) + count
+        return frequencies
+    # New user please install: pip install jieba
+    import jieba
+    with jieba.get_dict_file() as f:
+        for line in f:
+            fields = line.decode("utf-8").split()
+            if len(fields) >= 2:
+                frequencies[fields[0]] = float(fields[1])
+    if language == "c":
+        try:
+            from opencc import OpenCC
+        except ImportError:
+            return frequencies
+        # Convert all words in one call, one per line so no conversion spans two words
+        words = list(frequencies)
+        converted = OpenCC("s2t").convert("\n".join(words)).split("\n")
+        if len(converted) == len(words):
+            traditional = dict([])
+            for word, other in zip(words, converted):
+                traditional[other] = traditional.get(other, 0.0) + frequencies[word]
+            frequencies = traditional
+    return frequencies
+
+
+def rank_words(frequencies, lexicon, top, max_length=MAX_WORD):
+    """The top words of 2 to max_length chars that the lexicon covers, most frequent first"""
+    candidates = [word for word in frequencies
+                  if 2 <= len(word) <= max_length and all(char in lexicon and lexicon[char] for char in word)]
+    return sorted(candidates, key=lambda word: (-frequencies[word], word))[:top]
+
+
+def word_syllables(word, voice):
+    """The syllables of a word as the frontend reads them (first reading of every char, then the sandhi rules)"""
+    syllables = [voice.lexicon[char][0] for char in word]
+    for position, syllable in sandhi.apply(word, voice.language, voice.lexicon, voice.syllables).items():
+        syllables[position] = syllable
+    return syllables
+
+
+def build_words(voice, words, prefix):
+    """
+    Description: Render the word units of a voice
+
+    Input : A voices.Voice, its words (most frequent first) and the output prefix (without .npy/.json)
+    Output: The number of word units and the size of their samples in bytes
+    """
+    entries, pieces = dict([]), []
+    position = 0
+    for word in words:
+        syllables = word_syllables(word, voice)
+        key = word_key(syllables)
+        # Words that read the same share a unit, words with a syllable the voice plays as silence get none
+        if key in entries or any(voice.unit_name(syllable) == "" for syllable in syllables):
+            continue
+        data, bounds = join_units([voice.unit(syllable) for syllable in syllables])
+        # Joined from int16 units with linear fades: rounded, not dithered (the output is dithered once)
+        pieces.append(simpleaudio.to_int16(data, dither=False))
+        entries[key] = [position, position + len(data), bounds, word]
+        position += len(data)
+    data = np.concatenate(pieces) if pieces else np.zeros(0, dtype=np.int16)
+    # Temp file + rename (like write_atomic): a concurrent reader maps the old or the new samples, never half a file
+    tmp = "{}.npy.{}.tmp".format(prefix, os.getpid())
+    with open(tmp, "wb") as f:
+        np.save(f, data)
+    os.replace(tmp, prefix + ".npy")
+    write_atomic(prefix + ".json", json.dumps({"version": WORDS_VERSION, "rate": voice.rate, "words": entries}))
+    return len(entries), data.nbytes
+
+
+def build_voice(manifest, top, words_file=None):
+    """Build the word units of a voice pack and point its manifest to them"""
+    import voices
+    voice = voices.Voice.from_manifest(manifest)
+    voice.load()
+    words = rank_words(word_frequencies(voice.language, words_file), voice.lexicon, top)
+    count, nbytes = build_words(voice, words, os.path.join(os.path.dirname(manifest), WORDS_PREFIX))
+    with open(manifest, "r") as f:
+        info = json.loads(f.read())
+    info["words"] = WORDS_PREFIX
+    write_atomic(manifest, json.dumps(info))
+    return voice.name, count, nbytes
+
+
+if __name__ == "__main__":
+    import glob
+    import voices
+    parser = argparse.ArgumentParser(description='Pre-render the most frequent words of the voice packs as joined units.')
+    parser.add_argument('--voices', default=".", help="Folder containing voice packs (*/voice.json)")
+    parser.add_argument('--voice', default=None, help="Only build this voice")
+    parser.add_argument('--top', default=2000, type=int, help="Number of words per voice")
+    parser.add_argument('--words', default=None,
+                        help="Word list (word<TAB>count per line) instead of the jieba dictionary frequencies")
+    args = parser.parse_args()
+    for manifest in sorted(glob.glob(os.path.join(args.voices, "*", voices.MANIFEST))):
+        with open(manifest, "r") as f:
+            name = json.loads(f.read())["name"]
+        if args.voice not in (None, name):
+            continue
+        name, count, nbytes = build_voice(manifest, args.top, args.words)
+        print("{}: {} word units, {:.1f} MB".format(name, count, nbytes / 2**20))